@@ -1,23 +1,44 @@
-import base64
-import hmac
-import json
-import os
+import importlib
 import queue
 import threading
 import time
 import tkinter as tk
 import traceback
+from concurrent.futures import Future
 from datetime import datetime
 from tkinter import scrolledtext, ttk, font
-from typing import Optional
-from urllib.parse import urlencode
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import urlparse
 
-import requests
-from eth_account import Account
-from web3 import Web3
+from swap_config import FEE_URGENCY_LEVELS, JsonlLogWriter, config_store
+
+if TYPE_CHECKING:
+    from okx_dex import OKXDexSwap
+
+# 进程启动时间，用于统计界面显示耗时
+STARTED_AT = time.perf_counter()
+
+# 交易核心(okx_dex)依赖web3/eth_account/aiohttp，导入需要1秒左右，界面显示后再在后台导入
+okx_dex = None
+
+
+def load_core():
+    """导入交易核心模块，只在第一次调用时真正导入，多个线程同时调用时由导入锁等待同一次导入"""
+    global okx_dex
+    if okx_dex is None:
+        okx_dex = importlib.import_module("okx_dex")
+    return okx_dex
 
 
 class ConfigApp:
+    # 日志框最多保留的行数，超出后删除最早的行
+    LOG_MAX_LINES = 2000
+    # 每次刷新最多写入日志框的消息数，剩余的下一帧继续
+    LOG_BATCH_MAX = 200
+    # 日志刷新间隔（毫秒），有积压时缩短
+    LOG_INTERVAL_MS = 100
+    LOG_BACKLOG_INTERVAL_MS = 10
+
     def __init__(self, root):
         self.log_text = None
         self.is_selling = None
@@ -46,6 +67,32 @@ class ConfigApp:
         # 初始化entries列表
         self.entries = []
 
+        # 内存中的配置，修改后由后台合并写盘
+        self.config = config_store
+        # 后台保存配置失败时输出到日志窗口
+        self.config.log = self.log
+
+        # 报价预取器，交易核心导入后创建
+        self.prefetcher = None
+        # 定期更新预取目标的root.after回调ID，同一时间只保留一个
+        self._prefetch_after_id = None
+        self._core_lock = threading.Lock()
+
+        # 复用同一个OKXDexSwap客户端，保持预热好的HTTP连接
+        self._dex = None
+        self._dex_key = None
+
+        # 批量模式的并发钱包数
+        self.batch_workers = 8
+
+        # RPC健康监控，自动选择同一条链上最快的健康RPC，交易核心导入后设置
+        self.rpc_monitor = None
+        self.rpc_auto_select = True
+
+        # 交易费用模式：legacy或eip1559，紧急程度：slow/normal/fast
+        self.fee_mode = "legacy"
+        self.fee_urgency = "normal"
+
         # 创建主框架
         main_frame = tk.Frame(root, bg="#f0f0f0", padx=20, pady=10)
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -91,6 +138,8 @@ class ConfigApp:
 
         # 创建一个队列用于线程间通信 - 移到这里，在使用log方法之前
         self.log_queue = queue.Queue()
+        # 完整日志在后台写入滚动的JSONL文件，日志框只保留最近的行
+        self.log_writer = JsonlLogWriter()
 
         # 尝试加载现有配置
         self.load_config()
@@ -101,6 +150,9 @@ class ConfigApp:
         # 启动一个定时器来处理日志队列
         self.root.after(100, self.process_log_queue)
 
+        # 界面显示后再在后台导入交易核心并预热连接
+        self.root.after_idle(self._start_warm_up)
+
     def center_window(self):
         """将窗口居中显示在屏幕上"""
         # 更新窗口信息，确保获取正确的尺寸
@@ -240,6 +292,38 @@ class ConfigApp:
         )
         self.sell_button.pack(side=tk.LEFT, padx=5)
 
+        # 后台预取报价开关
+        prefetch_frame = tk.Frame(action_frame_container)
+        prefetch_frame.pack(fill=tk.X)
+
+        self.prefetch_var = tk.BooleanVar(value=False)
+        prefetch_check = ttk.Checkbutton(
+            prefetch_frame,
+            text="后台预取报价（点击买入/卖出时直接使用未过期的报价）",
+            variable=self.prefetch_var,
+            command=self.toggle_prefetch
+        )
+        prefetch_check.pack(side=tk.LEFT, padx=(75, 5))
+
+        # 多钱包批量模式开关
+        self.batch_var = tk.BooleanVar(value=False)
+        batch_check = ttk.Checkbutton(
+            prefetch_frame,
+            text="多钱包批量交易",
+            variable=self.batch_var
+        )
+        batch_check.pack(side=tk.LEFT, padx=(20, 5))
+
+        # 批量清仓按钮
+        self.sell_many_button = ttk.Button(
+            prefetch_frame,
+            text="批量清仓",
+            command=self.sell_many,
+            width=20,
+            style="Accent.TButton"
+        )
+        self.sell_many_button.pack(side=tk.RIGHT, padx=5)
+
         # 添加操作状态标志
         self.is_buying = False
         self.is_selling = False
@@ -334,7 +418,16 @@ class ConfigApp:
             width=15,
             style="Accent.TButton"
         )
-        self.adv_save_button.pack(pady=5)
+        self.adv_save_button.pack(side=tk.LEFT, padx=(280, 40), pady=5)
+
+        self.clear_allowance_button = ttk.Button(
+            adv_button_frame,
+            text="清除授权缓存",
+            command=self.clear_allowance_cache,
+            width=15,
+            style="Accent.TButton"
+        )
+        self.clear_allowance_button.pack(side=tk.LEFT, padx=0, pady=5)
 
         # 创建独立的RPC信息框架
         rpc_input_frame = tk.LabelFrame(self.advanced_config_tab, text="添加RPC信息", font=self.label_font, padx=15, pady=10)
@@ -392,6 +485,35 @@ class ConfigApp:
         )
         self.update_rpc_list_button.pack(side=tk.LEFT, padx=0, pady=5)
 
+        # 创建批量交易钱包框架
+        wallet_input_frame = tk.LabelFrame(self.advanced_config_tab, text="添加批量交易钱包", font=self.label_font, padx=15, pady=10)
+        wallet_input_frame.pack(fill=tk.X, padx=5, pady=5)
+
+        # 钱包名称、私钥和添加按钮在一行
+        wallet_row = tk.Frame(wallet_input_frame)
+        wallet_row.pack(fill=tk.X, pady=3)
+
+        wallet_name_label = tk.Label(wallet_row, text="钱包名称:", font=self.label_font, width=10, anchor="e")
+        wallet_name_label.pack(side=tk.LEFT, padx=(5, 2))
+
+        self.wallet_name_entry = ttk.Entry(wallet_row, width=12, font=self.label_font)
+        self.wallet_name_entry.pack(side=tk.LEFT, padx=(0, 10))
+
+        wallet_key_label = tk.Label(wallet_row, text="私钥:", font=self.label_font, width=6, anchor="e")
+        wallet_key_label.pack(side=tk.LEFT, padx=(5, 2))
+
+        self.wallet_key_entry = ttk.Entry(wallet_row, width=30, font=self.label_font)
+        self.wallet_key_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
+
+        self.add_wallet_button = ttk.Button(
+            wallet_row,
+            text="添加钱包",
+            command=self.add_wallet_info,
+            width=12,
+            style="Accent.TButton"
+        )
+        self.add_wallet_button.pack(side=tk.LEFT, padx=5)
+
         # 添加高级设置说明
         info_frame = tk.LabelFrame(self.advanced_config_tab, text="参数说明", font=self.label_font, padx=15, pady=15)
         info_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -411,6 +533,7 @@ class ConfigApp:
         info_text.insert(tk.END, "\n\nAPI Key / API Secret / Passphrase\n\n以上三个在这里申请 > https://www.okx.com/zh-hans-sg/web3/build/dev-portal ")
         info_text.insert(tk.END, "\n\n\nPrivate Key: 自己账号的私钥。")
         info_text.insert(tk.END, "\n\n\nRPC / 链ID: 添加新的RPC信息到基本配置中。")
+        info_text.insert(tk.END, "\n\n\n批量交易钱包: 勾选交易页面的\"多钱包批量交易\"后，买入/卖出会在所有已添加的钱包上同时执行。")
         info_text.config(state=tk.DISABLED)  # 设置为只读
 
     def add_rpc_info(self):
@@ -437,20 +560,13 @@ class ConfigApp:
 
         # 保存RPC信息到config.json
         try:
-            # 读取现有配置
-            config_data = {}
-            if os.path.exists("config.json"):
-                with open("config.json", "r") as f:
-                    config_data = json.load(f)
-
-            # 添加或更新RPC信息
+            # 添加或更新RPC信息，后台写盘
             rpc_key = f"RPC/{rpc_name}"
             rpc_value = f"{rpc}?{chain_id}"
-            config_data[rpc_key] = rpc_value
+            self.config.set(rpc_key, rpc_value)
 
-            # 保存回文件
-            with open("config.json", "w") as f:
-                json.dump(config_data, f, indent=4)
+            # 新RPC加入健康探测
+            self._refresh_rpc_monitor()
 
             # 显示成功消息
             self.log(f"RPC信息 '{rpc_name}' 已成功添加到配置文件")
@@ -464,88 +580,160 @@ class ConfigApp:
             error_msg = f"保存RPC信息失败: {str(e)}"
             self.log(error_msg)
 
+    def add_wallet_info(self):
+        """将批量交易钱包保存到config.json
+
+        导入eth_account和校验私钥在后台线程完成，结果通过root.after回到Tk线程，
+        避免交易核心尚未预热完成时卡住界面。
+        """
+        wallet_name = self.wallet_name_entry.get()
+        private_key = self.wallet_key_entry.get()
+
+        if not wallet_name or not private_key:
+            return
+
+        self.add_wallet_button.config(state=tk.DISABLED)
+        threading.Thread(
+            target=self._validate_wallet_thread, args=(wallet_name, private_key), daemon=True
+        ).start()
+
+    def _validate_wallet_thread(self, wallet_name, private_key):
+        """后台线程中校验私钥格式"""
+        try:
+            from eth_account import Account
+            Account.from_key(private_key)
+            error = None
+        except Exception as e:
+            error = str(e)
+        self.root.after(0, self._finish_add_wallet, wallet_name, private_key, error)
+
+    def _finish_add_wallet(self, wallet_name, private_key, error):
+        """在Tk线程中保存校验通过的钱包"""
+        self.add_wallet_button.config(state=tk.NORMAL)
+        if error is not None:
+            self.log(f"钱包私钥格式错误: {error}", "error")
+            return
+
+        self.wallet_name_entry.delete(0, tk.END)
+        self.wallet_key_entry.delete(0, tk.END)
+
+        try:
+            self.config.set(f"Wallet/{wallet_name}", private_key)
+
+            self.log(f"钱包 '{wallet_name}' 已成功添加到配置文件")
+
+            self.add_wallet_button.config(text="添加成功")
+            self.root.after(500, lambda: self.add_wallet_button.config(text="添加钱包"))
+        except Exception as e:
+            self.log(f"保存钱包失败: {str(e)}")
+
     def _reset_add_rpc_button_text(self):
         """恢复添加RPC信息按钮的文本"""
         self.add_rpc_button.config(text="添加RPC信息")
 
     def process_log_queue(self):
-        """处理日志队列中的消息"""
+        """处理日志队列中的消息，每次最多取LOG_BATCH_MAX条合并成一次插入"""
+        batch = []
         try:
-            # 尝试从队列中获取所有消息
-            while True:
-                message = self.log_queue.get_nowait()
-                self._log_direct(message)
+            while len(batch) < self.LOG_BATCH_MAX:
+                batch.append(self.log_queue.get_nowait())
                 self.log_queue.task_done()
         except queue.Empty:
             pass
         finally:
-            # 无论如何，继续定时检查队列
-            self.root.after(100, self.process_log_queue)
+            if batch:
+                self._log_direct(batch)
+            # 无论如何，继续定时检查队列；还有积压时尽快处理下一批
+            delay = self.LOG_BACKLOG_INTERVAL_MS if not self.log_queue.empty() else self.LOG_INTERVAL_MS
+            self.root.after(delay, self.process_log_queue)
 
     def log(self, message, level="info"):
         """向日志队列添加消息，可以指定级别（info, success, warning, error, highlight）"""
-        # 将消息和级别放入队列
-        self.log_queue.put((message, level))
-
-    def _log_direct(self, message_data):
-        """直接更新日志UI（仅在主线程中调用）"""
+        # 时间戳在产生日志时记录，不受界面刷新延迟影响
+        timestamp = time.time()
+        self.log_queue.put((timestamp, message, level))
+        self.log_writer.write(timestamp, message, level)
+
+    @staticmethod
+    def _format_log_entry(message_data) -> tuple:
+        """把队列中的消息转换为 (文本, 标签)"""
         # 如果消息为特殊标记"EMPTY_LINE"，则添加一个完全空白的行
         if message_data == "EMPTY_LINE":
-            self.log_text.config(state=tk.NORMAL)  # 临时允许编辑
-            self.log_text.insert(tk.END, "\n")
-            self.log_text.see(tk.END)  # 滚动到最新内容
-            self.log_text.config(state=tk.DISABLED)  # 恢复只读状态
-            return
+            return "\n", ()
 
-        # 解包消息和级别
-        if isinstance(message_data, tuple) and len(message_data) == 2:
-            message, level = message_data
+        # 解包时间、消息和级别
+        if isinstance(message_data, tuple) and len(message_data) == 3:
+            timestamp, message, level = message_data
         else:
-            message, level = message_data, "info"  # 默认为info级别
+            timestamp, message, level = time.time(), message_data, "info"  # 默认为info级别
 
         # 正常消息添加时间戳
-        current_time = datetime.now().strftime("%H:%M:%S")
-        log_message = f"[{current_time}] {message}"
+        current_time = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+        return f"[{current_time}] {message}\n", level  # 使用对应的标签
+
+    def _log_direct(self, batch: list):
+        """把一批消息一次性写入日志UI（仅在主线程中调用）"""
+        args = []
+        for message_data in batch:
+            args.extend(self._format_log_entry(message_data))
 
         self.log_text.config(state=tk.NORMAL)  # 临时允许编辑
-        self.log_text.insert(tk.END, log_message + "\n", level)  # 使用对应的标签
+        self.log_text.insert(tk.END, *args)
+        # 超出最大行数时删除最早的行
+        line_count = int(self.log_text.index("end-1c").split(".")[0])
+        if line_count > self.LOG_MAX_LINES:
+            self.log_text.delete("1.0", f"{line_count - self.LOG_MAX_LINES + 1}.0")
         self.log_text.see(tk.END)  # 滚动到最新内容
         self.log_text.config(state=tk.DISABLED)  # 恢复只读状态
 
     def load_config(self):
         """尝试加载现有的config.json文件"""
         try:
-            if os.path.exists("config.json"):
-                with open("config.json", "r") as f:
-                    config_data = json.load(f)
-
-                # 将读取的数据填充到基本配置输入框
-                if "rpc" in config_data:
-                    self.entries[0].insert(0, config_data["rpc"])
-                if "slippage" in config_data:
-                    self.entries[1].insert(0, config_data["slippage"])
-                if "chain_id" in config_data:
-                    self.entries[2].insert(0, config_data["chain_id"])
-                if "buy_amount" in config_data:
-                    self.entries[3].insert(0, config_data["buy_amount"])
-                if "sell_ratio" in config_data:
-                    self.entries[4].insert(0, config_data["sell_ratio"])
-                if "ca" in config_data:
-                    self.ca_entry.insert(0, config_data["ca"])
-
-                # 将读取的数据填充到高级配置输入框
-                if "api_key" in config_data:
-                    self.adv_entries[0].insert(0, config_data["api_key"])
-                if "api_secret" in config_data:
-                    self.adv_entries[1].insert(0, config_data["api_secret"])
-                if "passphrase" in config_data:
-                    self.adv_entries[2].insert(0, config_data["passphrase"])
-                if "private_key" in config_data:
-                    self.adv_entries[3].insert(0, config_data["private_key"])
+            config_data = self.config.load()
+
+            # 将读取的数据填充到基本配置输入框
+            if "rpc" in config_data:
+                self.entries[0].insert(0, config_data["rpc"])
+            if "slippage" in config_data:
+                self.entries[1].insert(0, config_data["slippage"])
+            if "chain_id" in config_data:
+                self.entries[2].insert(0, config_data["chain_id"])
+            if "buy_amount" in config_data:
+                self.entries[3].insert(0, config_data["buy_amount"])
+            if "sell_ratio" in config_data:
+                self.entries[4].insert(0, config_data["sell_ratio"])
+            if "ca" in config_data:
+                self.ca_entry.insert(0, config_data["ca"])
+
+            # 将读取的数据填充到高级配置输入框
+            if "api_key" in config_data:
+                self.adv_entries[0].insert(0, config_data["api_key"])
+            if "api_secret" in config_data:
+                self.adv_entries[1].insert(0, config_data["api_secret"])
+            if "passphrase" in config_data:
+                self.adv_entries[2].insert(0, config_data["passphrase"])
+            if "private_key" in config_data:
+                self.adv_entries[3].insert(0, config_data["private_key"])
+            if "rpc_auto_select" in config_data:
+                self.rpc_auto_select = bool(config_data["rpc_auto_select"])
+            if "batch_workers" in config_data:
+                self.batch_workers = int(config_data["batch_workers"])
+            if config_data.get("fee_mode") in ("legacy", "eip1559"):
+                self.fee_mode = config_data["fee_mode"]
+            if config_data.get("fee_urgency") in FEE_URGENCY_LEVELS:
+                self.fee_urgency = config_data["fee_urgency"]
+            if config_data.get("batch_mode"):
+                self.batch_var.set(True)
+            if config_data.get("prefetch_quotes"):
+                self.prefetch_var.set(True)
+                self.toggle_prefetch()
 
             # 加载RPC链选项到下拉框
             self.load_rpc_chains(config_data)
 
+            # 开始后台探测所有RPC
+            self._refresh_rpc_monitor()
+
             self.log("成功加载配置文件")
         except Exception as e:
             # 如果读取失败，不做任何操作，输入框保持为空
@@ -590,21 +778,12 @@ class ConfigApp:
 
         if selected_chain and selected_chain != default_text:
             try:
-                # 读取配置文件
-                if os.path.exists("config.json"):
-                    with open("config.json", "r") as f:
-                        config_data = json.load(f)
-
-                # 获取选中链的RPC信息
-                rpc_key = f"RPC/{selected_chain}"
-                if rpc_key in config_data:
-                    rpc_value = config_data[rpc_key]
-                    # 解析RPC值，格式为"rpc/chain_id"
-                    rpc_parts = rpc_value.split('?')
-                    # print(rpc_parts)
-                    if len(rpc_parts) >= 2:
-                        rpc = rpc_parts[0]
-                        chain_id = rpc_parts[1]
+                # 获取选中链的RPC信息（已解析的"rpc?chain_id"）
+                rpc_entries = self.config.rpc_entries()
+                rpc_value = self.config.get(f"RPC/{selected_chain}")
+                if rpc_value is not None:
+                    if selected_chain in rpc_entries:
+                        rpc, chain_id = rpc_entries[selected_chain]
 
                         # 打印调试信息到日志
                         self.log(f"已加载 {selected_chain} 的RPC信息")
@@ -616,13 +795,8 @@ class ConfigApp:
                         self.entries[2].delete(0, tk.END)
                         self.entries[2].insert(0, chain_id)
 
-                        # 更新config_data中的rpc和chain_id值
-                        config_data["rpc"] = rpc
-                        config_data["chain_id"] = chain_id
-
-                        # 保存更新后的配置
-                        with open("config.json", "w") as f:
-                            json.dump(config_data, f, indent=4)
+                        # 更新配置中的rpc和chain_id值，后台写盘
+                        self.config.update({"rpc": rpc, "chain_id": chain_id})
 
                         # self.log(f"已加载 {selected_chain} 的RPC信息")
                     else:
@@ -647,6 +821,12 @@ class ConfigApp:
             "api_secret": self.adv_entries[1].get(),
             "passphrase": self.adv_entries[2].get(),
             "private_key": self.adv_entries[3].get(),
+            "prefetch_quotes": self.prefetch_var.get(),
+            "batch_mode": self.batch_var.get(),
+            "batch_workers": self.batch_workers,
+            "rpc_auto_select": self.rpc_auto_select,
+            "fee_mode": self.fee_mode,
+            "fee_urgency": self.fee_urgency,
         }
 
         # 检查当前选择的链
@@ -655,22 +835,16 @@ class ConfigApp:
 
         # 保存为JSON文件
         try:
-            # 读取现有配置以保留RPC信息
-            if os.path.exists("config.json"):
-                with open("config.json", "r") as f:
-                    old_config = json.load(f)
-                    # 保留所有以RPC/开头的键
-                    for key in old_config:
-                        if key.startswith("RPC/"):
-                            config_data[key] = old_config[key]
-
             # 如果用户选择了一个有效的链（不是默认提示文本），则将其设置为默认链
             if selected_chain and selected_chain != default_text:
                 config_data["default_chain"] = selected_chain
                 self.log(f"已将 {selected_chain} 设置为默认链")
+            else:
+                self.config.pop("default_chain")
 
-            with open("config.json", "w") as f:
-                json.dump(config_data, f, indent=4)
+            # RPC/、Wallet/和跟踪的代币等其他配置项保持不变；立即写盘，确认保存成功
+            self.config.update(config_data)
+            self.config.flush()
             self.log("配置已成功保存到config.json")
         except Exception as e:
             error_msg = f"保存失败: {str(e)}"
@@ -688,6 +862,7 @@ class ConfigApp:
         # 禁用买入和卖出按钮
         self.buy_button.config(state="disabled")
         self.sell_button.config(state="disabled")
+        self.sell_many_button.config(state="disabled")
 
         # 创建一个新线程来执行买入操作
         buy_thread = threading.Thread(target=self._buy_token_thread)
@@ -734,58 +909,29 @@ class ConfigApp:
             # 调用OKX买入功能
             self.log("开始执行OKX买入操作...")
 
-            # 创建OKXDexSwap实例
-            dex = OKXDexSwap(api_key, api_secret, passphrase, private_key)
-
-            # 代币地址
-            BNB_ADDRESS = "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
-
-            # 转换买入金额为wei
-            amount_wei = str(int(float(buy_amount) * 1e18))
-
-            # 获取报价
-            self.log("买入获取报价中...")
-            quote = dex.get_quote(BNB_ADDRESS, ca, float(slippage) / 100, amount_wei, chain_id)
-
-            if quote is None:
-                self.log("获取买入报价失败")
+            # 多钱包批量模式
+            if self.batch_var.get():
+                self._run_batch("buy", api_key, api_secret, passphrase, ca, rpc, chain_id,
+                                float(slippage) / 100, buy_amount=buy_amount)
                 return
 
-            if quote.get("code") == "0":
-                # 显示预计收到的代币数量
-                expected_amount = quote["data"][0]["toTokenAmount"]
-                self.log(f"预计收到的代币 {float(expected_amount) / 1e18:.8f} {quote['data'][0]['toToken']['tokenSymbol']}")
-                self.log(f"价格影响: {quote['data'][0]['priceImpactPercentage']}%")
-                self.log(f"使用DEX: {quote['data'][0]['quoteCompareList'][0]['dexName']}")
-
-                # 执行交换
-                swap_result = dex.swap(quote["data"], float(slippage) / 100)
-                if swap_result and swap_result.get("code") == "0":
-                    # 从响应中提取交易数据
-                    tx_data = swap_result["data"][0]["tx"]
-                    self.log("买入交易数据已获取!")
-
-                    # 发送交易
-                    self.log('准备发送买入交易...')
-                    tx_result = dex.send_transaction(tx_data, rpc, chain_id)
-                    if tx_result:
-                        tx_hash = tx_result['tx_hash']
-                        receipt = tx_result['receipt']
-
-                        self.log(f"等待买入哈希确认:{tx_hash}")
-
-                        # 检查交易是否成功
-                        if receipt['status'] == 1:
-                            self.log(">> 买入交易成功! 后台进行预授权方便卖出...", "success")
-                            dex.check_and_approve(ca, rpc, chain_id, wait=False)
-                        else:
-                            self.log('[ 买入交易失败 ]', "error")
-                    else:
-                        self.log("发送买入交易失败", "error")
-                else:
-                    self.log(f"获取买入交易数据失败: {swap_result}", "error")
-            else:
-                self.log(f"获取买入报价失败: {quote}", "error")
+            # 创建OKXDexSwap实例
+            dex = self._create_dex(api_key, api_secret, passphrase, private_key)
+            self._log_selected_rpc(dex, rpc)
+
+            # 报价 -> 交换 -> 发送，优先使用未过期的预取报价
+            engine = load_core().BuyEngine(dex)
+            result = engine.run(ca, rpc, chain_id, buy_amount, float(slippage) / 100, log=self.log,
+                                quote_cache=self.prefetcher, wait=False)
+
+            if result['tx_hash']:
+                self._log_broadcast_acks(dex)
+                self.log(f"等待买入哈希确认:{result['tx_hash']}")
+
+                # 广播后立即释放按钮，收据到达时再检查交易是否成功
+                result['receipt_future'].add_done_callback(
+                    lambda future: self._on_buy_receipt(future, dex, ca, rpc, chain_id)
+                )
         except Exception as e:
             error_msg = f"买入失败: {str(e)}"
             self.log(error_msg, "error")
@@ -810,6 +956,7 @@ class ConfigApp:
         # 禁用买入和卖出按钮
         self.buy_button.config(state="disabled")
         self.sell_button.config(state="disabled")
+        self.sell_many_button.config(state="disabled")
 
         # 创建一个新线程来执行卖出操作
         sell_thread = threading.Thread(target=self._sell_token_thread)
@@ -833,22 +980,8 @@ class ConfigApp:
             private_key = self.adv_entries[3].get()
 
             # 验证卖出比例是整数且在0-100之间
-            try:
-                sell_ratio_value = float(sell_ratio)
-                # 检查是否为整数
-                if sell_ratio_value != int(sell_ratio_value):
-                    self.log("错误: 卖出比例必须是整数")
-                    return
-                # 转换为整数
-                sell_ratio_int = int(sell_ratio_value)
-                # 检查范围
-                if sell_ratio_int <= 0 or sell_ratio_int > 100:
-                    self.log("错误: 卖出比例必须大于0且小于或等于100")
-                    return
-                # 更新sell_ratio为整数值
-                sell_ratio = str(sell_ratio_int)
-            except ValueError:
-                self.log("错误: 卖出比例必须是有效的数字")
+            sell_ratio = self._validate_sell_ratio(sell_ratio)
+            if sell_ratio is None:
                 return
 
             # 检查必要参数
@@ -871,99 +1004,377 @@ class ConfigApp:
             self.log(f"滑点: {slippage}")
             self.log(f"卖出比例: {sell_ratio}%")
 
+            # 多钱包批量模式
+            if self.batch_var.get():
+                self._run_batch("sell", api_key, api_secret, passphrase, ca, rpc, chain_id,
+                                float(slippage) / 100, sell_ratio=int(sell_ratio))
+                return
+
             # 创建OKXDexSwap实例
-            dex = OKXDexSwap(api_key, api_secret, passphrase, private_key)
+            dex = self._create_dex(api_key, api_secret, passphrase, private_key)
+            self._log_selected_rpc(dex, rpc)
 
-            # 代币地址
-            BNB_ADDRESS = "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
+            # 余额、授权、gas价格和nonce并行获取
+            engine = load_core().SellEngine(dex)
+            result = engine.run(ca, rpc, chain_id, int(sell_ratio), float(slippage) / 100, log=self.log,
+                                quote_cache=self.prefetcher, wait=False)
 
-            # 获取代币余额
-            self.log("获取代币余额...")
-            token_balance = dex.get_token_balance(ca, rpc)
-            # print(token_balance)
-            # print(sell_ratio)
+            if 'critical_path_ms' in result:
+                self.log(f"关键路径耗时: {result['critical_path_ms']:.0f}ms")
 
-            if token_balance <= 100000000:
-                self.log(f"错误: 没有可用或太少的代币余额 {token_balance / 10 ** 18}", "warning")
-                return
+            if result['tx_hash']:
+                self._log_broadcast_acks(dex)
+                self.log(f"等待卖出哈希确认:{result['tx_hash']}")
 
-            self.log(f"代币余额: {float(token_balance) / 1e18:.8f}")
+                # 广播后立即释放按钮，收据到达时再检查交易是否成功
+                result['receipt_future'].add_done_callback(self._on_sell_receipt)
+        except Exception as e:
+            error_msg = f"卖出失败: {str(e)}"
+            self.log(error_msg, "error")
+            self.log(traceback.format_exc())
+        finally:
+            # 操作完成，设置卖出状态为False
+            self.is_selling = False
+            # 检查是否可以恢复按钮状态
+            self.root.after(0, self._check_and_enable_buttons)
+        # self.log("========================")
+        self.log_queue.put("EMPTY_LINE")  # 添加完全空白的行
 
-            # 计算要卖出的数量（根据百分比）
-            if int(sell_ratio) == 100:
-                sell_amount = token_balance
-            else:
-                # 否则计算百分比
-                sell_amount = int(token_balance * int(sell_ratio) / 100)
+    def toggle_prefetch(self):
+        """开启或关闭后台报价预取"""
+        if self.prefetcher is None:
+            # 交易核心导入后按勾选状态启动
+            return
+        self._cancel_prefetch_update()
+        if self.prefetch_var.get():
+            self.prefetcher.start()
+            self._update_prefetch_target()
+            self.log("已开启后台预取报价")
+        else:
+            self.prefetcher.stop()
+            self.log("已关闭后台预取报价")
+
+    def _cancel_prefetch_update(self):
+        if self._prefetch_after_id is not None:
+            self.root.after_cancel(self._prefetch_after_id)
+            self._prefetch_after_id = None
+
+    def _update_prefetch_target(self):
+        """在主线程中读取输入框，定期更新预取目标"""
+        self._prefetch_after_id = None
+        if not self.prefetch_var.get():
+            return
 
-            if sell_amount <= 0:
-                self.log("错误: 计算的卖出数量为零")
-                return
+        target = None
+        try:
+            ca = self.ca_entry.get()
+            slippage = self.entries[1].get()
+            api_values = [entry.get() for entry in self.adv_entries]
+            if ca and slippage and self.entries[0].get() and self.entries[2].get() and all(api_values):
+                target = {
+                    "api_key": api_values[0],
+                    "api_secret": api_values[1],
+                    "passphrase": api_values[2],
+                    "private_key": api_values[3],
+                    "rpc": self.entries[0].get(),
+                    "chain_id": self.entries[2].get(),
+                    "ca": ca,
+                    "slippage": float(slippage) / 100,
+                    "buy_amount": self.entries[3].get(),
+                    "sell_ratio": self.entries[4].get(),
+                }
+        except ValueError:
+            target = None
+
+        self.prefetcher.set_target(target)
+        self._prefetch_after_id = self.root.after(int(self.prefetcher.interval * 1000), self._update_prefetch_target)
+
+    def _load_broadcast_rpcs(self) -> dict:
+        """按链ID分组config.json中所有的RPC，用于同时广播交易"""
+        return self.config.rpc_groups()
+
+    def _refresh_rpc_monitor(self):
+        """用配置中的RPC更新健康探测列表"""
+        if self.rpc_monitor is None:
+            return
+        self.rpc_monitor.set_endpoints(self.config.rpc_groups())
+        if self.rpc_auto_select:
+            self.rpc_monitor.start()
+        else:
+            self.rpc_monitor.stop()
 
-            self.log(f"将卖出 {float(sell_amount) / 1e18:.8f} 代币 ({sell_ratio}%)")
+    def _log_rpc_ranking(self, chain_id):
+        """输出某条链上各RPC的健康状态排名"""
+        if self.rpc_monitor is None:
+            return
+        try:
+            rows = self.rpc_monitor.snapshot(str(int(chain_id)))
+        except ValueError:
+            return
+        for index, row in enumerate(rows, 1):
+            host = urlparse(row["url"]).netloc or row["url"]
+            latency = f"{row['latency_ms']:.0f}ms" if row["latency_ms"] is not None else "-"
+            lag = row["lag"] if row["lag"] is not None else "-"
+            status = "熔断" if row["circuit_open"] else ("正常" if row["healthy"] else "异常")
+            self.log(f"{index}. {host} 延迟 {latency} 落后 {lag} 块 错误率 {row['error_rate']:.0%} {status}")
+
+    def _rpc_selector(self):
+        return self.rpc_monitor if self.rpc_auto_select else None
+
+    def _start_warm_up(self):
+        """界面已显示，在主线程读取输入框后启动后台预热"""
+        self.log(f"界面启动耗时 {(time.perf_counter() - STARTED_AT) * 1000:.0f}ms")
+        api_values = [entry.get() for entry in self.adv_entries]
+        rpc = self.entries[0].get()
+        chain_id = self.entries[2].get()
+        threading.Thread(target=self._warm_up, args=(api_values, rpc, chain_id), daemon=True).start()
+
+    def _warm_up(self, api_values, rpc, chain_id):
+        """导入交易核心，创建账户和Web3实例，建立到OKX和RPC的长连接并初始化gas价格和nonce"""
+        started = time.perf_counter()
+        try:
+            self._ensure_core()
+            if all(api_values) and rpc and chain_id:
+                self._create_dex(*api_values).warm_up(rpc, chain_id)
+            self.log(f"交易模块预热完成 {(time.perf_counter() - started) * 1000:.0f}ms")
+        except Exception as e:
+            self.log(f"交易模块预热失败: {str(e)}", "warning")
+
+    def _ensure_core(self):
+        """导入交易核心并创建依赖它的预取器和RPC健康监控，返回okx_dex模块"""
+        core = load_core()
+        with self._core_lock:
+            if self.rpc_monitor is None:
+                if self.config.get("okx_rate_limit"):
+                    core.okx_rate_limiter.set_rate(float(self.config.get("okx_rate_limit")))
+                self.prefetcher = core.QuotePrefetcher()
+                self.rpc_monitor = core.rpc_health_monitor
+                self.root.after(0, self._on_core_ready)
+        return core
+
+    def _on_core_ready(self):
+        """交易核心导入后开始RPC健康探测，并按勾选状态启动报价预取"""
+        self._refresh_rpc_monitor()
+        if self.prefetch_var.get():
+            self.toggle_prefetch()
+
+    def _create_dex(self, api_key, api_secret, passphrase, private_key) -> "OKXDexSwap":
+        """获取OKXDexSwap实例，交易会同时广播到同一条链上配置的所有RPC
+
+        API和私钥不变时复用同一个实例，保留预热好的HTTP长连接。
+        """
+        core = self._ensure_core()
+        key = (api_key, api_secret, passphrase, private_key)
+        with self._core_lock:
+            if self._dex is None or self._dex_key != key:
+                self._dex = core.OKXDexSwap(api_key, api_secret, passphrase, private_key)
+                self._dex_key = key
+            dex = self._dex
+            dex.broadcast_rpcs = self._load_broadcast_rpcs()
+            dex.rpc_selector = self._rpc_selector()
+            dex.fee_mode = self.fee_mode
+            dex.fee_urgency = self.fee_urgency
+            dex.hedger = self._quote_hedger(core)
+        return dex
+
+    def _quote_hedger(self, core):
+        """config.json中hedge_quotes为true时交易报价使用对冲请求"""
+        return core.quote_hedger if self.config.get("hedge_quotes") else None
+
+    def _log_selected_rpc(self, dex: "OKXDexSwap", rpc: str):
+        """自动选择的RPC与输入框不同时输出提示"""
+        selected = dex.resolve_rpc(rpc)
+        if selected != rpc:
+            self.log(f"自动选择RPC: {urlparse(selected).netloc or selected}")
+
+    def _log_broadcast_acks(self, dex: "OKXDexSwap"):
+        """输出最近一次广播各RPC的确认耗时"""
+        if not dex.last_broadcast_acks:
+            return
+        parts = []
+        for rpc_url, ack in list(dex.last_broadcast_acks.items()):
+            host = urlparse(rpc_url).netloc or rpc_url
+            parts.append(f"{host} {ack:.0f}ms" if isinstance(ack, float) else f"{host} 失败")
+        self.log(f"RPC广播确认: {', '.join(parts)}")
+
+    def _load_wallets(self) -> dict:
+        """从config.json读取所有以Wallet/开头的钱包，返回 名称 -> 私钥"""
+        config_data = self.config.snapshot()
+        return {key[7:]: value for key, value in config_data.items() if key.startswith("Wallet/") and value}
+
+    def _run_batch(self, side, api_key, api_secret, passphrase, ca, rpc, chain_id, slippage,
+                   buy_amount=None, sell_ratio=None):
+        """在所有配置的钱包上并发执行买入或卖出，并输出汇总表"""
+        wallets = self._load_wallets()
+        if not wallets:
+            self.log("错误: 批量模式需要先在基本配置中添加钱包", "error")
+            return
+
+        action = "买入" if side == "buy" else "卖出"
+        self.log(f"批量{action}: {len(wallets)} 个钱包", "highlight")
+        core = self._ensure_core()
+        trader = core.BatchTrader(api_key, api_secret, passphrase, wallets, max_workers=self.batch_workers,
+                                  broadcast_rpcs=self._load_broadcast_rpcs(), rpc_selector=self._rpc_selector(),
+                                  fee_mode=self.fee_mode, fee_urgency=self.fee_urgency,
+                                  hedger=self._quote_hedger(core))
+        try:
+            results = trader.run(side, ca, rpc, chain_id, slippage, buy_amount=buy_amount, sell_ratio=sell_ratio,
+                                 log=self.log, quote_cache=self.prefetcher)
+        finally:
+            trader.close()
+
+        self.log(f"===== 批量{action}结果 =====", "highlight")
+        for line in core.BatchTrader.format_results(results):
+            self.log(line)
+        succeeded = sum(1 for row in results if row['success'])
+        level = "success" if succeeded == len(results) else "warning"
+        self.log(f"成功 {succeeded}/{len(results)}", level)
+
+    def _on_buy_receipt(self, future: Future, dex: "OKXDexSwap", ca, rpc, chain_id):
+        """买入交易收据到达（在收据跟踪器的回调线程中执行）"""
+        try:
+            receipt = future.result()
+        except Exception as e:
+            self.log(f"等待买入确认失败: {str(e)}", "error")
+            return
+
+        if receipt['status'] == 1:
+            self.log(">> 买入交易成功! 后台进行预授权方便卖出...", "success")
+            self._track_token(ca)
+            dex.check_and_approve(ca, rpc, chain_id, wait=False)
+        else:
+            self.log('[ 买入交易失败 ]', "error")
+
+    def _on_sell_receipt(self, future: Future):
+        """卖出交易收据到达（在收据跟踪器的回调线程中执行）"""
+        try:
+            receipt = future.result()
+        except Exception as e:
+            self.log(f"等待卖出确认失败: {str(e)}", "error")
+            return
 
-            # 检查并执行授权
-            self.log("检查并进行代币授权...")
-            if not dex.check_and_approve(ca, rpc, chain_id):
-                self.log("授权失败，交易终止", "error")
+        if receipt['status'] == 1:
+            self.log(">> 卖出交易成功!", "success")
+        else:
+            self.log('[ 卖出交易失败 ]', "error")
+
+    def _validate_sell_ratio(self, sell_ratio) -> Optional[str]:
+        """验证卖出比例是0-100之间的整数，无效时记录错误并返回None"""
+        try:
+            sell_ratio_value = float(sell_ratio)
+            # 检查是否为整数
+            if sell_ratio_value != int(sell_ratio_value):
+                self.log("错误: 卖出比例必须是整数")
+                return None
+            # 转换为整数
+            sell_ratio_int = int(sell_ratio_value)
+            # 检查范围
+            if sell_ratio_int <= 0 or sell_ratio_int > 100:
+                self.log("错误: 卖出比例必须大于0且小于或等于100")
+                return None
+            return str(sell_ratio_int)
+        except ValueError:
+            self.log("错误: 卖出比例必须是有效的数字")
+            return None
+
+    def sell_many(self):
+        """批量清仓 - 使用线程执行"""
+        if self.is_buying or self.is_selling:
+            return
+
+        self.is_selling = True
+        self.buy_button.config(state="disabled")
+        self.sell_button.config(state="disabled")
+        self.sell_many_button.config(state="disabled")
+
+        sell_thread = threading.Thread(target=self._sell_many_thread)
+        sell_thread.daemon = True
+        sell_thread.start()
+
+    def _get_liquidation_tokens(self, ca: str) -> list:
+        """CA输入框中有多个地址（逗号或空格分隔）时卖出这些代币，否则卖出跟踪列表中的所有代币"""
+        tokens = [token for token in ca.replace(",", " ").split() if token]
+        if len(tokens) > 1:
+            return tokens
+
+        for token in self.config.get("tracked_tokens", []):
+            if token.lower() not in [t.lower() for t in tokens]:
+                tokens.append(token)
+        return tokens
+
+    def _track_token(self, ca: str):
+        """买入成功后把CA加入跟踪列表，方便批量清仓"""
+        try:
+            self.config.append_unique("tracked_tokens", ca)
+        except Exception as e:
+            self.log(f"保存跟踪代币失败: {str(e)}")
+
+    def _log_sell_result(self, row: dict):
+        """输出单个代币的清仓结果"""
+        token = row['token'][:10]
+        if row['success']:
+            self.log(f"[{token}] 卖出成功 {row['latency_ms']:.0f}ms {row['tx_hash']}", "success")
+        elif row['tx_hash']:
+            self.log(f"[{token}] 卖出失败 {row['tx_hash']}", "error")
+        else:
+            self.log(f"[{token}] 未卖出: {row['error']}", "warning")
+
+    def _sell_many_thread(self):
+        """在单独的线程中并行卖出多个代币"""
+        try:
+            rpc = self.entries[0].get()
+            slippage = self.entries[1].get()
+            chain_id = self.entries[2].get()
+            sell_ratio = self.entries[4].get()
+            ca = self.ca_entry.get()
+            api_key = self.adv_entries[0].get()
+            api_secret = self.adv_entries[1].get()
+            passphrase = self.adv_entries[2].get()
+            private_key = self.adv_entries[3].get()
+
+            sell_ratio = self._validate_sell_ratio(sell_ratio)
+            if sell_ratio is None:
                 return
 
-            self.log("代币已授权，准备卖出")
+            if not api_key or not api_secret or not passphrase or not private_key:
+                self.log("错误: API Key、API Secret、Passphrase和Private Key不能为空")
+                return
 
-            # 获取卖出报价 - 注意这里slippage需要除以100转换为小数
-            self.log("获取卖出报价...")
-            quote = dex.get_quote(ca, BNB_ADDRESS, float(slippage) / 100, str(sell_amount), chain_id)
-            # print(quote)
-            if quote is None:
-                self.log("获取报价失败", "error")
+            if not slippage:
+                self.log("错误: 滑点不能为空")
                 return
 
-            if quote.get("code") == "0":
-                # 显示预计收到的BNB数量
-                expected_amount = quote["data"][0]["toTokenAmount"]
-                self.log(f"预计收到的代币: {float(expected_amount) / 1e18:.8f}")
-                self.log(f"价格影响: {quote['data'][0]['priceImpactPercentage']}%")
-                self.log(f"使用DEX: {quote['data'][0]['quoteCompareList'][0]['dexName']}")
-
-                # 执行交换 - 这里slippage也需要除以100
-                self.log("执行卖出交易...")
-                swap_result = dex.swap(quote["data"], float(slippage) / 100)
-                if swap_result and swap_result.get("code") == "0":
-                    # 从响应中提取交易数据
-                    tx_data = swap_result["data"][0]["tx"]
-                    self.log("卖出交易数据已获取!")
-                    # 发送交易
-                    self.log('准备发送卖出交易...')
-                    tx_result = dex.send_transaction(tx_data, rpc, chain_id)
-                    if tx_result:
-                        tx_hash = tx_result['tx_hash']
-                        receipt = tx_result['receipt']
-
-                        self.log(f"等待卖出哈希确认:{tx_hash}")
-
-                        # 检查交易是否成功
-                        if receipt['status'] == 1:
-                            self.log(">> 卖出交易成功!", "success")
-                        else:
-                            # print(receipt)
-                            self.log('[ 卖出交易失败 ]', "error")
-                    else:
-                        self.log(f'发送卖出交易出错...', "error")
-                else:
-                    self.log(f"获取卖出交易数据失败: {swap_result}", "error")
-            else:
-                self.log(f"获取卖出报价失败: {quote}", "error")
+            tokens = self._get_liquidation_tokens(ca)
+            if not tokens:
+                self.log("错误: 没有要卖出的代币，请在CA中输入多个地址或先买入代币")
+                return
+
+            self.log_queue.put("EMPTY_LINE")
+            self.log("===== 批量清仓参数 =====", "highlight")
+            self.log(f"代币数量: {len(tokens)}")
+            self.log(f"滑点: {slippage}")
+            self.log(f"卖出比例: {sell_ratio}%")
+
+            dex = self._create_dex(api_key, api_secret, passphrase, private_key)
+            self._log_selected_rpc(dex, rpc)
+            engine = load_core().MultiSellEngine(dex)
+            submitted = engine.submit(tokens, rpc, chain_id, int(sell_ratio), float(slippage) / 100,
+                                      log=self.log, on_result=self._log_sell_result)
+
+            # 交易已全部广播，释放按钮，收据在本线程继续等待
+            self.is_selling = False
+            self.root.after(0, self._check_and_enable_buttons)
+
+            results = engine.wait(submitted, rpc, chain_id, on_result=self._log_sell_result)
+            succeeded = sum(1 for row in results if row['success'])
+            self.log(f"批量清仓完成: 成功 {succeeded}/{len(tokens)}", "success" if succeeded == len(tokens) else "warning")
         except Exception as e:
-            error_msg = f"卖出失败: {str(e)}"
-            self.log(error_msg, "error")
+            self.log(f"批量清仓失败: {str(e)}", "error")
             self.log(traceback.format_exc())
         finally:
-            # 操作完成，设置卖出状态为False
             self.is_selling = False
-            # 检查是否可以恢复按钮状态
             self.root.after(0, self._check_and_enable_buttons)
-        # self.log("========================")
-        self.log_queue.put("EMPTY_LINE")  # 添加完全空白的行
+        self.log_queue.put("EMPTY_LINE")
 
     def _check_and_enable_buttons(self):
         """检查操作状态并决定是否恢复按钮状态"""
@@ -971,6 +1382,7 @@ class ConfigApp:
         if not self.is_buying and not self.is_selling:
             self.buy_button.config(state="normal")
             self.sell_button.config(state="normal")
+            self.sell_many_button.config(state="normal")
 
     def save_advanced_config(self):
         """保存高级配置并显示临时成功消息"""
@@ -987,14 +1399,19 @@ class ConfigApp:
         """恢复高级配置保存按钮的文本"""
         self.adv_save_button.config(text="保存高级配置")
 
+    def clear_allowance_cache(self):
+        """清空授权缓存，下次卖出重新检查授权"""
+        try:
+            load_core().allowance_cache.invalidate()
+            self.log("授权缓存已清除")
+        except Exception as e:
+            self.log(f"清除授权缓存失败: {str(e)}")
+
     def update_rpc_list(self):
         """更新RPC列表"""
         try:
-            # 加载配置文件
-            config_data = {}
-            if os.path.exists("config.json"):
-                with open("config.json", "r") as f:
-                    config_data = json.load(f)
+            # 重新读取配置文件（可能被手动编辑过）
+            config_data = self.config.reload()
 
             # 清空下拉框选项
             self.chain_combobox['values'] = []
@@ -1019,337 +1436,22 @@ class ConfigApp:
             self.root.after(500, lambda: self.update_rpc_list_button.config(text="更新RPC列表"))
 
             self.log("RPC列表已更新")
-        except Exception as e:
-            self.log(f"更新RPC列表失败: {str(e)}")
-
-
-class OKXDexSwap:
-    def __init__(self, api_key, api_secret, passphrase, private_key):
-        self.base_url = "https://www.okx.com"
-        self.api_key = api_key
-        self.api_secret = api_secret
-        self.passphrase = passphrase
-        self.private_key = private_key
-
-        # 验证参数
-        if not all([self.api_key, self.api_secret, self.passphrase, self.private_key]):
-            raise ValueError("请确保所有API参数都已正确设置")
-
-        try:
-            self.account = Account.from_key(self.private_key)
-        except Exception as e:
-            raise ValueError(f"私钥格式错误: {e}")
-
-    def generate_sign(self, timestamp: str, method: str, request_path: str, body: str = '') -> str:
-        """生成OKX API签名"""
-        if str(body) == '{}' or str(body) == 'None':
-            body = ''
-        message = timestamp + method + request_path + str(body)
-
-        try:
-            mac = hmac.new(
-                bytes(self.api_secret, encoding='utf8'),
-                bytes(message, encoding='utf-8'),
-                digestmod='sha256'
-            )
-            d = mac.digest()
-            return base64.b64encode(d).decode('utf-8')
-        except Exception as e:
-            # print(f"生成签名时发生错误: {e}")
-            raise
-
-    def get_quote(self, from_token: str, to_token: str, slippage, amount: str, chain_id) -> Optional[dict]:
-        """获取Swap报价"""
-        endpoint = "/api/v5/dex/aggregator/quote"
-        timestamp = str(int(time.time() * 1000))
-        method = 'GET'
-
-        params = {
-            "chainId": chain_id,
-            "fromTokenAddress": from_token,
-            "toTokenAddress": to_token,
-            "amount": amount,
-            "slippage": str(slippage),
-            "userAddr": self.account.address
-        }
-
-        # 使用urlencode确保参数正确编码
-        query_string = urlencode(sorted(params.items()))
-        full_path = f"{endpoint}?{query_string}"
-        # print(full_path)
-        try:
-            signature = self.generate_sign(timestamp, method, full_path)
-        except Exception as e:
-            # print(f"生成签名失败: {e}")
-            return None
-
-        headers = {
-            "OK-ACCESS-KEY": self.api_key,
-            "OK-ACCESS-SIGN": signature,
-            "OK-ACCESS-TIMESTAMP": timestamp,
-            "OK-ACCESS-PASSPHRASE": self.passphrase,
-            "Content-Type": "application/json"
-        }
-
-        try:
-            url = self.base_url + full_path
-            response = requests.get(url, headers=headers)
-
-            if response.status_code != 200:
-                return None
-
-            return response.json()
-
-        except requests.exceptions.RequestException as e:
-            # print(f"请求发生错误: {e}")
-            return None
-        except json.JSONDecodeError as e:
-            # print(f"解析响应JSON时发生错误: {e}")
-            return None
-
-    def swap(self, quote_data: list, slippage) -> Optional[dict]:
-        """执行Swap交易"""
-        endpoint = "/api/v5/dex/aggregator/swap"
-        timestamp = str(int(time.time() * 1000))
-        method = 'GET'  # 使用GET请求
-
-        # 构建交易参数
-        params = {
-            "chainId": quote_data[0]["chainId"],
-            "fromTokenAddress": quote_data[0]["fromToken"]["tokenContractAddress"],
-            "toTokenAddress": quote_data[0]["toToken"]["tokenContractAddress"],
-            "amount": quote_data[0]["fromTokenAmount"],
-            "userWalletAddress": self.account.address,
-            "slippage": str(slippage),
-            "dexId": quote_data[0]["quoteCompareList"][0]["dexName"].replace(" ", "")
-        }
-
-        # print(f"交易参数: {json.dumps(params, indent=2)}")
-        # 使用urlencode确保参数正确编码
-        query_string = urlencode(sorted(params.items()))
-        full_path = f"{endpoint}?{query_string}"
-
-        # 生成签名
-        signature = self.generate_sign(timestamp, method, full_path)
-
-        headers = {
-            "OK-ACCESS-KEY": self.api_key,
-            "OK-ACCESS-SIGN": signature,
-            "OK-ACCESS-TIMESTAMP": timestamp,
-            "OK-ACCESS-PASSPHRASE": self.passphrase,
-            "Content-Type": "application/json"
-        }
-
-        try:
-            url = self.base_url + full_path
-            response = requests.get(url, headers=headers)
-
-            if response.status_code != 200:
-                return None
-
-            return response.json()
 
+            # 刷新健康探测并输出当前链的RPC排名
+            self._refresh_rpc_monitor()
+            self._log_rpc_ranking(self.entries[2].get())
         except Exception as e:
-            # print(f"执行Swap时发生错误: {e}")
-            return None
-
-    def send_transaction(self, tx_data: dict, rpc_url: str, chain_id) -> Optional[dict]:
-        """发送交易到区块链并返回交易收据"""
-        try:
-            # 连接到区块链
-            w3 = Web3(Web3.HTTPProvider(rpc_url))
-            gas_price = w3.eth.gas_price
-            gas_limit = int(tx_data['gas']) * 2  # 增加gas限制
-            # 创建交易对象
-            transaction = {
-                'from': self.account.address,
-                'to': tx_data['to'],
-                'value': int(tx_data['value']),
-                'gas': gas_limit,  # 增加gas限制
-                'gasPrice': int(gas_price * 1.01),  # 增加20%的gas价格
-                'nonce': w3.eth.get_transaction_count(self.account.address),
-                'data': tx_data['data'],
-                'chainId': int(chain_id)  # 确保chainId是整数
-            }
-            # print(transaction)
-
-            # 签名交易
-            signed_txn = w3.eth.account.sign_transaction(transaction, self.private_key)
-
-            # 发送交易
-            tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
-
-            # 等待交易收据
-            # print(f"等待交易确认，交易哈希: {w3.to_hex(tx_hash)}")
-            receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
-
-            # 返回交易哈希和收据
-            return {
-                'tx_hash': w3.to_hex(tx_hash),
-                'receipt': receipt
-            }
-
-        except Exception as e:
-            # print(f"发送交易时发生错误: {e}")
-            return None
-
-    def get_token_balance(self, token_address: str, rpc):
-        """获取代币余额"""
-        try:
-            w3 = Web3(Web3.HTTPProvider(rpc))
-
-            abi = [
-                {
-                    "constant": True,
-                    "inputs": [{"name": "_owner", "type": "address"}],
-                    "name": "balanceOf",
-                    "outputs": [{"name": "balance", "type": "uint256"}],
-                    "type": "function"
-                }
-            ]
-
-            contract = w3.eth.contract(address=Web3.to_checksum_address(token_address), abi=abi)
-            balance = contract.functions.balanceOf(self.account.address).call()
-            return int(balance)
-        except Exception as e:
-            # print(f"获取代币余额时发生错误: {e}")
-            return 0
-
-    def check_and_approve(self, token_address: str, rpc_url: str, chain_id, wait=True):
-        """检查并执行代币授权"""
-        try:
-            w3 = Web3(Web3.HTTPProvider(rpc_url))
-            # 首先通过OKX API获取授权交易信息
-            endpoint = "/api/v5/dex/aggregator/approve-transaction"
-            timestamp = str(int(time.time() * 1000))
-            method = 'GET'
-            # 构建参数
-            params = {
-                "chainId": chain_id,
-                "tokenContractAddress": token_address,
-                "approveAmount": "10"  # 2^256-1
-            }
-
-            # 使用urlencode确保参数正确编码
-            query_string = urlencode(sorted(params.items()))
-            full_path = f"{endpoint}?{query_string}"
-
-            # 生成签名
-            signature = self.generate_sign(timestamp, method, full_path)
-
-            headers = {
-                "OK-ACCESS-KEY": self.api_key,
-                "OK-ACCESS-SIGN": signature,
-                "OK-ACCESS-TIMESTAMP": timestamp,
-                "OK-ACCESS-PASSPHRASE": self.passphrase,
-                "Content-Type": "application/json"
-            }
-
-            url = self.base_url + full_path
-            response = requests.get(url, headers=headers)
-
-            if response.status_code != 200:
-                return False
-
-            approve_data = response.json()
-
-            if approve_data.get("code") != "0":
-                return False
-
-            # 获取DEX合约地址作为授权接收方
-            spender_address = approve_data["data"][0]["dexContractAddress"]
-
-            # ERC20代币ABI
-            abi = [
-                # balanceOf
-                {
-                    "constant": True,
-                    "inputs": [{"name": "_owner", "type": "address"}],
-                    "name": "balanceOf",
-                    "outputs": [{"name": "balance", "type": "uint256"}],
-                    "type": "function"
-                },
-                # allowance
-                {
-                    "constant": True,
-                    "inputs": [
-                        {"name": "_owner", "type": "address"},
-                        {"name": "_spender", "type": "address"}
-                    ],
-                    "name": "allowance",
-                    "outputs": [{"name": "", "type": "uint256"}],
-                    "type": "function"
-                },
-                # approve
-                {
-                    "constant": False,
-                    "inputs": [
-                        {"name": "_spender", "type": "address"},
-                        {"name": "_value", "type": "uint256"}
-                    ],
-                    "name": "approve",
-                    "outputs": [{"name": "", "type": "bool"}],
-                    "type": "function"
-                }
-            ]
-
-            # 创建合约实例
-            contract = w3.eth.contract(address=Web3.to_checksum_address(token_address), abi=abi)
-
-            # 检查当前授权额度
-            allowance = contract.functions.allowance(
-                self.account.address,
-                Web3.to_checksum_address(spender_address)
-            ).call()
-
-            # 最大授权额度
-            max_amount = 2 ** 256 - 1
-
-            # 如果授权额度小于最大值，则需要重新授权
-            if allowance < max_amount:
-                # print(f"\n当前授权额度: {allowance / 1e18:.8f}")
-                # print(f"代币余额: {balance / 1e18:.8f}")
-                # print("需要最大授权，准备发送授权交易...")
-
-                # 构建授权交易
-                transaction = contract.functions.approve(
-                    Web3.to_checksum_address(spender_address),
-                    max_amount
-                ).build_transaction({
-                    'from': self.account.address,
-                    'gas': 2100000,
-                    'gasPrice': w3.eth.gas_price,
-                    'nonce': w3.eth.get_transaction_count(self.account.address),
-                    'chainId': int(chain_id)
-                })
-
-                # 签名并发送交易
-                signed_txn = w3.eth.account.sign_transaction(transaction, self.private_key)
-                tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
-
-                # # 等待交易确认
-                # print(f"授权交易已发送，交易哈希: {w3.to_hex(tx_hash)}")
-                # print("等待交易确认...")
-                if not wait:
-                    return
-
-                try:
-                    tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=60)
-                    if tx_receipt['status'] == 1:
-                        return True
-                except Exception as e:
-                    # print(f"等待授权交易确认时发生错误: {e}")
-                    pass
-                return False
-            else:
-                return True
-
-        except Exception as e:
-            # print(f"检查授权时发生错误: {e}")
-            return False
+            self.log(f"更新RPC列表失败: {str(e)}")
 
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = ConfigApp(root)
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        app.config.flush()
+        app.log_writer.close()
+        if okx_dex is not None:
+            okx_dex.trade_trace_recorder.close()
+            okx_dex.allowance_cache.flush()
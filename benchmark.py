@@ -0,0 +1,485 @@
+"""端到端延迟基准测试：本地模拟OKX聚合器接口和EVM JSON-RPC节点，离线测量真实的买入/卖出流程
+
+    python benchmark.py [--iterations 50] [--okx-latency 80 --okx-jitter 30 --okx-error-rate 0.01]
+                        [--rpc-latency 30 --rpc-jitter 10 --rpc-error-rate 0] [--block-time 0.5]
+                        [--okx-rate-limit 0] [--okx-tail-rate 0.05 --okx-tail-latency 1000] [--hedge]
+                        [--side both] [--output benchmark_results/xxx.json] [--compare 之前的结果.json]
+
+模拟服务器按配置注入延迟、抖动和错误率，OKXDexSwap/BuyEngine/SellEngine与实盘使用同一套代码，
+只是OKX地址和RPC指向本地。输出每个阶段以及端到端的p50/p95/p99，外加签名、参数编码、交易签名的微基准。
+结果保存为JSON，--compare 与之前保存的结果对比，用来证明性能改动的效果。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import timeit
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from eth_abi import decode, encode
+from eth_account import Account
+from web3 import Web3
+
+from okx_dex import (
+    BNB_ADDRESS,
+    MAX_ALLOWANCE,
+    MULTICALL3_ADDRESS,
+    AllowanceCache,
+    BuyEngine,
+    GasOracle,
+    NonceManager,
+    OKXDexSwap,
+    SellEngine,
+    QuoteHedger,
+    TradeTraceRecorder,
+    web3_registry,
+)
+
+# 模拟环境使用的测试私钥、代币和合约地址，不对应任何真实资产
+BENCH_PRIVATE_KEY = "0x" + "42" * 32
+BENCH_TOKEN = "0x" + "77" * 20
+BENCH_ROUTER = "0x" + "55" * 20
+BENCH_CHAIN_ID = 31337
+
+# ERC20和Multicall3的函数选择器
+SELECTOR_BALANCE_OF = "70a08231"
+SELECTOR_ALLOWANCE = "dd62ed3e"
+SELECTOR_DECIMALS = "313ce567"
+SELECTOR_AGGREGATE3 = "82ad56cb"
+
+
+class FaultInjector:
+    """每个请求注入的延迟（毫秒，均匀抖动）和错误率，tail_rate比例的请求额外延迟tail_ms模拟长尾"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None, tail_rate=0.0, tail_ms=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self) -> bool:
+        """等待注入的延迟，返回本次请求是否应当失败"""
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            if self._random.random() < self.tail_rate:
+                delay += self.tail_ms
+            failed = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay / 1000)
+        return failed
+
+
+class _MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, faults: FaultInjector):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.faults = faults
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写入，不关闭Nagle时每个请求会多出约40ms的延迟确认等待
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _OkxHandler(_JsonHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        if not self.server.admit():
+            self.server.throttled += 1
+            self._send_json(429, {"code": "50011", "msg": "Too Many Requests"})
+            return
+        if self.server.faults.apply():
+            self._send_json(500, {"code": "50001", "msg": "injected error"})
+            return
+
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path.endswith("/quote"):
+            data = {
+                "chainId": params.get("chainId"),
+                "fromToken": {"tokenContractAddress": params.get("fromTokenAddress"), "decimal": "18"},
+                "toToken": {"tokenContractAddress": params.get("toTokenAddress"), "tokenSymbol": "MOCK",
+                            "decimal": "18"},
+                "fromTokenAmount": params.get("amount"),
+                "toTokenAmount": params.get("amount"),
+                "priceImpactPercentage": "0.1",
+                "quoteCompareList": [{"dexName": "Mock Swap"}]
+            }
+        elif url.path.endswith("/swap"):
+            value = params.get("amount") if params.get("fromTokenAddress", "").lower() == BNB_ADDRESS else "0"
+            data = {"tx": {"to": BENCH_ROUTER, "value": value, "gas": "150000", "data": "0x12345678"}}
+        elif url.path.endswith("/approve-transaction"):
+            data = {"dexContractAddress": BENCH_ROUTER, "data": "0x", "gasLimit": "60000"}
+        else:
+            self._send_json(404, {"code": "404", "msg": "not found"})
+            return
+        self._send_json(200, {"code": "0", "msg": "", "data": [data]})
+
+
+class MockOkxServer(_MockServer):
+    """模拟OKX DEX聚合器的quote、swap、approve-transaction接口，rate_limit>0时超过每秒请求数返回429"""
+
+    def __init__(self, faults: FaultInjector, rate_limit=0):
+        super().__init__(_OkxHandler, faults)
+        self.rate_limit = rate_limit
+        self.throttled = 0
+        self._window = deque()
+        self._window_lock = threading.Lock()
+
+    def admit(self) -> bool:
+        """最近一秒内的请求数未超过限制时接受请求"""
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        with self._window_lock:
+            while self._window and now - self._window[0] >= 1:
+                self._window.popleft()
+            if len(self._window) >= self.rate_limit:
+                return False
+            self._window.append(now)
+            return True
+
+
+class _RpcHandler(_JsonHandler):
+    def do_POST(self):
+        self.server.requests += 1
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+        if self.server.faults.apply():
+            self._send_json(500, {"error": "injected error"})
+            return
+        if isinstance(payload, list):
+            self._send_json(200, [self.server.node.handle(request) for request in payload])
+        else:
+            self._send_json(200, self.server.node.handle(payload))
+
+
+class MockEvmNode:
+    """最小的EVM节点状态：按固定出块时间增长的区块高度、nonce、ERC20读取和交易收据"""
+
+    def __init__(self, block_time=0.5, chain_id=BENCH_CHAIN_ID, gas_price=3 * 10 ** 9):
+        self.block_time = block_time
+        self.chain_id = chain_id
+        self.gas_price = gas_price
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._nonces = {}
+        # 交易哈希 -> (发送者, 广播时的区块高度)
+        self._transactions = {}
+
+    @property
+    def block_number(self) -> int:
+        return 1000 + int((time.time() - self.started) / self.block_time)
+
+    def handle(self, request: dict) -> dict:
+        method = getattr(self, "rpc_" + str(request.get("method")), None)
+        if method is None:
+            error = {"code": -32601, "message": f"method not found: {request.get('method')}"}
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": error}
+        try:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": method(*request.get("params", []))}
+        except Exception as e:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32000, "message": str(e)}}
+
+    def rpc_eth_chainId(self):
+        return hex(self.chain_id)
+
+    def rpc_eth_blockNumber(self):
+        return hex(self.block_number)
+
+    def rpc_eth_gasPrice(self):
+        return hex(self.gas_price)
+
+    def rpc_eth_feeHistory(self, block_count, newest_block, percentiles):
+        count = int(block_count, 16) if isinstance(block_count, str) else int(block_count)
+        return {
+            "oldestBlock": hex(self.block_number - count + 1),
+            "baseFeePerGas": [hex(self.gas_price)] * (count + 1),
+            "gasUsedRatio": [0.5] * count,
+            "reward": [[hex(10 ** 9)] * len(percentiles)] * count
+        }
+
+    def rpc_eth_getBalance(self, address, block="latest"):
+        return hex(10 ** 20)
+
+    def rpc_eth_getCode(self, address, block="latest"):
+        return "0x6080" if address.lower() == MULTICALL3_ADDRESS.lower() else "0x"
+
+    def rpc_eth_getTransactionCount(self, address, block="latest"):
+        with self._lock:
+            return hex(self._nonces.get(address.lower(), 0))
+
+    def rpc_eth_estimateGas(self, transaction, block=None):
+        return hex(60000)
+
+    def rpc_eth_call(self, transaction, block="latest"):
+        return "0x" + self._call(transaction["to"], bytes.fromhex(transaction["data"][2:])).hex()
+
+    def _call(self, to: str, data: bytes) -> bytes:
+        selector = data[:4].hex()
+        if selector == SELECTOR_AGGREGATE3 and to.lower() == MULTICALL3_ADDRESS.lower():
+            calls = decode(["(address,bool,bytes)[]"], data[4:])[0]
+            return encode(["(bool,bytes)[]"], [[(True, self._call(target, call_data))
+                                                 for target, _, call_data in calls]])
+        if selector == SELECTOR_BALANCE_OF:
+            return encode(["uint256"], [10 ** 21])
+        if selector == SELECTOR_ALLOWANCE:
+            return encode(["uint256"], [MAX_ALLOWANCE])
+        if selector == SELECTOR_DECIMALS:
+            return encode(["uint8"], [18])
+        return b""
+
+    def rpc_eth_sendRawTransaction(self, raw_tx):
+        tx_hash = Web3.keccak(hexstr=raw_tx).hex()
+        if not tx_hash.startswith("0x"):
+            tx_hash = "0x" + tx_hash
+        sender = Account.recover_transaction(raw_tx).lower()
+        with self._lock:
+            self._nonces[sender] = self._nonces.get(sender, 0) + 1
+            self._transactions[tx_hash] = (sender, self.block_number)
+        return tx_hash
+
+    def rpc_eth_getTransactionReceipt(self, tx_hash):
+        with self._lock:
+            entry = self._transactions.get(tx_hash.lower())
+        # 广播后的下一个区块才能查到收据
+        if entry is None or self.block_number <= entry[1]:
+            return None
+        block_number = entry[1] + 1
+        return {
+            "transactionHash": tx_hash, "transactionIndex": "0x0", "blockHash": "0x" + "ab" * 32,
+            "blockNumber": hex(block_number), "from": entry[0], "to": BENCH_ROUTER, "status": "0x1",
+            "cumulativeGasUsed": hex(100000), "gasUsed": hex(100000), "effectiveGasPrice": hex(self.gas_price),
+            "contractAddress": None, "logs": [], "logsBloom": "0x" + "00" * 256, "type": "0x0"
+        }
+
+
+class MockRpcServer(_MockServer):
+    """模拟EVM JSON-RPC节点，支持批量请求"""
+
+    def __init__(self, faults: FaultInjector, node: MockEvmNode):
+        super().__init__(_RpcHandler, faults)
+        self.node = node
+
+
+def percentiles(samples: list) -> dict:
+    """p50/p95/p99/平均值（毫秒）"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pick(50),
+        "p95": pick(95),
+        "p99": pick(99),
+        "max": ordered[-1]
+    }
+
+
+def _phase_samples(result: dict) -> dict:
+    """一次交易各阶段耗时（毫秒）：引擎记录的阶段（含等待收据）加上关键路径和端到端"""
+    samples = dict(result["timings"])
+    if "critical_path_ms" in result:
+        samples["critical_path"] = result["critical_path_ms"]
+    if "total_ms" in result:
+        samples["end_to_end"] = result["total_ms"]
+    return samples
+
+
+def run_flow(side: str, dex: OKXDexSwap, rpc_url: str, iterations: int, warmup: int,
+             recorder: TradeTraceRecorder) -> dict:
+    """重复执行买入或卖出流程，返回各阶段的分位数和失败次数"""
+    phases = {}
+    failures = 0
+    for index in range(warmup + iterations):
+        if side == "buy":
+            result = BuyEngine(dex, recorder=recorder).run(BENCH_TOKEN, rpc_url, BENCH_CHAIN_ID, "0.01", 0.05,
+                                                           pre_approve=False)
+        else:
+            result = SellEngine(dex, recorder=recorder).run(BENCH_TOKEN, rpc_url, BENCH_CHAIN_ID, 100, 0.05)
+        if index < warmup:
+            continue
+        if not result["success"]:
+            failures += 1
+            continue
+        for name, value in _phase_samples(result).items():
+            phases.setdefault(name, []).append(value)
+    return {
+        "iterations": iterations,
+        "failures": failures,
+        "phases": {name: percentiles(values) for name, values in phases.items()}
+    }
+
+
+def run_micro(dex: OKXDexSwap, number=2000) -> dict:
+    """签名、参数编码和交易签名的微基准，返回每次调用的耗时（微秒）"""
+    params = dex._quote_params(BNB_ADDRESS, BENCH_TOKEN, 0.05, str(10 ** 16), BENCH_CHAIN_ID)
+    path = "/api/v5/dex/aggregator/quote?" + urlencode(sorted(params.items()))
+    timestamp = str(int(time.time() * 1000))
+    transaction = dex._build_swap_transaction(
+        {"to": BENCH_ROUTER, "value": "0", "gas": "150000", "data": "0x12345678"},
+        {"gasPrice": 3 * 10 ** 9}, BENCH_CHAIN_ID
+    )
+    transaction["nonce"] = 0
+    cases = {
+        "generate_sign": lambda: dex.generate_sign(timestamp, "GET", path),
+        "query_encoding": lambda: urlencode(sorted(params.items())),
+        "signed_request": lambda: dex._signed_request("/api/v5/dex/aggregator/quote", params),
+        "sign_transaction": lambda: Account.sign_transaction(transaction, dex.private_key),
+    }
+    results = {}
+    for name, func in cases.items():
+        # 交易签名比HMAC慢两个数量级，次数相应减少
+        count = number // 20 if name == "sign_transaction" else number
+        runs = timeit.repeat(func, number=count, repeat=5)
+        results[name] = {"us_per_call": min(runs) / count * 1e6, "calls": count}
+    return results
+
+
+def run_benchmark(args) -> dict:
+    okx = MockOkxServer(FaultInjector(args.okx_latency, args.okx_jitter, args.okx_error_rate, args.seed,
+                                      args.okx_tail_rate, args.okx_tail_latency),
+                        rate_limit=args.okx_rate_limit).start()
+    node = MockEvmNode(block_time=args.block_time)
+    rpc = MockRpcServer(FaultInjector(args.rpc_latency, args.rpc_jitter, args.rpc_error_rate, args.seed), node).start()
+
+    # 授权缓存、nonce和gas缓存使用独立实例，模拟的授权接收方不会写入实盘的allowance_cache.json
+    state_dir = tempfile.TemporaryDirectory(prefix="swaphelper-bench-")
+    allowances = AllowanceCache(os.path.join(state_dir.name, "allowance_cache.json"))
+    dex = OKXDexSwap("bench-key", "bench-secret", "bench-passphrase", BENCH_PRIVATE_KEY,
+                     nonces=NonceManager(), allowances=allowances, fee_oracle=GasOracle(web3_registry),
+                     hedger=QuoteHedger() if args.hedge else None)
+    dex.base_url = okx.url
+    # 模拟交易的span树不写入实盘的logs/trades.jsonl
+    recorder = TradeTraceRecorder(os.path.join("benchmark_results", "trades.jsonl"))
+    try:
+        flows = {}
+        for side in (("buy", "sell") if args.side == "both" else (args.side,)):
+            flows[side] = run_flow(side, dex, rpc.url, args.iterations, args.warmup, recorder)
+        micro = run_micro(dex)
+    finally:
+        recorder.close()
+        dex.close()
+        okx.shutdown()
+        rpc.shutdown()
+        allowances.flush()
+        state_dir.cleanup()
+
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "flows": flows,
+        "micro": micro,
+        "requests": {"okx": okx.requests, "okx_throttled": okx.throttled, "rpc": rpc.requests}
+    }
+
+
+def format_report(report: dict, baseline: dict = None) -> list:
+    """生成文本报告，有基准结果时在每个分位数后附上变化百分比"""
+
+    def delta(current, previous):
+        if previous in (None, 0):
+            return ""
+        return f" ({(current - previous) / previous:+.0%})"
+
+    lines = []
+    for side, flow in report["flows"].items():
+        lines.append(f"== {side}: {flow['iterations']} 次，失败 {flow['failures']} 次 (ms)")
+        lines.append(f"{'阶段':<16}{'p50':>16}{'p95':>16}{'p99':>16}")
+        base_phases = (baseline or {}).get("flows", {}).get(side, {}).get("phases", {})
+        for name, stats in flow["phases"].items():
+            if not stats["count"]:
+                continue
+            base = base_phases.get(name, {})
+            cells = [f"{stats[p]:.1f}{delta(stats[p], base.get(p))}" for p in ("p50", "p95", "p99")]
+            lines.append(f"{name:<16}" + "".join(f"{cell:>16}" for cell in cells))
+
+    lines.append("== 微基准 (us/次)")
+    base_micro = (baseline or {}).get("micro", {})
+    for name, stats in report["micro"].items():
+        previous = base_micro.get(name, {}).get("us_per_call")
+        lines.append(f"{name:<20}{stats['us_per_call']:>10.2f}{delta(stats['us_per_call'], previous)}")
+    lines.append(f"请求数: OKX {report['requests']['okx']}（限流 {report['requests']['okx_throttled']}）, "
+                 f"RPC {report['requests']['rpc']}")
+    return lines
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="OKX Evm Swap Helper 离线延迟基准测试")
+    parser.add_argument("--iterations", type=int, default=50, help="每个流程计入统计的次数")
+    parser.add_argument("--warmup", type=int, default=3, help="不计入统计的预热次数")
+    parser.add_argument("--side", choices=("buy", "sell", "both"), default="both")
+    parser.add_argument("--okx-latency", type=float, default=80, help="OKX接口延迟（毫秒）")
+    parser.add_argument("--okx-jitter", type=float, default=30, help="OKX接口延迟抖动（毫秒）")
+    parser.add_argument("--okx-error-rate", type=float, default=0.0, help="OKX接口返回500的比例")
+    parser.add_argument("--okx-tail-rate", type=float, default=0.0, help="OKX接口出现长尾延迟的比例")
+    parser.add_argument("--okx-tail-latency", type=float, default=1000, help="长尾请求额外的延迟（毫秒）")
+    parser.add_argument("--hedge", action="store_true", help="交易报价使用对冲请求")
+    parser.add_argument("--okx-rate-limit", type=int, default=0, help="OKX接口每秒请求数上限，超过返回429，0为不限")
+    parser.add_argument("--rpc-latency", type=float, default=30, help="RPC延迟（毫秒）")
+    parser.add_argument("--rpc-jitter", type=float, default=10, help="RPC延迟抖动（毫秒）")
+    parser.add_argument("--rpc-error-rate", type=float, default=0.0, help="RPC返回500的比例")
+    parser.add_argument("--block-time", type=float, default=0.5, help="模拟出块时间（秒）")
+    parser.add_argument("--seed", type=int, default=1, help="延迟和错误的随机种子，便于复现")
+    parser.add_argument("--output", help="结果JSON路径，默认保存到benchmark_results/")
+    parser.add_argument("--compare", help="与之前保存的结果JSON对比")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    report = run_benchmark(args)
+    for line in format_report(report, baseline):
+        print(line)
+
+    output = args.output or os.path.join("benchmark_results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,422 @@
+"""命令行入口：不依赖tkinter，直接读取config.json驱动OKXDexSwap
+
+    python cli.py buy <CA> [--amount 0.01]
+    python cli.py sell <CA> [--ratio 100]
+    python cli.py quote <CA> [--side buy|sell] [--amount 0.01 | --ratio 100]
+    python cli.py balance [CA ...]
+    python cli.py daemon
+    python cli.py serve [--port 8765] [--workers 4] [--queue-size 100]
+    python cli.py watch [CA ...] [--tp 50] [--sl 20]
+
+所有命令都支持 --chain <RPC名称> 和 --wallet <钱包名称>，默认使用config.json中保存的RPC、链ID和私钥。
+日志输出到stderr，结果以JSON输出到stdout，交易成功时退出码为0。
+
+daemon模式常驻运行并复用同一个客户端（HTTP连接、nonce、gas缓存保持热状态），
+从标准输入逐行读取JSON命令，例如 {"id": 1, "cmd": "buy", "ca": "0x...", "amount": "0.01"}，
+每条命令的结果以一行JSON输出。serve模式提供本机HTTP/JSON控制接口，见control_api.py。
+
+watch模式监控代币价值，触及止盈/止损线时自动卖出。监控列表为命令行给出的CA（持仓为钱包当前余额，
+成本为开始监控时的价值）加上config.json中的watchlist，例如
+    "watchlist": [{"ca": "0x...", "wallet": "钱包名称", "amount": "1000", "cost": "0.05", "tp": 100, "sl": 30, "ratio": 100}]
+amount为代币数量（省略时取钱包余额），cost为成本（原生代币，省略时取开始监控时的价值），tp/sl为涨跌百分比。
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from datetime import datetime
+
+from control_api import run_server
+from okx_dex import (
+    BNB_ADDRESS,
+    BuyEngine,
+    GasOracle,
+    MIN_SELL_BALANCE,
+    OKXDexSwap,
+    PriceWatcher,
+    SellEngine,
+    allowance_cache,
+    calc_sell_amount,
+    okx_rate_limiter,
+    quote_hedger,
+    rpc_health_monitor,
+    trade_trace_recorder,
+)
+from swap_config import config_store
+
+
+def stderr_log(message, level="info"):
+    """日志输出到stderr，stdout只输出结果"""
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+
+class HeadlessTrader:
+    """从config.json读取参数执行交易，同一个实例内复用OKXDexSwap客户端"""
+
+    def __init__(self, config=None, log=None):
+        self.config = config or config_store
+        self.log = log or stderr_log
+        self.config.log = self.log
+        self.rpc_monitor = rpc_health_monitor
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    def load(self):
+        """读取配置，启用自动选择RPC时开始后台探测"""
+        self.config.load()
+        if self.config.get("okx_rate_limit"):
+            okx_rate_limiter.set_rate(float(self.config.get("okx_rate_limit")))
+        self.rpc_monitor.set_endpoints(self.config.rpc_groups())
+        if self.config.get("rpc_auto_select", True):
+            self.rpc_monitor.start()
+
+    def close(self):
+        with self._clients_lock:
+            for dex in self._clients.values():
+                dex.close()
+            self._clients.clear()
+        self.rpc_monitor.stop()
+        self.config.flush()
+        trade_trace_recorder.close()
+        allowance_cache.flush()
+
+    def resolve_chain(self, chain=None) -> tuple:
+        """返回 (RPC, 链ID)，chain为config.json中RPC/<名称>的名称"""
+        if chain:
+            entries = self.config.rpc_entries()
+            if chain not in entries:
+                raise ValueError(f"找不到链 {chain} 的RPC信息")
+            return entries[chain]
+        rpc, chain_id = self.config.get("rpc"), self.config.get("chain_id")
+        if not rpc or not chain_id:
+            raise ValueError("config.json中没有RPC和链ID，请使用--chain指定")
+        return rpc, chain_id
+
+    def get_dex(self, wallet=None) -> OKXDexSwap:
+        """获取（首次使用时创建）某个钱包的客户端，wallet为None时使用主私钥"""
+        with self._clients_lock:
+            dex = self._clients.get(wallet)
+            if dex is None:
+                dex = self._clients[wallet] = self._create_dex(wallet)
+            return dex
+
+    def _create_dex(self, wallet=None) -> OKXDexSwap:
+        private_key = self.config.get(f"Wallet/{wallet}") if wallet else self.config.get("private_key")
+        if not private_key:
+            raise ValueError(f"找不到钱包 {wallet} 的私钥" if wallet else "config.json中没有私钥")
+        fee_mode = self.config.get("fee_mode", "legacy")
+        fee_urgency = self.config.get("fee_urgency", "normal")
+        if fee_urgency not in GasOracle.URGENCY_LEVELS:
+            fee_urgency = "normal"
+        return OKXDexSwap(
+            self.config.get("api_key"), self.config.get("api_secret"), self.config.get("passphrase"), private_key,
+            broadcast_rpcs=self.config.rpc_groups(),
+            rpc_selector=self.rpc_monitor if self.config.get("rpc_auto_select", True) else None,
+            fee_mode=fee_mode, fee_urgency=fee_urgency,
+            hedger=quote_hedger if self.config.get("hedge_quotes") else None
+        )
+
+    def _slippage(self, slippage=None) -> float:
+        """滑点参数与界面一致为百分比，返回小数"""
+        slippage = slippage if slippage is not None else self.config.get("slippage")
+        if not slippage:
+            raise ValueError("滑点不能为空")
+        return float(slippage) / 100
+
+    @staticmethod
+    def _summarize(result: dict) -> dict:
+        """去掉不能序列化的收据对象"""
+        summary = {key: value for key, value in result.items() if key not in ("receipt", "receipt_future")}
+        if result.get("receipt") is not None:
+            summary["status"] = result["receipt"]["status"]
+            summary["block_number"] = result["receipt"]["blockNumber"]
+        return summary
+
+    def buy(self, ca, amount=None, slippage=None, chain=None, wallet=None, wait=True, log=None) -> dict:
+        log = log or self.log
+        rpc, chain_id = self.resolve_chain(chain)
+        amount = amount or self.config.get("buy_amount")
+        if not ca or not amount:
+            raise ValueError("CA和买入金额不能为空")
+
+        dex = self.get_dex(wallet)
+        log(f"买入 {ca} 金额 {amount}")
+        result = BuyEngine(dex).run(ca, rpc, chain_id, amount, self._slippage(slippage), log=log, wait=wait)
+        if result["success"]:
+            # 与界面一致，买入成功的代币加入跟踪列表
+            self.config.append_unique("tracked_tokens", ca)
+        return self._summarize(result)
+
+    def sell(self, ca, ratio=None, slippage=None, chain=None, wallet=None, wait=True, log=None, amount=None) -> dict:
+        """按比例卖出钱包余额；amount为卖出数量（最小单位）时按该数量卖出，不超过余额"""
+        log = log or self.log
+        rpc, chain_id = self.resolve_chain(chain)
+        ratio = int(ratio or self.config.get("sell_ratio") or 100)
+        if not 1 <= ratio <= 100:
+            raise ValueError("卖出比例必须在1到100之间")
+
+        dex = self.get_dex(wallet)
+        log(f"卖出 {ca} 数量 {amount}" if amount is not None else f"卖出 {ca} 比例 {ratio}%")
+        result = SellEngine(dex).run(ca, rpc, chain_id, ratio, self._slippage(slippage), log=log, wait=wait,
+                                     amount=amount)
+        return self._summarize(result)
+
+    def quote(self, ca, side="buy", amount=None, ratio=None, slippage=None, chain=None, wallet=None) -> dict:
+        rpc, chain_id = self.resolve_chain(chain)
+        dex = self.get_dex(wallet)
+        if side == "buy":
+            amount = amount or self.config.get("buy_amount")
+            amount_wei = str(int(float(amount) * 1e18))
+            quote = dex.get_quote(BNB_ADDRESS, ca, self._slippage(slippage), amount_wei, chain_id)
+        else:
+            balance = dex.get_token_balance(ca, rpc)
+            amount_wei = str(calc_sell_amount(balance, int(ratio or self.config.get("sell_ratio") or 100)))
+            quote = dex.get_quote(ca, BNB_ADDRESS, self._slippage(slippage), amount_wei, chain_id)
+
+        if not quote or quote.get("code") != "0":
+            return {"success": False, "error": quote}
+        data = quote["data"][0]
+        to_decimals = int(data.get("toToken", {}).get("decimal", 18))
+        return {
+            "success": True,
+            "side": side,
+            "amount": amount_wei,
+            "to_token_amount": data["toTokenAmount"],
+            "to_token_amount_formatted": int(data["toTokenAmount"]) / 10 ** to_decimals,
+            "price_impact": data.get("priceImpactPercentage"),
+            "dex": data["quoteCompareList"][0]["dexName"] if data.get("quoteCompareList") else None
+        }
+
+    def balance(self, tokens=None, chain=None, wallet=None) -> dict:
+        """原生代币和代币余额，tokens为空时查询跟踪列表中的代币"""
+        rpc, chain_id = self.resolve_chain(chain)
+        dex = self.get_dex(wallet)
+        tokens = list(tokens or self.config.get("tracked_tokens", []))
+        native = dex.get_web3(rpc).eth.get_balance(dex.account.address)
+        states = dex.get_token_states(tokens, rpc, chain_id) if tokens else {}
+        return {
+            "success": True,
+            "address": dex.account.address,
+            "native": native / 1e18,
+            "tokens": {
+                token: {
+                    "balance": state["balance"],
+                    "decimals": state["decimals"],
+                    "formatted": state["balance"] / 10 ** state["decimals"]
+                } if state["balance"] is not None else {"error": "读取余额失败"}
+                for token, state in states.items()
+            }
+        }
+
+    def warm_up(self, chain=None, wallet=None):
+        """预先建立连接并初始化nonce和gas缓存，daemon启动时调用"""
+        rpc, chain_id = self.resolve_chain(chain)
+        self.get_dex(wallet).warm_up(rpc, chain_id)
+
+    def watch(self, tokens=None, take_profit=None, stop_loss=None, chain=None, wallet=None, on_sell=None) -> PriceWatcher:
+        """按命令行CA和config.json中的watchlist创建并启动止盈止损监控，触发时按条目的比例卖出"""
+        rpc, chain_id = self.resolve_chain(chain)
+        items = [{"ca": ca, "wallet": wallet, "tp": take_profit, "sl": stop_loss} for ca in tokens or []]
+        items += self.config.get("watchlist", [])
+        if not items:
+            raise ValueError("监控列表为空，请指定CA或在config.json中配置watchlist")
+
+        def sell(entry, reason):
+            try:
+                # 卖出数量为该条监控持仓数量amount的sell_ratio%，SellEngine再按钱包当前余额封顶
+                amount = entry["amount"] * entry["sell_ratio"] // 100
+                result = self.sell(entry["token"], chain=chain, wallet=entry["wallet"], amount=amount)
+            except Exception as e:
+                self.log(f"{entry['token']} 自动卖出失败: {str(e)}", "error")
+                result = {"success": False, "error": str(e)}
+            result.update(token=entry["token"], reason=reason, wallet=entry["wallet"], value=entry["value"], cost=entry["cost"])
+            if on_sell is not None:
+                on_sell(result)
+
+        watcher = PriceWatcher(self.get_dex(wallet), sell, log=self.log,
+                               min_interval=float(self.config.get("watch_min_interval", 1.0)),
+                               max_interval=float(self.config.get("watch_max_interval", 30.0)))
+        # 没有给出数量的条目按钱包一次性批量读取余额
+        balances = {}
+        for item in items:
+            item_wallet = item.get("wallet")
+            if item.get("amount") is None and item_wallet not in balances:
+                wallet_tokens = [i["ca"] for i in items if i.get("wallet") == item_wallet and i.get("amount") is None]
+                balances[item_wallet] = self.get_dex(item_wallet).get_token_states(wallet_tokens, rpc, chain_id)
+
+        for item in items:
+            ca = item["ca"]
+            if item.get("tp") is None and item.get("sl") is None:
+                raise ValueError(f"{ca} 没有设置止盈或止损")
+            if item.get("amount") is None:
+                amount = balances[item.get("wallet")][ca]["balance"]
+                if amount is None:
+                    self.log(f"{ca} 读取余额失败，跳过", "error")
+                    continue
+            else:
+                decimals = self.get_dex(item.get("wallet")).get_token_decimals(ca, rpc)
+                amount = int(float(item["amount"]) * 10 ** decimals)
+            if amount <= MIN_SELL_BALANCE:
+                self.log(f"{ca} 没有持仓，跳过", "warning")
+                continue
+            watcher.watch(ca, chain_id, amount, cost=item.get("cost"),
+                          take_profit=None if item.get("tp") is None else float(item["tp"]),
+                          stop_loss=None if item.get("sl") is None else float(item["sl"]),
+                          sell_ratio=int(item.get("ratio") or 100), wallet=item.get("wallet"), rpc_url=rpc)
+        watcher.start()
+        return watcher
+
+    def handle(self, command: dict, log=None, chain=None, wallet=None) -> dict:
+        """执行一条daemon/控制接口命令，log用于接收该命令的进度日志
+
+        命令中没有chain/wallet时使用chain/wallet参数（启动时的--chain/--wallet），再没有才使用config.json的默认值。
+        """
+        cmd = command.get("cmd")
+        common = {"chain": command.get("chain") or chain, "wallet": command.get("wallet") or wallet}
+        if cmd == "buy":
+            return self.buy(command["ca"], command.get("amount"), command.get("slippage"),
+                            wait=command.get("wait", True), log=log, **common)
+        if cmd == "sell":
+            return self.sell(command["ca"], command.get("ratio"), command.get("slippage"),
+                             wait=command.get("wait", True), log=log, **common)
+        if cmd == "quote":
+            return self.quote(command["ca"], command.get("side", "buy"), command.get("amount"), command.get("ratio"),
+                              command.get("slippage"), **common)
+        if cmd == "balance":
+            return self.balance(command.get("tokens"), **common)
+        if cmd == "ping":
+            return {"success": True}
+        raise ValueError(f"未知命令: {cmd}")
+
+
+def run_daemon(trader: HeadlessTrader, chain=None, wallet=None, stdin=None, stdout=None):
+    """逐行读取JSON命令并输出结果，直到标准输入结束"""
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    try:
+        trader.warm_up(chain, wallet)
+        trader.log("daemon已启动，等待命令")
+    except Exception as e:
+        trader.log(f"预热失败: {str(e)}", "warning")
+
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        command = {}
+        try:
+            command = json.loads(line)
+            response = trader.handle(command, chain=chain, wallet=wallet)
+        except Exception as e:
+            response = {"success": False, "error": str(e)}
+        if isinstance(command, dict) and "id" in command:
+            response["id"] = command["id"]
+        stdout.write(json.dumps(response, ensure_ascii=False, default=str) + "\n")
+        stdout.flush()
+
+
+def run_watch(trader: HeadlessTrader, tokens=None, take_profit=None, stop_loss=None, chain=None, wallet=None,
+              report_interval=30.0) -> dict:
+    """监控到全部触发或Ctrl+C为止，定期输出各代币的盈亏，返回自动卖出的结果"""
+    sells = []
+    watcher = trader.watch(tokens, take_profit, stop_loss, chain, wallet, on_sell=sells.append)
+    trader.log(f"开始监控 {len(watcher.snapshot())} 个持仓")
+    next_report = time.monotonic() + report_interval
+    try:
+        while True:
+            rows = watcher.snapshot()
+            if not rows:
+                break
+            if time.monotonic() >= next_report:
+                next_report += report_interval
+                for row in rows:
+                    pnl = "-" if row["pnl"] is None else f"{row['pnl']:+.2f}%"
+                    trader.log(f"{row['token']} {row['wallet'] or ''} 价值 {row['value'] or 0:.6f} 盈亏 {pnl} "
+                               f"间隔 {row['interval']:.1f}s")
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+    return {"success": all(result.get("success") for result in sells), "sells": sells}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="OKX Evm Swap Helper 命令行")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--chain", help="使用config.json中RPC/<名称>的RPC和链ID")
+    parser.add_argument("--wallet", help="使用config.json中Wallet/<名称>的私钥")
+    parser.add_argument("--slippage", help="滑点（百分比），默认使用配置")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    buy = subparsers.add_parser("buy", help="买入代币")
+    buy.add_argument("ca")
+    buy.add_argument("--amount", help="买入金额（原生代币），默认使用配置")
+    buy.add_argument("--no-wait", action="store_true", help="广播后立即返回，不等待收据")
+
+    sell = subparsers.add_parser("sell", help="卖出代币")
+    sell.add_argument("ca")
+    sell.add_argument("--ratio", type=int, help="卖出比例（1-100），默认使用配置")
+    sell.add_argument("--no-wait", action="store_true", help="广播后立即返回，不等待收据")
+
+    quote = subparsers.add_parser("quote", help="查询报价")
+    quote.add_argument("ca")
+    quote.add_argument("--side", choices=("buy", "sell"), default="buy")
+    quote.add_argument("--amount", help="买入金额（原生代币）")
+    quote.add_argument("--ratio", type=int, help="卖出比例（1-100）")
+
+    balance = subparsers.add_parser("balance", help="查询余额")
+    balance.add_argument("tokens", nargs="*", help="代币地址，默认查询跟踪列表")
+
+    subparsers.add_parser("daemon", help="常驻运行，从标准输入读取JSON命令")
+
+    serve = subparsers.add_parser("serve", help="常驻运行，提供本机HTTP/JSON控制接口")
+    serve.add_argument("--host", default="127.0.0.1", help="监听地址，默认只允许本机访问；非本机地址需在config.json中设置control_api_token")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--workers", type=int, default=4, help="同时执行的订单数")
+    serve.add_argument("--queue-size", type=int, default=100, help="排队和执行中的订单上限")
+
+    watch = subparsers.add_parser("watch", help="监控持仓价值，触及止盈/止损时自动卖出")
+    watch.add_argument("tokens", nargs="*", help="代币地址，持仓为钱包当前余额；另外监控config.json中的watchlist")
+    watch.add_argument("--tp", type=float, help="止盈：价值较开始监控时上涨的百分比")
+    watch.add_argument("--sl", type=float, help="止损：价值较开始监控时下跌的百分比")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    config_store.path = args.config
+    trader = HeadlessTrader()
+    try:
+        trader.load()
+        common = {"chain": args.chain, "wallet": args.wallet}
+        if args.command == "daemon":
+            run_daemon(trader, **common)
+            return 0
+        if args.command == "serve":
+            run_server(trader, args.host, args.port, args.workers, args.queue_size,
+                       token=trader.config.get("control_api_token"), **common)
+            return 0
+        if args.command == "watch":
+            result = run_watch(trader, args.tokens, args.tp, args.sl, **common)
+        elif args.command == "buy":
+            result = trader.buy(args.ca, args.amount, args.slippage, wait=not args.no_wait, **common)
+        elif args.command == "sell":
+            result = trader.sell(args.ca, args.ratio, args.slippage, wait=not args.no_wait, **common)
+        elif args.command == "quote":
+            result = trader.quote(args.ca, args.side, args.amount, args.ratio, args.slippage, **common)
+        else:
+            result = trader.balance(args.tokens, **common)
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+    finally:
+        trader.close()
+
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    # 只广播不等待时有交易哈希即视为成功
+    return 0 if result.get("success") or (result.get("tx_hash") and getattr(args, "no_wait", False)) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+"""本地HTTP/JSON控制接口：策略进程通过HTTP提交买入/卖出/报价，不经过图形界面
+
+    python cli.py serve [--port 8765] [--workers 4] [--queue-size 100]
+
+    POST /orders        请求体与daemon命令相同，例如 {"cmd": "buy", "ca": "0x...", "amount": "0.01"}
+                        默认等待执行完成后返回结果；
+                        "stream": true 时以NDJSON逐行返回进度事件，最后一行为 {"result": {...}}；
+                        "async": true 时立即返回订单ID，之后通过 GET /orders/<id> 查询
+    GET  /orders/<id>   订单状态、进度事件和结果
+    GET  /status        队列中的订单数、工作线程数
+
+默认只监听本机地址。POST必须使用Content-Type: application/json，带Origin头的请求（浏览器中的网页发出）一律拒绝，
+防止网页跨站提交订单。config.json中设置了control_api_token时所有请求需带 Authorization: Bearer <token>，
+监听非本机地址时必须设置。订单进入有界队列（队列满时返回429），由固定数量的工作线程执行，
+同一钱包的买卖按提交顺序串行执行，不同钱包之间并发；所有订单复用同一个预热好的客户端。
+"""
+import hmac
+import ipaddress
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Optional
+
+# 可以通过控制接口提交的命令
+ORDER_COMMANDS = ("buy", "sell", "quote", "balance")
+# 需要按钱包串行执行的命令（会发送交易）
+SERIAL_COMMANDS = ("buy", "sell")
+
+
+class Order:
+    """一笔订单：命令、执行状态、进度事件和结果"""
+
+    def __init__(self, order_id: int, command: dict):
+        self.id = order_id
+        self.command = command
+        # queued -> running -> done
+        self.status = "queued"
+        self.events = []
+        self.result = None
+        self.created_at = time.time()
+        self._cond = threading.Condition()
+
+    @property
+    def wallet_key(self):
+        """串行执行的钱包标识，查询类命令返回None不需要串行"""
+        if self.command.get("cmd") not in SERIAL_COMMANDS:
+            return None
+        return self.command.get("wallet") or ""
+
+    @property
+    def done(self) -> bool:
+        return self.status == "done"
+
+    def log(self, message, level="info"):
+        """交易流程的日志回调，每条日志记为一个进度事件"""
+        with self._cond:
+            self.events.append({"time": time.time(), "level": level, "message": str(message)})
+            self._cond.notify_all()
+
+    def set_running(self):
+        with self._cond:
+            self.status = "running"
+            self._cond.notify_all()
+
+    def finish(self, result: dict):
+        with self._cond:
+            self.result = result
+            self.status = "done"
+            self._cond.notify_all()
+
+    def wait(self, timeout=None) -> bool:
+        """等待订单执行完成，返回是否已完成"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.done, timeout)
+
+    def iter_events(self):
+        """按顺序产出进度事件，直到订单完成且事件全部产出"""
+        index = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: index < len(self.events) or self.done)
+                events = self.events[index:]
+                done = self.done
+            index += len(events)
+            yield from events
+            if done and not events:
+                return
+
+    def to_dict(self) -> dict:
+        with self._cond:
+            return {
+                "id": self.id,
+                "cmd": self.command.get("cmd"),
+                "status": self.status,
+                "created_at": self.created_at,
+                "events": list(self.events),
+                "result": self.result
+            }
+
+
+class OrderQueue:
+    """有界订单队列和工作线程池
+
+    同一钱包同一时间只有一笔买卖在执行：钱包忙时后到的订单挂在该钱包的等待队列上，
+    当前订单完成后由同一个工作线程接着执行，不占用其他工作线程。
+    """
+
+    def __init__(self, trader, workers=4, max_pending=100, history=1000, chain=None, wallet=None):
+        self.trader = trader
+        self.workers = workers
+        # 启动时的--chain/--wallet，订单没有指定时使用
+        self.chain = chain
+        self.wallet = wallet
+        # 排队和执行中的订单上限
+        self.max_pending = max_pending
+        # 保留最近多少笔订单供查询
+        self.history = history
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        # 钱包 -> 等待该钱包的订单，键存在表示该钱包有订单在执行
+        self._busy_wallets = {}
+        self._orders = OrderedDict()
+        self._ids = count(1)
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"order-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """执行完已取出的订单后退出工作线程"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, command: dict) -> Order:
+        """提交订单，队列已满时抛出queue.Full，命令无效时抛出ValueError
+
+        命令中没有chain/wallet时先填入启动参数，串行执行按填入后的钱包判断。
+        """
+        if command.get("cmd") not in ORDER_COMMANDS:
+            raise ValueError(f"未知命令: {command.get('cmd')}")
+        if command.get("cmd") in ("buy", "sell", "quote") and not command.get("ca"):
+            raise ValueError("CA不能为空")
+        command = dict(command, chain=command.get("chain") or self.chain, wallet=command.get("wallet") or self.wallet)
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise queue.Full
+            self._pending += 1
+            order = Order(next(self._ids), command)
+            self._orders[order.id] = order
+            while len(self._orders) > self.history:
+                self._orders.popitem(last=False)
+        self._queue.put(order)
+        return order
+
+    def get(self, order_id: int) -> Order:
+        with self._lock:
+            return self._orders.get(order_id)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "workers": self.workers,
+                "busy_wallets": len(self._busy_wallets)
+            }
+
+    def _worker(self):
+        while True:
+            order = self._queue.get()
+            if order is None:
+                return
+            if not self._acquire(order):
+                # 同一钱包有订单在执行，由那个工作线程接着执行
+                continue
+            while order is not None:
+                self._execute(order)
+                order = self._release(order)
+
+    def _acquire(self, order: Order) -> bool:
+        key = order.wallet_key
+        if key is None:
+            return True
+        with self._lock:
+            if key in self._busy_wallets:
+                self._busy_wallets[key].append(order)
+                return False
+            self._busy_wallets[key] = deque()
+            return True
+
+    def _release(self, order: Order) -> Optional[Order]:
+        """订单完成，返回同一钱包的下一笔订单（没有则释放钱包）"""
+        key = order.wallet_key
+        with self._lock:
+            self._pending -= 1
+            if key is None:
+                return None
+            waiting = self._busy_wallets[key]
+            if waiting:
+                return waiting.popleft()
+            del self._busy_wallets[key]
+            return None
+
+    def _execute(self, order: Order):
+        order.set_running()
+        try:
+            result = self.trader.handle(order.command, log=order.log)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        order.finish(result)
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    server_version = "SwapHelper"
+
+    def _authorize(self) -> bool:
+        """拒绝浏览器网页发出的请求和没有正确令牌的请求，已发送错误响应时返回False"""
+        if self.headers.get("Origin") is not None:
+            self._send_json(403, {"success": False, "error": "不接受浏览器跨站请求"})
+            return False
+        token = self.server.token
+        if token:
+            auth = self.headers.get("Authorization") or ""
+            if not hmac.compare_digest(auth.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+                self._send_json(401, {"success": False, "error": "令牌无效"})
+                return False
+        return True
+
+    def do_GET(self):
+        if not self._authorize():
+            return
+        orders = self.server.orders
+        if self.path == "/status":
+            self._send_json(200, orders.status())
+            return
+        if self.path.startswith("/orders/"):
+            try:
+                order = orders.get(int(self.path[len("/orders/"):]))
+            except ValueError:
+                order = None
+            if order is None:
+                self._send_json(404, {"success": False, "error": "订单不存在"})
+            else:
+                self._send_json(200, order.to_dict())
+            return
+        self._send_json(404, {"success": False, "error": "接口不存在"})
+
+    def do_POST(self):
+        if not self._authorize():
+            return
+        if self.path != "/orders":
+            self._send_json(404, {"success": False, "error": "接口不存在"})
+            return
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self._send_json(415, {"success": False, "error": "Content-Type必须为application/json"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            command = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(command, dict):
+                raise ValueError("请求体必须是JSON对象")
+            order = self.server.orders.submit(command)
+        except queue.Full:
+            self._send_json(429, {"success": False, "error": "订单队列已满"})
+            return
+        except ValueError as e:
+            self._send_json(400, {"success": False, "error": str(e)})
+            return
+
+        if command.get("async"):
+            self._send_json(202, {"success": True, "id": order.id})
+        elif command.get("stream"):
+            self._stream(order)
+        else:
+            order.wait()
+            self._send_json(200, dict(order.result, id=order.id))
+
+    def _stream(self, order: Order):
+        """逐行输出进度事件，最后一行为结果；响应没有长度，输出完毕后关闭连接"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self._write_line({"id": order.id, "status": "queued"})
+        for event in order.iter_events():
+            self._write_line(event)
+        self._write_line({"id": order.id, "result": order.result})
+
+    def _write_line(self, data: dict):
+        self.wfile.write((json.dumps(data, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def _send_json(self, status: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.log(f"{self.address_string()} {format % args}", "debug")
+
+
+class ControlServer(ThreadingHTTPServer):
+    """每个HTTP连接一个线程，实际执行交易的是OrderQueue的工作线程"""
+
+    daemon_threads = True
+
+    def __init__(self, address, orders: OrderQueue, log, token=None):
+        super().__init__(address, ControlRequestHandler)
+        self.orders = orders
+        self.log = log
+        self.token = token
+
+
+def run_server(trader, host="127.0.0.1", port=8765, workers=4, queue_size=100, chain=None, wallet=None,
+               token=None):
+    """预热客户端后启动控制接口，直到Ctrl+C；监听非本机地址时必须提供token"""
+    if not token and not is_loopback(host):
+        raise ValueError("监听非本机地址时必须在config.json中设置control_api_token")
+    try:
+        trader.warm_up(chain, wallet)
+    except Exception as e:
+        trader.log(f"预热失败: {str(e)}", "warning")
+
+    orders = OrderQueue(trader, workers=workers, max_pending=queue_size, chain=chain, wallet=wallet)
+    orders.start()
+    server = ControlServer((host, port), orders, trader.log, token)
+    trader.log(f"控制接口已启动: http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        orders.stop()
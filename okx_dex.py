@@ -0,0 +1,3136 @@
+"""OKX DEX交易核心：OKX接口客户端、链上读写、nonce/授权/收据/gas缓存以及买卖流程
+
+不依赖tkinter，图形界面(SwapHelper.py)、命令行(cli.py)共用。
+"""
+import asyncio
+import base64
+import heapq
+import hmac
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlencode
+
+import aiohttp
+import requests
+from eth_account import Account
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from web3 import AsyncWeb3, Web3
+from web3.datastructures import AttributeDict
+
+from swap_config import FEE_URGENCY_LEVELS, JsonlLogWriter
+
+
+# ERC20代币ABI
+ERC20_ABI = [
+    # balanceOf
+    {
+        "constant": True,
+        "inputs": [{"name": "_owner", "type": "address"}],
+        "name": "balanceOf",
+        "outputs": [{"name": "balance", "type": "uint256"}],
+        "type": "function"
+    },
+    # allowance
+    {
+        "constant": True,
+        "inputs": [
+            {"name": "_owner", "type": "address"},
+            {"name": "_spender", "type": "address"}
+        ],
+        "name": "allowance",
+        "outputs": [{"name": "", "type": "uint256"}],
+        "type": "function"
+    },
+    # decimals
+    {
+        "constant": True,
+        "inputs": [],
+        "name": "decimals",
+        "outputs": [{"name": "", "type": "uint8"}],
+        "type": "function"
+    },
+    # approve
+    {
+        "constant": False,
+        "inputs": [
+            {"name": "_spender", "type": "address"},
+            {"name": "_value", "type": "uint256"}
+        ],
+        "name": "approve",
+        "outputs": [{"name": "", "type": "bool"}],
+        "type": "function"
+    }
+]
+
+
+class BatchingHTTPProvider(Web3.HTTPProvider):
+    """把多个线程几乎同时发出的JSON-RPC请求合并为一个批量请求
+
+    没有其他请求在进行时直接发送，不等待；已有请求在进行时，新到达的第一个请求等待window秒
+    收集同一交易步骤中并发发出的其他请求（余额、gas、nonce等），然后一次POST发出，按顺序把响应分发给各自的调用方。
+    节点拒绝某一批时这一批逐个重发；连续BATCH_REJECTIONS_TO_DISABLE次明确拒绝后停止合并，
+    BATCH_RETRY_AFTER秒后再尝试。超时、连接中断等传输错误直接返回给调用方，不重发。
+    广播交易不等待合并窗口、不参与合并，直接发送。
+    """
+
+    # 直接发送的方法：重发可能重复广播，且位于交易的关键路径上
+    DIRECT_METHODS = ("eth_sendRawTransaction",)
+    # 限流、请求过大，只说明这一批不行，不代表节点不支持批量请求
+    TRANSIENT_STATUS = (413, 429)
+    BATCH_REJECTIONS_TO_DISABLE = 3
+    BATCH_RETRY_AFTER = 300.0
+
+    def __init__(self, endpoint_uri, window=0.002, max_batch=50, **kwargs):
+        super().__init__(endpoint_uri, **kwargs)
+        self.window = window
+        self.max_batch = max_batch
+        self._batch_lock = threading.Lock()
+        self._pending = []
+        # 正在进行的请求数（包括直接发送的）
+        self._in_flight = 0
+        # 连续被明确拒绝的批次数和停止合并的截止时间
+        self._batch_rejections = 0
+        self._batch_disabled_until = 0.0
+
+    def make_request(self, method, params):
+        if self.window <= 0 or method in self.DIRECT_METHODS or time.monotonic() < self._batch_disabled_until:
+            return super().make_request(method, params)
+
+        entry = (method, params, Future())
+        with self._batch_lock:
+            self._in_flight += 1
+            # 没有其他请求在进行，等待窗口也收集不到别的请求
+            direct = self._in_flight == 1 and not self._pending
+            if not direct:
+                self._pending.append(entry)
+                # 第一个加入等待队列的线程负责发送这一批
+                leader = len(self._pending) == 1
+        try:
+            if direct:
+                return super().make_request(method, params)
+            if leader:
+                time.sleep(self.window)
+                with self._batch_lock:
+                    batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+                    remaining = bool(self._pending)
+                if remaining:
+                    # 超出单批上限的请求交给新的线程发送
+                    threading.Thread(target=self._flush_pending, daemon=True).start()
+                self._send(batch)
+            return entry[2].result()
+        finally:
+            with self._batch_lock:
+                self._in_flight -= 1
+
+    def _flush_pending(self):
+        while True:
+            with self._batch_lock:
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if not batch:
+                return
+            self._send(batch)
+
+    def _send(self, batch: list):
+        """发送一批请求并完成对应的Future"""
+        if len(batch) == 1:
+            self._send_single(batch[0])
+            return
+
+        rejected = False
+        try:
+            responses = super().make_batch_request([(method, params) for method, params, _ in batch])
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status is None or status >= 500:
+                self._fail(batch, e)
+                return
+            # 413/429只是这一批不行，其他4xx视为节点拒绝批量请求
+            responses = None
+            rejected = status not in self.TRANSIENT_STATUS
+        except ValueError:
+            # 响应不是JSON（例如代理返回的错误页面）
+            responses = None
+        except Exception as e:
+            # 传输错误时节点可能已经处理了这一批，不重发也不关闭合并
+            self._fail(batch, e)
+            return
+        else:
+            # 返回单个错误对象或数量不符：节点不支持批量请求
+            rejected = not isinstance(responses, list) or len(responses) != len(batch)
+
+        if responses is None or rejected:
+            if rejected:
+                self._record_rejection()
+            # 这一批未被执行，逐个重发
+            for entry in batch:
+                self._send_single(entry)
+            return
+
+        with self._batch_lock:
+            self._batch_rejections = 0
+        for (_, _, future), response in zip(batch, responses):
+            future.set_result(response)
+
+    def _record_rejection(self):
+        with self._batch_lock:
+            self._batch_rejections += 1
+            if self._batch_rejections >= self.BATCH_REJECTIONS_TO_DISABLE:
+                self._batch_rejections = 0
+                self._batch_disabled_until = time.monotonic() + self.BATCH_RETRY_AFTER
+
+    @staticmethod
+    def _fail(batch: list, error: Exception):
+        for _, _, future in batch:
+            future.set_exception(error)
+
+    def _send_single(self, entry):
+        method, params, future = entry
+        try:
+            future.set_result(super().make_request(method, params))
+        except Exception as e:
+            future.set_exception(e)
+
+
+class Web3Registry:
+    """按RPC地址缓存Web3实例，按(RPC, 代币地址)缓存合约实例
+
+    batch_window大于0时，同一RPC上并发发出的请求合并为JSON-RPC批量请求（见BatchingHTTPProvider）。
+    """
+
+    def __init__(self, timeout=10, pool_size=10, batch_window=0.002):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        self._web3 = {}
+        self._sessions = {}
+        self._contracts = {}
+
+    def get_web3(self, rpc_url: str) -> Web3:
+        """获取RPC对应的Web3实例，不存在时创建（每个RPC独立的连接池）"""
+        w3 = self._web3.get(rpc_url)
+        if w3 is not None:
+            return w3
+
+        with self._lock:
+            w3 = self._web3.get(rpc_url)
+            if w3 is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                provider = BatchingHTTPProvider(rpc_url, window=self.batch_window,
+                                                request_kwargs={"timeout": self.timeout}, session=session)
+                w3 = Web3(provider)
+                self._sessions[rpc_url] = session
+                self._web3[rpc_url] = w3
+            return w3
+
+    def get_contract(self, rpc_url: str, token_address: str):
+        """获取缓存的ERC20合约实例"""
+        address = Web3.to_checksum_address(token_address)
+        key = (rpc_url, address)
+        contract = self._contracts.get(key)
+        if contract is not None:
+            return contract
+
+        w3 = self.get_web3(rpc_url)
+        with self._lock:
+            contract = self._contracts.get(key)
+            if contract is None:
+                contract = w3.eth.contract(address=address, abi=ERC20_ABI)
+                self._contracts[key] = contract
+            return contract
+
+    def close(self):
+        """关闭所有RPC连接并清空缓存"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._web3.clear()
+            self._contracts.clear()
+
+
+# 原生代币地址
+BNB_ADDRESS = "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
+
+# 最大授权额度
+MAX_ALLOWANCE = 2 ** 256 - 1
+
+# 低于该余额视为没有可卖出的代币
+MIN_SELL_BALANCE = 100000000
+
+
+def calc_sell_amount(token_balance: int, sell_ratio) -> int:
+    """根据卖出比例计算卖出数量"""
+    if int(sell_ratio) == 100:
+        return token_balance
+    return int(token_balance * int(sell_ratio) / 100)
+
+
+# 进程内共享的Web3注册表
+web3_registry = Web3Registry()
+
+
+# Multicall3在绝大多数EVM链上部署在同一地址
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+MULTICALL3_ABI = [
+    # aggregate3
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"name": "target", "type": "address"},
+                    {"name": "allowFailure", "type": "bool"},
+                    {"name": "callData", "type": "bytes"}
+                ],
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"name": "success", "type": "bool"},
+                    {"name": "returnData", "type": "bytes"}
+                ],
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
+# 读取不到精度时使用的默认值
+DEFAULT_DECIMALS = 18
+
+
+class Erc20Reader:
+    """批量读取ERC20余额、授权额度和精度
+
+    任意多个(钱包, 代币, 授权接收方)的读取合并为一次Multicall3 aggregate3调用；
+    RPC所在链没有部署Multicall3时退回为一次JSON-RPC批量eth_call。代币精度不会变化，读取后一直缓存。
+    """
+
+    # 单次aggregate3最多包含的调用数，避免超出节点eth_call的gas上限
+    MAX_CALLS = 500
+
+    def __init__(self, registry: Web3Registry):
+        self.registry = registry
+        self._lock = threading.Lock()
+        # (RPC, 代币地址小写) -> 精度
+        self._decimals = {}
+        # RPC -> Multicall3合约实例，未部署时为None
+        self._multicall = {}
+
+    def read(self, rpc_url: str, items) -> dict:
+        """items为(钱包, 代币, 授权接收方)元组，钱包或授权接收方为None时不读取对应的值
+
+        返回 元组 -> {'balance', 'allowance', 'decimals'}，未读取或读取失败的余额/授权额度为None，
+        精度读取失败时为DEFAULT_DECIMALS。
+        """
+        items = list(items)
+        calls = []
+        decimals_needed = {}
+        for wallet, token, spender in items:
+            if wallet:
+                calls.append((token, "balanceOf", [Web3.to_checksum_address(wallet)]))
+                if spender:
+                    calls.append((token, "allowance", [Web3.to_checksum_address(wallet),
+                                                       Web3.to_checksum_address(spender)]))
+            key = (rpc_url, token.lower())
+            if key not in self._decimals and key not in decimals_needed:
+                decimals_needed[key] = len(calls)
+                calls.append((token, "decimals", []))
+
+        values = self._execute(rpc_url, calls) if calls else []
+        with self._lock:
+            for key, index in decimals_needed.items():
+                # decimals()返回uint8，超出范围说明不是标准ERC20
+                if values[index] is not None and values[index] <= 255:
+                    self._decimals[key] = values[index]
+
+        results = {}
+        position = 0
+        for item in items:
+            wallet, token, spender = item
+            state = {"balance": None, "allowance": None, "decimals": None}
+            if wallet:
+                state["balance"] = values[position]
+                position += 1
+                if spender:
+                    state["allowance"] = values[position]
+                    position += 1
+            key = (rpc_url, token.lower())
+            if decimals_needed.get(key) == position:
+                position += 1
+            state["decimals"] = self._decimals.get(key, DEFAULT_DECIMALS)
+            results[item] = state
+        return results
+
+    def balances(self, rpc_url: str, wallet: str, tokens: list) -> dict:
+        """一个钱包的多个代币余额，返回 代币地址 -> 余额（读取失败为0）"""
+        states = self.read(rpc_url, [(wallet, token, None) for token in tokens])
+        return {token: states[(wallet, token, None)]["balance"] or 0 for token in tokens}
+
+    def decimals(self, rpc_url: str, token: str) -> int:
+        key = (rpc_url, token.lower())
+        if key not in self._decimals:
+            self.read(rpc_url, [(None, token, None)])
+        return self._decimals.get(key, DEFAULT_DECIMALS)
+
+    def _get_multicall(self, rpc_url: str):
+        """获取RPC对应链上的Multicall3合约，首次使用时检查是否已部署"""
+        if rpc_url not in self._multicall:
+            w3 = self.registry.get_web3(rpc_url)
+            address = Web3.to_checksum_address(MULTICALL3_ADDRESS)
+            deployed = len(w3.eth.get_code(address)) > 0
+            with self._lock:
+                self._multicall[rpc_url] = w3.eth.contract(address=address, abi=MULTICALL3_ABI) if deployed else None
+        return self._multicall[rpc_url]
+
+    @staticmethod
+    def _decode_uint(w3: Web3, data) -> Optional[int]:
+        if not data or len(data) < 32:
+            return None
+        return int(w3.codec.decode(["uint256"], bytes(data[:32]))[0])
+
+    def _execute(self, rpc_url: str, calls: list) -> list:
+        """执行(代币, 函数名, 参数)调用，返回与calls对应的整数结果，失败的为None"""
+        try:
+            multicall = self._get_multicall(rpc_url)
+        except Exception:
+            multicall = None
+        if multicall is not None:
+            try:
+                return self._execute_multicall(rpc_url, multicall, calls)
+            except Exception:
+                # Multicall3调用失败时退回批量请求
+                pass
+        return self._execute_batch(rpc_url, calls)
+
+    def _execute_multicall(self, rpc_url: str, multicall, calls: list) -> list:
+        w3 = self.registry.get_web3(rpc_url)
+        values = []
+        for offset in range(0, len(calls), self.MAX_CALLS):
+            chunk = calls[offset:offset + self.MAX_CALLS]
+            requests_ = [
+                (Web3.to_checksum_address(token), True,
+                 self.registry.get_contract(rpc_url, token).encode_abi(fn_name, args=args))
+                for token, fn_name, args in chunk
+            ]
+            for success, data in multicall.functions.aggregate3(requests_).call():
+                values.append(self._decode_uint(w3, data) if success else None)
+        return values
+
+    def _execute_batch(self, rpc_url: str, calls: list) -> list:
+        """一次JSON-RPC批量eth_call，单个调用失败只影响自己的结果"""
+        w3 = self.registry.get_web3(rpc_url)
+        requests_ = [
+            ("eth_call", [{"to": Web3.to_checksum_address(token),
+                           "data": self.registry.get_contract(rpc_url, token).encode_abi(fn_name, args=args)},
+                          "latest"])
+            for token, fn_name, args in calls
+        ]
+        try:
+            responses = w3.provider.make_batch_request(requests_)
+            if not isinstance(responses, list) or len(responses) != len(requests_):
+                raise ValueError(responses)
+        except Exception:
+            # RPC不支持批量请求时逐个查询
+            responses = []
+            for method, params in requests_:
+                try:
+                    responses.append(w3.provider.make_request(method, params))
+                except Exception:
+                    responses.append(None)
+
+        values = []
+        for response in responses:
+            result = response.get("result") if isinstance(response, dict) else None
+            values.append(self._decode_uint(w3, Web3.to_bytes(hexstr=result)) if result else None)
+        return values
+
+
+# 进程内共享的ERC20批量读取器
+erc20_reader = Erc20Reader(web3_registry)
+
+
+class NonceManager:
+    """按(链ID, 地址)在本地分配nonce，只在首次使用时从链上pending数量初始化"""
+
+    # 出现这些错误说明本地nonce与链上状态不一致，需要重新同步
+    RESYNC_ERRORS = ("nonce too low", "already known", "replacement transaction underpriced", "nonce too high")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._next = {}
+        self._free = {}
+
+    @staticmethod
+    def _key(chain_id, address):
+        return int(chain_id), address.lower()
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _seed(self, w3: Web3, key, address: str):
+        """首次使用时从链上pending数量初始化（调用方需持有该key的锁）"""
+        if key not in self._next:
+            if w3 is None:
+                raise RuntimeError("nonce尚未初始化")
+            self._next[key] = w3.eth.get_transaction_count(address, "pending")
+            self._free[key] = []
+
+    def is_seeded(self, chain_id, address: str) -> bool:
+        return self._key(chain_id, address) in self._next
+
+    def seed(self, chain_id, address: str, pending_count: int):
+        """使用外部获取的pending数量初始化（已初始化时忽略），供异步客户端使用"""
+        key = self._key(chain_id, address)
+        with self._key_lock(key):
+            if key not in self._next:
+                self._next[key] = pending_count
+                self._free[key] = []
+
+    def allocate(self, w3: Web3, chain_id, address: str) -> int:
+        """分配下一个可用nonce，优先复用之前归还的nonce"""
+        key = self._key(chain_id, address)
+        with self._key_lock(key):
+            self._seed(w3, key, address)
+            free = self._free[key]
+            if free:
+                free.sort()
+                return free.pop(0)
+            nonce = self._next[key]
+            self._next[key] = nonce + 1
+            return nonce
+
+    def release(self, chain_id, address: str, nonce: int):
+        """交易未能广播时归还nonce，避免后续交易卡在空缺的nonce上"""
+        key = self._key(chain_id, address)
+        with self._key_lock(key):
+            if key not in self._next:
+                return
+            if self._next[key] == nonce + 1:
+                self._next[key] = nonce
+            elif nonce < self._next[key] and nonce not in self._free[key]:
+                self._free[key].append(nonce)
+
+    def prime(self, w3: Web3, chain_id, address: str):
+        """提前从链上初始化nonce，不分配"""
+        key = self._key(chain_id, address)
+        with self._key_lock(key):
+            self._seed(w3, key, address)
+
+    def reset(self, chain_id, address: str):
+        """丢弃本地状态，下次分配时重新从链上读取"""
+        key = self._key(chain_id, address)
+        with self._key_lock(key):
+            self._next.pop(key, None)
+            self._free.pop(key, None)
+
+    def reconcile(self, chain_id, address: str, nonce: int, error: Exception):
+        """根据发送失败的原因归还nonce或重新同步"""
+        message = str(error).lower()
+        if any(text in message for text in self.RESYNC_ERRORS):
+            self.reset(chain_id, address)
+        else:
+            self.release(chain_id, address, nonce)
+
+
+# 进程内共享的nonce管理器
+nonce_manager = NonceManager()
+
+
+class AllowanceCache:
+    """持久化的授权缓存
+
+    记录每条链的授权接收方（带有效期）以及已知为最大额度的授权
+    (chain_id, wallet, token, spender)，命中时卖出可跳过OKX授权接口和链上allowance查询。
+    修改只更新内存，debounce秒内的多次修改由后台定时器合并为一次原子写盘，交易流程中不做磁盘I/O。
+    """
+
+    def __init__(self, path="allowance_cache.json", spender_ttl=3600, debounce=0.5):
+        self.path = path
+        self.spender_ttl = spender_ttl
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        # 串行化写盘，避免两个定时器同时替换文件
+        self._write_lock = threading.Lock()
+        self._loaded = False
+        self._spenders = {}
+        self._approved = {}
+        self._timer = None
+
+    @staticmethod
+    def _allowance_key(chain_id, wallet: str, token: str, spender: str) -> str:
+        return f"{int(chain_id)}:{wallet.lower()}:{token.lower()}:{spender.lower()}"
+
+    def _load(self):
+        """首次访问时从文件加载（调用方需持有锁）"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+                self._spenders = data.get("spenders", {})
+                self._approved = data.get("allowances", {})
+        except Exception:
+            # 缓存文件损坏时直接丢弃，重新查询即可
+            self._spenders = {}
+            self._approved = {}
+
+    def _save(self):
+        """安排写盘，debounce时间内的多次修改只写一次（调用方需持有锁）"""
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(self.debounce, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """立即原子写入尚未落盘的修改，退出前调用"""
+        # 先取得写锁再复制数据，保证较新的数据不会被较旧的覆盖
+        with self._write_lock:
+            with self._lock:
+                if self._timer is None:
+                    return
+                self._timer.cancel()
+                self._timer = None
+                data = {"spenders": dict(self._spenders), "allowances": dict(self._approved)}
+            try:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f, indent=4)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                # 缓存可以重新查询，写盘失败时丢弃
+                pass
+
+    def get_spender(self, chain_id) -> Optional[str]:
+        """获取未过期的授权接收方地址"""
+        with self._lock:
+            self._load()
+            entry = self._spenders.get(str(int(chain_id)))
+            if entry and time.time() - entry["updated"] < self.spender_ttl:
+                return entry["address"]
+            return None
+
+    def set_spender(self, chain_id, address: str):
+        with self._lock:
+            self._load()
+            self._spenders[str(int(chain_id))] = {"address": address, "updated": time.time()}
+            self._save()
+
+    def is_max_approved(self, chain_id, wallet: str, token: str, spender: str) -> bool:
+        with self._lock:
+            self._load()
+            return self._allowance_key(chain_id, wallet, token, spender) in self._approved
+
+    def mark_approved(self, chain_id, wallet: str, token: str, spender: str):
+        with self._lock:
+            self._load()
+            self._approved[self._allowance_key(chain_id, wallet, token, spender)] = time.time()
+            self._save()
+
+    def invalidate(self, chain_id=None, wallet: str = None, token: str = None):
+        """清除匹配的授权记录，不传参数时清空全部（包括授权接收方）"""
+        with self._lock:
+            self._load()
+            if chain_id is None and wallet is None and token is None:
+                self._spenders.clear()
+                self._approved.clear()
+            else:
+                for key in list(self._approved):
+                    key_chain, key_wallet, key_token, _ = key.split(":")
+                    if chain_id is not None and key_chain != str(int(chain_id)):
+                        continue
+                    if wallet is not None and key_wallet != wallet.lower():
+                        continue
+                    if token is not None and key_token != token.lower():
+                        continue
+                    del self._approved[key]
+            self._save()
+
+
+# 进程内共享的授权缓存
+allowance_cache = AllowanceCache()
+
+
+class RawTxBroadcaster:
+    """把签名后的原始交易同时广播到同一条链的所有RPC
+
+    第一个成功确认的RPC即视为广播成功，"already known"一类错误说明交易已在该节点的交易池中，同样算成功。
+    每个RPC的确认耗时都会记录下来。
+    """
+
+    ALREADY_KNOWN_ERRORS = ("already known", "known transaction", "already imported", "alreadyknown")
+
+    def __init__(self, registry: Web3Registry, max_workers=16, history=50):
+        self.registry = registry
+        self.history = history
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self.latencies = {}
+
+    def _record(self, rpc_url: str, latency_ms: float):
+        with self._lock:
+            samples = self.latencies.setdefault(rpc_url, deque(maxlen=self.history))
+            samples.append(latency_ms)
+
+    def _send_one(self, rpc_url: str, raw_tx: bytes, acks: dict):
+        start = time.perf_counter()
+        try:
+            self.registry.get_web3(rpc_url).eth.send_raw_transaction(raw_tx)
+            error = None
+        except Exception as e:
+            message = str(e).lower()
+            error = None if any(text in message for text in self.ALREADY_KNOWN_ERRORS) else e
+        latency_ms = (time.perf_counter() - start) * 1000
+        if error is None:
+            self._record(rpc_url, latency_ms)
+            acks[rpc_url] = latency_ms
+        else:
+            acks[rpc_url] = str(error)
+        return error
+
+    def broadcast(self, raw_tx: bytes, rpc_urls: list):
+        """并发广播，返回(交易哈希, 各RPC确认情况)，确认情况为 url -> 耗时毫秒或错误信息
+
+        返回的字典在其余RPC完成后会继续被更新。全部失败时抛出第一个错误。
+        """
+        tx_hash = Web3.keccak(raw_tx)
+        acks = {}
+        futures = [self._pool.submit(self._send_one, rpc_url, raw_tx, acks) for rpc_url in rpc_urls]
+        errors = []
+        for future in as_completed(futures):
+            error = future.result()
+            if error is None:
+                return tx_hash, acks
+            errors.append(error)
+        raise errors[0]
+
+    def average_latency(self, rpc_url: str) -> Optional[float]:
+        with self._lock:
+            samples = self.latencies.get(rpc_url)
+            return sum(samples) / len(samples) if samples else None
+
+
+# 进程内共享的交易广播器
+raw_tx_broadcaster = RawTxBroadcaster(web3_registry)
+
+
+class ReceiptTracker:
+    """共享的交易收据跟踪器
+
+    每条链一个后台线程跟踪最新区块高度，区块前进时用一次JSON-RPC批量请求查询所有待确认交易的收据，
+    查到后完成对应的Future。Future的回调在独立线程池中执行，不会阻塞跟踪线程。
+    """
+
+    RECEIPT_INT_FIELDS = ("status", "blockNumber", "gasUsed", "cumulativeGasUsed", "effectiveGasPrice",
+                          "transactionIndex", "type")
+
+    def __init__(self, registry: Web3Registry, poll_interval=0.5):
+        self.registry = registry
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._chains = {}
+        self._callbacks = ThreadPoolExecutor(max_workers=4)
+
+    def track(self, tx_hash, rpc_url: str, chain_id, timeout=120) -> Future:
+        """开始跟踪交易，返回在收据到达时完成的Future，超时抛出TimeoutError"""
+        tx_hash = Web3.to_hex(tx_hash) if not isinstance(tx_hash, str) else tx_hash
+        future = Future()
+        key = str(int(chain_id))
+        with self._lock:
+            chain = self._chains.setdefault(key, {"rpc_url": rpc_url, "pending": {}, "thread": None})
+            chain["rpc_url"] = rpc_url
+            chain["pending"][tx_hash.lower()] = (future, time.time() + timeout)
+            if chain["thread"] is None or not chain["thread"].is_alive():
+                chain["thread"] = threading.Thread(target=self._run, args=(key,), daemon=True)
+                chain["thread"].start()
+        return future
+
+    @classmethod
+    def _format_receipt(cls, raw: dict) -> AttributeDict:
+        receipt = dict(raw)
+        for field in cls.RECEIPT_INT_FIELDS:
+            if isinstance(receipt.get(field), str):
+                receipt[field] = int(receipt[field], 16)
+        return AttributeDict(receipt)
+
+    def _fetch_receipts(self, w3: Web3, tx_hashes: list) -> tuple:
+        """批量查询收据，返回 (交易哈希 -> 原始收据（未上链的不包含）, 查询成功的交易哈希集合)
+
+        查询失败的交易不在集合中，下一轮（不必等到新区块）重新查询。
+        """
+        requests_ = [("eth_getTransactionReceipt", [tx_hash]) for tx_hash in tx_hashes]
+        try:
+            responses = w3.provider.make_batch_request(requests_)
+            if not isinstance(responses, list) or len(responses) != len(requests_):
+                raise ValueError(responses)
+        except Exception:
+            # RPC不支持批量请求时逐个查询，单个请求失败不影响其他交易
+            responses = []
+            for method, params in requests_:
+                try:
+                    responses.append(w3.provider.make_request(method, params))
+                except Exception:
+                    responses.append(None)
+
+        receipts = {}
+        queried = set()
+        for tx_hash, response in zip(tx_hashes, responses):
+            if not isinstance(response, dict) or "error" in response:
+                continue
+            queried.add(tx_hash)
+            result = response.get("result")
+            if result:
+                receipts[result["transactionHash"].lower()] = result
+        return receipts, queried
+
+    def _resolve(self, future: Future, receipt=None, error=None):
+        """在回调线程池中完成Future"""
+        if error is not None:
+            self._callbacks.submit(future.set_exception, error)
+        else:
+            self._callbacks.submit(future.set_result, receipt)
+
+    def _run(self, key: str):
+        last_block = None
+        checked = set()
+        while True:
+            with self._lock:
+                chain = self._chains[key]
+                pending = dict(chain["pending"])
+                rpc_url = chain["rpc_url"]
+                if not pending:
+                    chain["thread"] = None
+                    return
+
+            try:
+                w3 = self.registry.get_web3(rpc_url)
+                block_number = w3.eth.block_number
+                # 出现新区块时查询全部待确认交易，否则只查询本区块内还没查过的新交易
+                if block_number != last_block:
+                    last_block = block_number
+                    checked = set()
+                to_check = [tx_hash for tx_hash in pending if tx_hash not in checked]
+                if to_check:
+                    receipts, queried = self._fetch_receipts(w3, to_check)
+                    checked.update(queried)
+                    with self._lock:
+                        for tx_hash, raw in receipts.items():
+                            entry = chain["pending"].pop(tx_hash, None)
+                            if entry is not None:
+                                self._resolve(entry[0], receipt=self._format_receipt(raw))
+            except Exception:
+                # 网络错误时下一轮重试，超时由下面统一处理
+                pass
+
+            now = time.time()
+            with self._lock:
+                for tx_hash, (future, deadline) in list(chain["pending"].items()):
+                    if now > deadline:
+                        del chain["pending"][tx_hash]
+                        self._resolve(future, error=TimeoutError(f"等待交易收据超时: {tx_hash}"))
+
+            time.sleep(self.poll_interval)
+
+
+# 进程内共享的收据跟踪器
+receipt_tracker = ReceiptTracker(web3_registry)
+
+
+class GasOracle:
+    """按链缓存的gas费用预言机
+
+    每条链一个后台线程跟踪区块高度，出现新区块时刷新gas价格（EIP-1559模式下同时刷新eth_feeHistory），
+    交易时直接返回缓存值，省去每次发送前的一次RPC往返。一段时间没有使用时后台线程自动退出。
+    """
+
+    # 紧急程度 -> 小费取最近区块优先费的百分位
+    URGENCY_LEVELS = FEE_URGENCY_LEVELS
+    # 参与统计的最近区块数
+    FEE_HISTORY_BLOCKS = 5
+    # maxFeePerGas = baseFee * 倍数 + 小费，base fee连续上涨几个区块交易仍可打包
+    BASE_FEE_MULTIPLIER = 2
+
+    def __init__(self, registry: Web3Registry, poll_interval=1.0, max_age=30, idle_timeout=120):
+        self.registry = registry
+        self.poll_interval = poll_interval
+        # 缓存超过该时间（秒）未刷新则同步重新获取
+        self.max_age = max_age
+        # 超过该时间（秒）没有使用则停止后台刷新
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._chains = {}
+
+    def get_fees(self, rpc_url: str, chain_id, mode="legacy", urgency="normal") -> dict:
+        """返回可直接放入交易的费用字段
+
+        legacy模式返回 {'gasPrice'}，eip1559模式返回 {'maxFeePerGas', 'maxPriorityFeePerGas'}，
+        链不支持EIP-1559时回退为legacy。
+        """
+        if urgency not in self.URGENCY_LEVELS:
+            raise ValueError(f"未知的紧急程度: {urgency}")
+        key = str(int(chain_id))
+        eip1559 = mode == "eip1559"
+        with self._lock:
+            chain = self._chains.setdefault(key, {"rpc_url": rpc_url, "eip1559": False, "snapshot": None,
+                                                 "last_used": 0, "thread": None})
+            chain["rpc_url"] = rpc_url
+            chain["last_used"] = time.time()
+            if eip1559:
+                chain["eip1559"] = True
+            snapshot = chain["snapshot"]
+
+        if (snapshot is None or time.time() - snapshot["updated"] > self.max_age
+                or (eip1559 and "base_fee" not in snapshot)):
+            snapshot = self.refresh(rpc_url, chain_id)
+
+        with self._lock:
+            if chain["thread"] is None or not chain["thread"].is_alive():
+                chain["thread"] = threading.Thread(target=self._run, args=(key,), daemon=True)
+                chain["thread"].start()
+        return self._fee_fields(snapshot, eip1559, urgency)
+
+    def refresh(self, rpc_url: str, chain_id) -> dict:
+        """立即从RPC获取费用并更新缓存"""
+        key = str(int(chain_id))
+        with self._lock:
+            chain = self._chains.get(key)
+            eip1559 = bool(chain and chain["eip1559"])
+        snapshot = self._fetch(self.registry.get_web3(rpc_url), eip1559)
+        with self._lock:
+            if key in self._chains:
+                self._chains[key]["snapshot"] = snapshot
+        return snapshot
+
+    def _fetch(self, w3: Web3, eip1559: bool) -> dict:
+        snapshot = {"gas_price": w3.eth.gas_price, "updated": time.time()}
+        if not eip1559:
+            return snapshot
+
+        percentiles = list(self.URGENCY_LEVELS.values())
+        try:
+            history = w3.eth.fee_history(self.FEE_HISTORY_BLOCKS, "latest", percentiles)
+            # 最后一个元素是下一个区块的base fee
+            base_fee = history["baseFeePerGas"][-1]
+            rewards = history.get("reward") or []
+        except Exception:
+            # 不支持EIP-1559的链
+            snapshot["base_fee"] = None
+            return snapshot
+
+        priority_fees = {}
+        for index, urgency in enumerate(self.URGENCY_LEVELS):
+            samples = sorted(block[index] for block in rewards if len(block) > index)
+            priority_fees[urgency] = samples[len(samples) // 2] if samples else 0
+        snapshot["base_fee"] = base_fee
+        snapshot["priority_fees"] = priority_fees
+        return snapshot
+
+    def _fee_fields(self, snapshot: dict, eip1559: bool, urgency: str) -> dict:
+        if not eip1559 or snapshot.get("base_fee") is None:
+            return {"gasPrice": snapshot["gas_price"]}
+
+        base_fee = snapshot["base_fee"]
+        priority_fee = snapshot["priority_fees"][urgency]
+        if priority_fee <= 0:
+            # 最近区块没有小费数据时用节点建议的gas价格推算
+            priority_fee = max(snapshot["gas_price"] - base_fee, 0)
+        return {
+            "maxFeePerGas": base_fee * self.BASE_FEE_MULTIPLIER + priority_fee,
+            "maxPriorityFeePerGas": priority_fee
+        }
+
+    def _run(self, key: str):
+        last_block = None
+        while True:
+            with self._lock:
+                chain = self._chains[key]
+                rpc_url = chain["rpc_url"]
+                if time.time() - chain["last_used"] > self.idle_timeout:
+                    chain["thread"] = None
+                    return
+
+            try:
+                w3 = self.registry.get_web3(rpc_url)
+                block_number = w3.eth.block_number
+                # 首次只记录区块高度，缓存刚由get_fees获取过
+                if last_block is not None and block_number != last_block:
+                    self.refresh(rpc_url, key)
+                last_block = block_number
+            except Exception:
+                # 网络错误时下一轮重试，缓存过期后由get_fees同步获取
+                pass
+
+            time.sleep(self.poll_interval)
+
+
+# 进程内共享的gas费用预言机
+gas_oracle = GasOracle(web3_registry)
+
+
+class RpcHealthMonitor:
+    """后台探测所有配置的RPC并按链给出排名
+
+    每轮对每个RPC调用eth_blockNumber，记录延迟、相对同链其他节点的区块落后数和错误率。
+    连续失败达到阈值的RPC会被熔断一段时间，期间不参与选择；冷却后重新探测成功即恢复。
+    """
+
+    def __init__(self, registry: Web3Registry, interval=10.0, max_lag=3, failure_threshold=3,
+                 cooldown=30.0, history=20):
+        self.registry = registry
+        self.interval = interval
+        self.max_lag = max_lag
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.history = history
+        self._lock = threading.Lock()
+        self._chains = {}
+        self._chain_of = {}
+        self._stats = {}
+        self._pool = ThreadPoolExecutor(max_workers=8)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def set_endpoints(self, chains: dict):
+        """设置要探测的RPC: 链ID -> [url, ...]"""
+        with self._lock:
+            self._chains = {str(chain_id): list(urls) for chain_id, urls in chains.items()}
+            self._chain_of = {url: chain_id for chain_id, urls in self._chains.items() for url in urls}
+            for url in self._chain_of:
+                self._stats.setdefault(url, {
+                    "latencies": deque(maxlen=self.history),
+                    "errors": deque(maxlen=self.history),
+                    "block": None,
+                    "failures": 0,
+                    "open_until": 0.0,
+                })
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return
+        # 每次启动使用新的停止事件，stop()之后立即start()时旧线程仍会按自己的事件退出
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop_event,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread = None
+
+    def record_success(self, rpc_url: str, latency_ms: float, block_number=None):
+        with self._lock:
+            stats = self._stats.get(rpc_url)
+            if stats is None:
+                return
+            stats["latencies"].append(latency_ms)
+            stats["errors"].append(False)
+            stats["failures"] = 0
+            stats["open_until"] = 0.0
+            if block_number is not None:
+                stats["block"] = block_number
+
+    def record_failure(self, rpc_url: str):
+        """记录一次失败，连续失败达到阈值时熔断"""
+        with self._lock:
+            stats = self._stats.get(rpc_url)
+            if stats is None:
+                return
+            stats["errors"].append(True)
+            stats["failures"] += 1
+            if stats["failures"] >= self.failure_threshold:
+                stats["open_until"] = time.time() + self.cooldown
+
+    def _probe(self, rpc_url: str):
+        start = time.perf_counter()
+        try:
+            block_number = self.registry.get_web3(rpc_url).eth.block_number
+        except Exception:
+            self.record_failure(rpc_url)
+            return
+        self.record_success(rpc_url, (time.perf_counter() - start) * 1000, block_number)
+
+    def probe_once(self):
+        """探测一轮所有RPC"""
+        with self._lock:
+            urls = list(self._chain_of)
+        for future in [self._pool.submit(self._probe, url) for url in urls]:
+            future.result()
+
+    def _run(self, stop_event: threading.Event):
+        while not stop_event.is_set():
+            try:
+                self.probe_once()
+            except Exception:
+                pass
+            stop_event.wait(self.interval)
+
+    def snapshot(self, chain_id) -> list:
+        """返回该链所有RPC的状态，按排名排序（健康的在前，延迟低的在前）"""
+        now = time.time()
+        with self._lock:
+            urls = self._chains.get(str(chain_id), [])
+            heights = [self._stats[url]["block"] for url in urls if self._stats[url]["block"] is not None]
+            top = max(heights) if heights else None
+            rows = []
+            for url in urls:
+                stats = self._stats[url]
+                latencies = stats["latencies"]
+                errors = stats["errors"]
+                lag = top - stats["block"] if top is not None and stats["block"] is not None else None
+                error_rate = sum(errors) / len(errors) if errors else 0.0
+                circuit_open = stats["open_until"] > now
+                healthy = (not circuit_open and bool(latencies) and error_rate < 0.5
+                           and lag is not None and lag <= self.max_lag)
+                rows.append({
+                    "url": url,
+                    "latency_ms": sum(latencies) / len(latencies) if latencies else None,
+                    "lag": lag,
+                    "error_rate": error_rate,
+                    "circuit_open": circuit_open,
+                    "healthy": healthy,
+                })
+        rows.sort(key=lambda row: (not row["healthy"], row["latency_ms"] if row["latency_ms"] is not None else float("inf")))
+        return rows
+
+    def ranked(self, chain_id) -> list:
+        return [row["url"] for row in self.snapshot(chain_id)]
+
+    def best_for(self, rpc_url: str) -> str:
+        """返回与rpc_url同一条链上最好的健康RPC，没有探测数据时原样返回"""
+        with self._lock:
+            chain_id = self._chain_of.get(rpc_url)
+        if chain_id is None:
+            return rpc_url
+        for row in self.snapshot(chain_id):
+            if row["healthy"]:
+                return row["url"]
+        return rpc_url
+
+
+# 进程内共享的RPC健康监控
+rpc_health_monitor = RpcHealthMonitor(web3_registry)
+
+
+# 当前线程正在记录的交易阶段：(TradeTrace, 阶段名)
+_trace_context = threading.local()
+
+
+class TradeTrace:
+    """一笔交易的耗时span树
+
+    引擎通过_timed_call记录顶层阶段（报价、交换、发送等），阶段内部的签名、HTTP请求、gas价格、nonce、
+    签名交易和广播由trace_span记录为子span，父span为当前线程正在执行的阶段。
+    """
+
+    def __init__(self, side: str, token_address: str, chain_id):
+        self.side = side
+        self.token_address = token_address
+        self.chain_id = chain_id
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        # {"name", "parent", "start_ms", "ms"}，start_ms为相对交易开始的时间
+        self.spans = []
+        # 顶层阶段 -> 耗时（毫秒），即结果中的timings
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, parent: Optional[str], start: float, end: float):
+        """记录一个span，start/end为time.perf_counter()的值"""
+        span = {"name": name, "parent": parent, "start_ms": (start - self.started) * 1000, "ms": (end - start) * 1000}
+        with self._lock:
+            self.spans.append(span)
+            if parent is None:
+                self.timings[name] = span["ms"]
+
+    @contextmanager
+    def span(self, name: str):
+        """记录一个span，在当前线程的某个阶段内调用时为该阶段的子span"""
+        previous = getattr(_trace_context, "current", None)
+        parent = previous[1] if previous is not None and previous[0] is self else None
+        # 只保留两层：阶段内再嵌套的span都记在该阶段下
+        _trace_context.current = (self, name if parent is None else parent)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, parent, start, time.perf_counter())
+            _trace_context.current = previous
+
+    def end_receipt(self):
+        """记录从交易发出到拿到收据的耗时"""
+        with self._lock:
+            send = next((span for span in self.spans if span["name"] == "send" and span["parent"] is None), None)
+        if send is not None:
+            start = self.started + (send["start_ms"] + send["ms"]) / 1000
+            self.add("receipt", None, start, time.perf_counter())
+
+    def tree(self) -> list:
+        """按开始时间排序的span树"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        nodes = [dict(span, children=[]) for span in spans]
+        roots = []
+        for node in nodes:
+            parent = next((item for item in nodes if item["parent"] is None and item["name"] == node["parent"]), None)
+            if node["parent"] is None or parent is None:
+                roots.append(node)
+            else:
+                parent["children"].append(node)
+        for node in nodes:
+            del node["parent"]
+        return roots
+
+    def format_line(self) -> str:
+        """一行毫秒耗时明细，例如 quote 80(sign 0.1, http 79.6) | swap 86 | ... | total 570"""
+        parts = []
+        for node in self.tree():
+            part = f"{node['name']} {node['ms']:.0f}"
+            if node["children"]:
+                part += "(" + ", ".join(f"{child['name']} {child['ms']:.1f}" for child in node["children"]) + ")"
+            parts.append(part)
+        parts.append(f"total {(time.perf_counter() - self.started) * 1000:.0f}")
+        return " | ".join(parts)
+
+    def to_record(self, tx_hash=None, success=False) -> dict:
+        return {
+            "time": datetime.fromtimestamp(self.started_at).isoformat(timespec="milliseconds"),
+            "side": self.side,
+            "token": self.token_address,
+            "chain_id": str(self.chain_id),
+            "tx_hash": tx_hash,
+            "success": success,
+            "total_ms": (time.perf_counter() - self.started) * 1000,
+            "spans": self.tree()
+        }
+
+
+@contextmanager
+def trace_span(name: str):
+    """在当前线程正在记录的交易阶段内记录一个子span，没有正在记录的交易时不做任何事"""
+    current = getattr(_trace_context, "current", None)
+    if current is None:
+        yield
+        return
+    with current[0].span(name):
+        yield
+
+
+def bind_trace(func):
+    """让func在其他线程中执行时，其中的trace_span仍记在当前线程正在记录的阶段下"""
+    current = getattr(_trace_context, "current", None)
+
+    def wrapper(*args, **kwargs):
+        previous = getattr(_trace_context, "current", None)
+        _trace_context.current = current
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _trace_context.current = previous
+
+    return wrapper
+
+
+def trace_record(name: str, start: float, end: float):
+    """为当前阶段补记一个已知起止时间的子span"""
+    current = getattr(_trace_context, "current", None)
+    if current is not None:
+        current[0].add(name, current[1], start, end)
+
+
+class TradeTraceRecorder:
+    """交易结束（拿到收据或失败）时把耗时明细写入日志，并把span树追加到JSONL文件"""
+
+    def __init__(self, path=os.path.join("logs", "trades.jsonl")):
+        self.path = path
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def report(self, trace: TradeTrace, result: dict, log=None):
+        """交易已广播时等收据到达后再输出，否则立即输出"""
+        receipt_future = result.get('receipt_future')
+        if receipt_future is None:
+            self._emit(trace, result, log)
+            return
+
+        def on_receipt(future):
+            trace.end_receipt()
+            success = future.exception() is None and future.result()['status'] == 1
+            self._emit(trace, result, log, success)
+
+        receipt_future.add_done_callback(on_receipt)
+
+    def _emit(self, trace: TradeTrace, result: dict, log=None, success=None):
+        if log is not None:
+            log(f"耗时(ms): {trace.format_line()}")
+        try:
+            self.record(trace.to_record(result.get('tx_hash'), result['success'] if success is None else success))
+        except OSError:
+            # 记录失败不影响交易
+            pass
+
+    def record(self, data: dict):
+        with self._lock:
+            if self._writer is None:
+                self._writer = JsonlLogWriter(self.path)
+        self._writer.write_record(data)
+
+    def close(self):
+        """写完尚未落盘的记录"""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+# 进程内共享的交易耗时记录
+trade_trace_recorder = TradeTraceRecorder()
+
+
+class OkxRateLimiter:
+    """按API Key共享的令牌桶限流，覆盖所有聚合器接口（quote、swap、approve-transaction）
+
+    交易请求优先：有交易请求在等待时后台请求（如报价预取）不取令牌，且后台请求总要给交易留出reserve个令牌。
+    被限流后速率减半并在Retry-After内暂停发放令牌，之后每次成功逐步恢复到上限（加性增、乘性减），
+    请求量稳定在接口允许的上限附近，而不是把请求浪费在被拒绝上。
+    """
+
+    PRIORITY_TRADE = 0
+    PRIORITY_BACKGROUND = 1
+
+    def __init__(self, rate=10.0, burst=None, min_rate=0.5, reserve=1):
+        # 每秒请求数上限和令牌桶容量
+        self.max_rate = rate
+        self.burst = burst or rate
+        self.min_rate = min_rate
+        self.reserve = reserve
+        self._cond = threading.Condition()
+        # API Key -> 令牌桶状态
+        self._buckets = {}
+
+    def set_rate(self, rate, burst=None):
+        with self._cond:
+            self.max_rate = rate
+            self.burst = burst or rate
+            for bucket in self._buckets.values():
+                bucket["rate"] = rate
+                bucket["tokens"] = min(bucket["tokens"], self.burst)
+            self._cond.notify_all()
+
+    def _bucket(self, key) -> dict:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = {
+                "tokens": float(self.burst), "rate": self.max_rate, "updated": time.monotonic(),
+                "paused_until": 0.0, "waiting_trades": 0, "throttled": 0
+            }
+        return bucket
+
+    def _refill(self, bucket: dict, now: float):
+        """按当前速率补充令牌，暂停期间不补充"""
+        start = max(bucket["updated"], bucket["paused_until"])
+        if now > start:
+            bucket["tokens"] = min(self.burst, bucket["tokens"] + (now - start) * bucket["rate"])
+        bucket["updated"] = max(bucket["updated"], now)
+
+    def acquire(self, key, priority=PRIORITY_TRADE, timeout=None) -> bool:
+        """取一个令牌，返回是否在timeout秒内取到"""
+        trade = priority == self.PRIORITY_TRADE
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            bucket = self._bucket(key)
+            if trade:
+                bucket["waiting_trades"] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(bucket, now)
+                    needed = 1 if trade else min(1 + self.reserve, self.burst)
+                    if (now >= bucket["paused_until"] and bucket["tokens"] >= needed
+                            and (trade or bucket["waiting_trades"] == 0)):
+                        bucket["tokens"] -= 1
+                        return True
+                    wait = max(bucket["paused_until"] - now, (needed - bucket["tokens"]) / bucket["rate"], 0.001)
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                if trade:
+                    bucket["waiting_trades"] -= 1
+                    self._cond.notify_all()
+
+    def on_throttled(self, key, retry_after=0.0):
+        """请求被限流：速率减半，retry_after秒内（至少一个令牌的时间）不再发放令牌"""
+        with self._cond:
+            bucket = self._bucket(key)
+            now = time.monotonic()
+            self._refill(bucket, now)
+            bucket["rate"] = max(self.min_rate, bucket["rate"] / 2)
+            bucket["tokens"] = min(bucket["tokens"], 0.0)
+            bucket["paused_until"] = max(bucket["paused_until"], now + max(retry_after, 1 / bucket["rate"]))
+            bucket["throttled"] += 1
+
+    def on_success(self, key):
+        """请求成功，速率向上限恢复"""
+        with self._cond:
+            bucket = self._bucket(key)
+            if bucket["rate"] < self.max_rate:
+                bucket["rate"] = min(self.max_rate, bucket["rate"] + self.max_rate * 0.05)
+
+    def stats(self, key) -> dict:
+        with self._cond:
+            bucket = self._bucket(key)
+            return {"rate": bucket["rate"], "tokens": bucket["tokens"], "throttled": bucket["throttled"]}
+
+
+# 进程内共享的OKX接口限流器
+okx_rate_limiter = OkxRateLimiter()
+
+
+class QuoteHedger:
+    """报价请求对冲，降低尾部延迟
+
+    报价请求开始执行后超过最近延迟的percentile分位数仍未返回时，再发送一次相同的已签名请求，使用先返回的结果。
+    对冲请求使用单独的线程池，批量交易占满主请求线程时也能立即发出。
+    对冲请求数不超过最近window次报价的budget比例，避免在OKX整体变慢时把请求量翻倍。
+    样本不足min_samples时按default_delay秒触发。
+    """
+
+    def __init__(self, percentile=90, budget=0.1, window=200, min_samples=20, default_delay=0.5, min_delay=0.02,
+                 max_workers=16, hedge_workers=4):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self._lock = threading.Lock()
+        # 最近请求的延迟（毫秒）和最近报价是否发出了对冲请求
+        self._latencies = deque(maxlen=window)
+        self._hedged = deque(maxlen=window)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="quote-primary")
+        self._hedge_pool = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="quote-hedge")
+
+    def delay(self) -> float:
+        """触发对冲前等待的秒数"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.default_delay
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index] / 1000)
+
+    def _record(self, hedged: bool, check_budget=False) -> bool:
+        """记录一次报价是否对冲；check_budget为True时在同一把锁内检查并占用预算，超出预算时记为未对冲"""
+        with self._lock:
+            if check_budget and sum(self._hedged) + 1 > self.budget * (len(self._hedged) + 1):
+                hedged = False
+            self._hedged.append(hedged)
+            return hedged
+
+    def _timed(self, func, started: threading.Event = None):
+        start = time.perf_counter()
+        if started is not None:
+            started.set()
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._latencies.append((time.perf_counter() - start) * 1000)
+
+    def call(self, func):
+        """执行func（失败时返回None），开始执行后超过对冲延迟仍未返回且预算允许时并发再执行一次，返回先得到的非None结果
+
+        主请求线程池占满、请求在对冲延迟内没能开始执行时直接发出对冲请求。
+        """
+        func = bind_trace(func)
+        delay = self.delay()
+        started = threading.Event()
+        primary = self._pool.submit(self._timed, func, started)
+        # 对冲延迟从请求真正开始时计时，不包括在线程池中排队的时间
+        if started.wait(delay) and wait([primary], timeout=delay).done:
+            self._record(False)
+            return primary.result()
+        if not self._record(True, check_budget=True):
+            return primary.result()
+
+        pending = {primary, self._hedge_pool.submit(self._timed, func)}
+        result = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result is not None:
+                    # 还在排队的请求取消，已开始的较慢请求继续在后台完成，结果丢弃
+                    for other in pending:
+                        other.cancel()
+                    return result
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hedged": sum(self._hedged), "quotes": len(self._hedged), "samples": len(self._latencies)}
+
+
+# 进程内共享的报价对冲器，延迟统计在所有客户端之间共享
+quote_hedger = QuoteHedger()
+
+
+class OKXDexBase:
+    """OKX DEX客户端的公共部分：账户、签名、请求参数和交易构建，不涉及任何I/O"""
+
+    base_url = "https://www.okx.com"
+
+    def __init__(self, api_key, api_secret, passphrase, private_key, nonces=None, allowances=None):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.passphrase = passphrase
+        self.private_key = private_key
+        # 本地nonce分配器
+        self.nonces = nonces or nonce_manager
+        # 授权接收方和授权额度缓存
+        self.allowances = allowances or allowance_cache
+
+        # 验证参数
+        if not all([self.api_key, self.api_secret, self.passphrase, self.private_key]):
+            raise ValueError("请确保所有API参数都已正确设置")
+
+        try:
+            self.account = Account.from_key(self.private_key)
+        except Exception as e:
+            raise ValueError(f"私钥格式错误: {e}")
+
+    def generate_sign(self, timestamp: str, method: str, request_path: str, body: str = '') -> str:
+        """生成OKX API签名"""
+        if str(body) == '{}' or str(body) == 'None':
+            body = ''
+        message = timestamp + method + request_path + str(body)
+
+        try:
+            mac = hmac.new(
+                bytes(self.api_secret, encoding='utf8'),
+                bytes(message, encoding='utf-8'),
+                digestmod='sha256'
+            )
+            d = mac.digest()
+            return base64.b64encode(d).decode('utf-8')
+        except Exception as e:
+            # print(f"生成签名时发生错误: {e}")
+            raise
+
+    def _signed_request(self, endpoint: str, params: dict):
+        """构建带签名的GET请求路径和请求头"""
+        timestamp = str(int(time.time() * 1000))
+        method = 'GET'
+
+        # 使用urlencode确保参数正确编码
+        query_string = urlencode(sorted(params.items()))
+        full_path = f"{endpoint}?{query_string}"
+
+        # 生成签名
+        with trace_span("sign"):
+            signature = self.generate_sign(timestamp, method, full_path)
+
+        headers = {
+            "OK-ACCESS-KEY": self.api_key,
+            "OK-ACCESS-SIGN": signature,
+            "OK-ACCESS-TIMESTAMP": timestamp,
+            "OK-ACCESS-PASSPHRASE": self.passphrase,
+            "Content-Type": "application/json"
+        }
+        return full_path, headers
+
+    def _quote_params(self, from_token: str, to_token: str, slippage, amount: str, chain_id) -> dict:
+        return {
+            "chainId": chain_id,
+            "fromTokenAddress": from_token,
+            "toTokenAddress": to_token,
+            "amount": amount,
+            "slippage": str(slippage),
+            "userAddr": self.account.address
+        }
+
+    def _swap_params(self, quote_data: list, slippage) -> dict:
+        return {
+            "chainId": quote_data[0]["chainId"],
+            "fromTokenAddress": quote_data[0]["fromToken"]["tokenContractAddress"],
+            "toTokenAddress": quote_data[0]["toToken"]["tokenContractAddress"],
+            "amount": quote_data[0]["fromTokenAmount"],
+            "userWalletAddress": self.account.address,
+            "slippage": str(slippage),
+            "dexId": quote_data[0]["quoteCompareList"][0]["dexName"].replace(" ", "")
+        }
+
+    @staticmethod
+    def _approve_params(token_address: str, chain_id) -> dict:
+        return {
+            "chainId": chain_id,
+            "tokenContractAddress": token_address,
+            "approveAmount": "10"  # 2^256-1
+        }
+
+    def _build_swap_transaction(self, tx_data: dict, fees: dict, chain_id) -> dict:
+        """根据swap接口返回的交易数据构建交易对象（不含nonce）
+
+        fees为 {'gasPrice'} 或 {'maxFeePerGas', 'maxPriorityFeePerGas'}
+        """
+        gas_limit = int(tx_data['gas']) * 2  # 增加gas限制
+        transaction = {
+            'from': self.account.address,
+            'to': tx_data['to'],
+            'value': int(tx_data['value']),
+            'gas': gas_limit,  # 增加gas限制
+            'data': tx_data['data'],
+            'chainId': int(chain_id)  # 确保chainId是整数
+        }
+        if 'gasPrice' in fees:
+            transaction['gasPrice'] = int(fees['gasPrice'] * 1.01)  # 增加1%的gas价格
+        else:
+            transaction['maxFeePerGas'] = fees['maxFeePerGas']
+            transaction['maxPriorityFeePerGas'] = fees['maxPriorityFeePerGas']
+        return transaction
+
+    def _approve_transaction_fields(self, fees: dict, nonce: int, chain_id) -> dict:
+        return {
+            'from': self.account.address,
+            'gas': 2100000,
+            **fees,
+            'nonce': nonce,
+            'chainId': int(chain_id)
+        }
+
+    def invalidate_allowance(self, token_address: str, chain_id):
+        """授权可能已失效（如卖出回滚）时清除该代币的缓存"""
+        self.allowances.invalidate(chain_id, self.account.address, token_address)
+
+
+class OKXDexSwap(OKXDexBase):
+    # OKX接口限流的错误码（Too Many Requests）
+    THROTTLE_CODE = "50011"
+    # 被限流时最多重试次数和指数退避的基数（秒）
+    THROTTLE_RETRIES = 4
+    THROTTLE_BACKOFF = 0.25
+
+    def __init__(self, api_key, api_secret, passphrase, private_key,
+                 timeout=(3.05, 10), retries=2, pool_size=10, registry=None, nonces=None, allowances=None,
+                 session=None, broadcast_rpcs=None, broadcaster=None, rpc_selector=None, receipts=None,
+                 fee_oracle=None, fee_mode="legacy", fee_urgency="normal", reader=None, rate_limiter=None,
+                 hedger=None):
+        super().__init__(api_key, api_secret, passphrase, private_key, nonces=nonces, allowances=allowances)
+        # 请求超时 (连接超时, 读取超时)，单位秒
+        self.timeout = timeout
+        # Web3实例和合约实例缓存
+        self.registry = registry or web3_registry
+        # 同时广播交易的RPC: 链ID -> [url, ...]
+        self.broadcast_rpcs = broadcast_rpcs or {}
+        self.broadcaster = broadcaster or raw_tx_broadcaster
+        # 最近一次广播各RPC的确认情况
+        self.last_broadcast_acks = {}
+        # RPC健康监控，设置后读写自动使用同一条链上最好的健康RPC
+        self.rpc_selector = rpc_selector
+        # 共享的收据跟踪器
+        self.receipts = receipts or receipt_tracker
+        # gas费用缓存，fee_mode为legacy或eip1559，fee_urgency见GasOracle.URGENCY_LEVELS
+        self.fee_oracle = fee_oracle or gas_oracle
+        self.fee_mode = fee_mode
+        self.fee_urgency = fee_urgency
+        # ERC20批量读取（Multicall3）
+        self.reader = reader or erc20_reader
+        # 同一API Key共享的限流器
+        self.rate_limiter = rate_limiter or okx_rate_limiter
+        # 报价对冲（QuoteHedger），None为不对冲
+        self.hedger = hedger
+
+        # 所有OKX接口共用一个长连接会话，避免每次请求都重新握手；多个客户端可共用外部传入的会话
+        self._owns_session = session is None
+        self.session = session or self._build_session(retries, pool_size)
+
+    @staticmethod
+    def _build_session(retries, pool_size) -> requests.Session:
+        """创建带连接池、keep-alive和重试策略的HTTP会话"""
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=0.2,
+            # 429由限流器处理（退避并降低速率），这里只重试服务端错误
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Connection": "keep-alive"})
+        return session
+
+    def _get(self, full_path: str, headers: dict, priority=OkxRateLimiter.PRIORITY_TRADE) -> requests.Response:
+        """通过共享会话发送GET请求
+
+        发送前从API Key的令牌桶取令牌，被限流时带抖动指数退避后重试，重试用尽时返回最后一次的响应。
+        """
+        url = self.base_url + full_path
+        for attempt in range(self.THROTTLE_RETRIES + 1):
+            self.rate_limiter.acquire(self.api_key, priority)
+            with trace_span("http"):
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            retry_after = self._throttle_delay(response)
+            if retry_after is None:
+                self.rate_limiter.on_success(self.api_key)
+                return response
+            self.rate_limiter.on_throttled(self.api_key, retry_after)
+            if attempt < self.THROTTLE_RETRIES:
+                # full jitter，之后的acquire还会等到Retry-After结束
+                time.sleep(random.uniform(0, self.THROTTLE_BACKOFF * 2 ** attempt))
+        return response
+
+    @classmethod
+    def _throttle_delay(cls, response: requests.Response) -> Optional[float]:
+        """被限流时返回Retry-After秒数（没有时为0），否则返回None"""
+        if response.status_code != 429:
+            if response.status_code != 200 or cls.THROTTLE_CODE.encode() not in response.content:
+                return None
+            try:
+                if response.json().get("code") != cls.THROTTLE_CODE:
+                    return None
+            except ValueError:
+                return None
+        try:
+            return float(response.headers.get("Retry-After") or 0)
+        except ValueError:
+            return 0.0
+
+    def close(self):
+        """关闭HTTP会话，释放连接池"""
+        if self._owns_session:
+            self.session.close()
+
+    def resolve_rpc(self, rpc_url: str) -> str:
+        """返回实际使用的RPC（启用健康监控时为同链最好的健康RPC）"""
+        if self.rpc_selector is None:
+            return rpc_url
+        return self.rpc_selector.best_for(rpc_url)
+
+    def get_web3(self, rpc_url: str) -> Web3:
+        return self.registry.get_web3(self.resolve_rpc(rpc_url))
+
+    def get_fees(self, rpc_url: str, chain_id) -> dict:
+        """从gas费用缓存获取交易费用字段"""
+        with trace_span("gas_price"):
+            return self.fee_oracle.get_fees(self.resolve_rpc(rpc_url), chain_id, mode=self.fee_mode,
+                                            urgency=self.fee_urgency)
+
+    def warm_up(self, rpc_url: str, chain_id):
+        """预先建立到OKX和RPC的长连接，并初始化nonce和gas缓存，第一笔交易不再承担这些往返"""
+        try:
+            self.session.head(self.base_url, timeout=self.timeout)
+        except requests.RequestException:
+            # 只是为了建立连接，失败时第一笔交易再连接
+            pass
+        w3 = self.get_web3(rpc_url)
+        self.nonces.prime(w3, chain_id, self.account.address)
+        self.get_fees(rpc_url, chain_id)
+
+    def _broadcast_urls(self, w3: Web3, chain_id) -> list:
+        """当前RPC加上同一条链上配置的其他RPC"""
+        rpc_urls = [w3.provider.endpoint_uri]
+        for rpc_url in self.broadcast_rpcs.get(str(int(chain_id)), []):
+            if rpc_url not in rpc_urls:
+                rpc_urls.append(rpc_url)
+        return rpc_urls
+
+    def _sign_and_send(self, w3: Web3, transaction: dict, chain_id):
+        """签名并广播交易，失败时归还或重新同步nonce"""
+        try:
+            with trace_span("sign_tx"):
+                signed_txn = w3.eth.account.sign_transaction(transaction, self.private_key)
+            rpc_urls = self._broadcast_urls(w3, chain_id)
+            if len(rpc_urls) == 1:
+                with trace_span("broadcast"):
+                    start = time.perf_counter()
+                    tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+                # 只有一个RPC时，节点接受交易即为最早看到交易的时间
+                trace_record("first_seen", start, time.perf_counter())
+                return tx_hash
+            # 同一条链有多个RPC时同时广播，第一个确认的胜出
+            with trace_span("broadcast"):
+                start = time.perf_counter()
+                tx_hash, self.last_broadcast_acks = self.broadcaster.broadcast(signed_txn.raw_transaction, rpc_urls)
+            acks = [ack for ack in list(self.last_broadcast_acks.values()) if isinstance(ack, float)]
+            if acks:
+                trace_record("first_seen", start, start + min(acks) / 1000)
+            return tx_hash
+        except Exception as e:
+            self.nonces.reconcile(chain_id, self.account.address, transaction['nonce'], e)
+            raise
+
+    def get_quote(self, from_token: str, to_token: str, slippage, amount: str, chain_id,
+                  priority=OkxRateLimiter.PRIORITY_TRADE) -> Optional[dict]:
+        """获取Swap报价，后台刷新报价时priority传PRIORITY_BACKGROUND，让交易请求优先
+
+        设置了hedger时交易报价会对冲：响应慢于最近延迟的分位数时再发一次相同的请求，取先返回的结果。
+        """
+        params = self._quote_params(from_token, to_token, slippage, amount, chain_id)
+        try:
+            full_path, headers = self._signed_request("/api/v5/dex/aggregator/quote", params)
+        except Exception as e:
+            # print(f"生成签名失败: {e}")
+            return None
+
+        if self.hedger is not None and priority == OkxRateLimiter.PRIORITY_TRADE:
+            return self.hedger.call(lambda: self._fetch_quote(full_path, headers, priority))
+        return self._fetch_quote(full_path, headers, priority)
+
+    def _fetch_quote(self, full_path: str, headers: dict, priority) -> Optional[dict]:
+        try:
+            response = self._get(full_path, headers, priority)
+
+            if response.status_code != 200:
+                return None
+
+            return response.json()
+
+        except requests.exceptions.RequestException as e:
+            # print(f"请求发生错误: {e}")
+            return None
+        except json.JSONDecodeError as e:
+            # print(f"解析响应JSON时发生错误: {e}")
+            return None
+
+    def swap(self, quote_data: list, slippage) -> Optional[dict]:
+        """执行Swap交易"""
+        # 构建交易参数
+        params = self._swap_params(quote_data, slippage)
+        full_path, headers = self._signed_request("/api/v5/dex/aggregator/swap", params)
+
+        try:
+            response = self._get(full_path, headers)
+
+            if response.status_code != 200:
+                return None
+
+            return response.json()
+
+        except Exception as e:
+            # print(f"执行Swap时发生错误: {e}")
+            return None
+
+    def broadcast_transaction(self, tx_data: dict, rpc_url: str, chain_id, fees=None) -> str:
+        """构建、签名并广播交易，不等待收据，返回交易哈希；fees默认取自gas费用缓存"""
+        # 连接到区块链
+        w3 = self.get_web3(rpc_url)
+        if fees is None:
+            fees = self.get_fees(rpc_url, chain_id)
+        # 创建交易对象
+        transaction = self._build_swap_transaction(tx_data, fees, chain_id)
+        # 本地分配nonce，无需每次查询链上
+        with trace_span("nonce"):
+            transaction['nonce'] = self.nonces.allocate(w3, chain_id, self.account.address)
+        # print(transaction)
+
+        # 签名并发送交易
+        tx_hash = self._sign_and_send(w3, transaction, chain_id)
+        return w3.to_hex(tx_hash)
+
+    def track_receipt(self, tx_hash: str, rpc_url: str, chain_id, timeout=120) -> Future:
+        """交给共享跟踪器等待收据，返回Future"""
+        return self.receipts.track(tx_hash, self.resolve_rpc(rpc_url), chain_id, timeout=timeout)
+
+    def wait_for_receipt(self, tx_hash: str, rpc_url: str, chain_id, timeout=120):
+        """阻塞等待交易收据"""
+        return self.track_receipt(tx_hash, rpc_url, chain_id, timeout=timeout).result()
+
+    def send_transaction(self, tx_data: dict, rpc_url: str, chain_id, fees=None) -> Optional[dict]:
+        """发送交易到区块链并返回交易收据，可传入预先获取的费用字段"""
+        try:
+            tx_hash = self.broadcast_transaction(tx_data, rpc_url, chain_id, fees=fees)
+
+            # 等待交易收据
+            # print(f"等待交易确认，交易哈希: {tx_hash}")
+            receipt = self.wait_for_receipt(tx_hash, rpc_url, chain_id, timeout=120)
+
+            # 返回交易哈希和收据
+            return {
+                'tx_hash': tx_hash,
+                'receipt': receipt
+            }
+
+        except Exception as e:
+            # print(f"发送交易时发生错误: {e}")
+            return None
+
+    def get_token_balance(self, token_address: str, rpc):
+        """获取代币余额"""
+        try:
+            return self.get_token_balances([token_address], rpc)[token_address]
+        except Exception as e:
+            # print(f"获取代币余额时发生错误: {e}")
+            return 0
+
+    def get_token_balances(self, token_addresses: list, rpc) -> dict:
+        """通过一次Multicall3调用获取多个代币余额，返回 代币地址 -> 余额"""
+        return self.reader.balances(self.resolve_rpc(rpc), self.account.address, token_addresses)
+
+    def get_token_decimals(self, token_address: str, rpc) -> int:
+        """获取代币精度（缓存）"""
+        try:
+            return self.reader.decimals(self.resolve_rpc(rpc), token_address)
+        except Exception:
+            return DEFAULT_DECIMALS
+
+    def get_token_states(self, token_addresses: list, rpc_url: str, chain_id, spender_address=None) -> dict:
+        """一次Multicall3调用读取多个代币的余额、精度以及对spender_address的授权额度
+
+        返回 代币地址 -> {'balance', 'decimals', 'allowance'}，未传spender_address或授权额度读取失败时allowance为None，
+        由调用方通过get_approval_state/check_and_approve重新检查，缓存中已是最大授权的代币不再读取授权额度。
+        余额读取失败时balance为None，与余额为0区分开。
+        """
+        items = {}
+        for token_address in token_addresses:
+            read_spender = spender_address
+            if spender_address and self.allowances.is_max_approved(chain_id, self.account.address, token_address,
+                                                                   spender_address):
+                read_spender = None
+            items[token_address] = (self.account.address, token_address, read_spender)
+
+        results = self.reader.read(self.resolve_rpc(rpc_url), items.values())
+        states = {}
+        for token_address, item in items.items():
+            state = results[item]
+            if spender_address and item[2] is None:
+                state["allowance"] = MAX_ALLOWANCE
+            elif spender_address and state["allowance"] is not None:
+                if state["allowance"] >= MAX_ALLOWANCE:
+                    self.allowances.mark_approved(chain_id, self.account.address, token_address, spender_address)
+            states[token_address] = state
+        return states
+
+    def get_token_state(self, token_address: str, rpc_url: str, chain_id, spender_address=None) -> dict:
+        """单个代币的余额、精度和授权额度，见get_token_states"""
+        return self.get_token_states([token_address], rpc_url, chain_id, spender_address)[token_address]
+
+    def get_spender_address(self, token_address: str, chain_id, use_cache=True) -> Optional[str]:
+        """通过OKX API获取授权接收方（DEX合约地址），优先使用缓存"""
+        if use_cache:
+            spender_address = self.allowances.get_spender(chain_id)
+            if spender_address:
+                return spender_address
+
+        params = self._approve_params(token_address, chain_id)
+        full_path, headers = self._signed_request("/api/v5/dex/aggregator/approve-transaction", params)
+
+        response = self._get(full_path, headers)
+
+        if response.status_code != 200:
+            return None
+
+        approve_data = response.json()
+
+        if approve_data.get("code") != "0":
+            return None
+
+        # 获取DEX合约地址作为授权接收方
+        spender_address = approve_data["data"][0]["dexContractAddress"]
+        self.allowances.set_spender(chain_id, spender_address)
+        return spender_address
+
+    def get_allowance(self, token_address: str, spender_address: str, rpc_url: str) -> int:
+        """查询当前授权额度"""
+        item = (self.account.address, token_address, spender_address)
+        allowance = self.reader.read(self.resolve_rpc(rpc_url), [item])[item]["allowance"]
+        if allowance is None:
+            raise ValueError(f"读取授权额度失败: {token_address}")
+        return allowance
+
+    def get_approval_state(self, token_address: str, rpc_url: str, chain_id):
+        """获取授权接收方及当前授权额度，缓存中已是最大授权时不发起任何请求"""
+        spender_address = self.get_spender_address(token_address, chain_id)
+        if spender_address is None:
+            return None, 0
+
+        if self.allowances.is_max_approved(chain_id, self.account.address, token_address, spender_address):
+            return spender_address, MAX_ALLOWANCE
+
+        allowance = self.get_allowance(token_address, spender_address, rpc_url)
+        if allowance >= MAX_ALLOWANCE:
+            self.allowances.mark_approved(chain_id, self.account.address, token_address, spender_address)
+        return spender_address, allowance
+
+    def approve(self, token_address: str, spender_address: str, rpc_url: str, chain_id, wait=True, fees=None):
+        """发送最大额度授权交易"""
+        rpc_url = self.resolve_rpc(rpc_url)
+        w3 = self.registry.get_web3(rpc_url)
+        contract = self.registry.get_contract(rpc_url, token_address)
+
+        # 构建授权交易
+        if fees is None:
+            fees = self.get_fees(rpc_url, chain_id)
+        nonce = self.nonces.allocate(w3, chain_id, self.account.address)
+        try:
+            transaction = contract.functions.approve(
+                Web3.to_checksum_address(spender_address),
+                MAX_ALLOWANCE
+            ).build_transaction(self._approve_transaction_fields(fees, nonce, chain_id))
+        except Exception:
+            self.nonces.release(chain_id, self.account.address, nonce)
+            raise
+
+        # 签名并发送交易
+        tx_hash = self._sign_and_send(w3, transaction, chain_id)
+
+        # # 等待交易确认
+        # print(f"授权交易已发送，交易哈希: {w3.to_hex(tx_hash)}")
+        # print("等待交易确认...")
+        if not wait:
+            return
+
+        try:
+            tx_receipt = self.receipts.track(tx_hash, rpc_url, chain_id, timeout=60).result()
+            if tx_receipt['status'] == 1:
+                self.allowances.mark_approved(chain_id, self.account.address, token_address, spender_address)
+                return True
+        except Exception as e:
+            # print(f"等待授权交易确认时发生错误: {e}")
+            pass
+        return False
+
+    def check_and_approve(self, token_address: str, rpc_url: str, chain_id, wait=True):
+        """检查并执行代币授权"""
+        try:
+            # 获取授权接收方和当前授权额度（优先使用缓存）
+            spender_address, allowance = self.get_approval_state(token_address, rpc_url, chain_id)
+            if spender_address is None:
+                return False
+
+            # 如果授权额度小于最大值，则需要重新授权
+            if allowance < MAX_ALLOWANCE:
+                return self.approve(token_address, spender_address, rpc_url, chain_id, wait=wait)
+            else:
+                return True
+
+        except Exception as e:
+            # print(f"检查授权时发生错误: {e}")
+            return False
+
+
+class AsyncOKXDexSwap(OKXDexBase):
+    """OKXDexSwap的asyncio版本
+
+    OKX接口使用aiohttp长连接会话，链上调用使用AsyncWeb3，方法与OKXDexSwap一一对应但均为协程，
+    可以在一个事件循环中同时进行大量报价和收据等待。签名和参数构建与OKXDexSwap共用。
+    授权缓存的读写可能涉及磁盘I/O，通过asyncio.to_thread在线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, api_key, api_secret, passphrase, private_key,
+                 timeout=10, pool_size=100, nonces=None, allowances=None):
+        super().__init__(api_key, api_secret, passphrase, private_key, nonces=nonces, allowances=allowances)
+        # 请求总超时，单位秒
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # aiohttp会话必须在事件循环中创建，首次请求时再初始化
+        self._session = None
+        self._web3 = {}
+        self._contracts = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def _get(self, full_path: str, headers: dict) -> Optional[dict]:
+        """发送GET请求，非200时返回None"""
+        url = self.base_url + full_path
+        async with self._get_session().get(url, headers=headers) as response:
+            if response.status != 200:
+                return None
+            return await response.json(content_type=None)
+
+    async def close(self):
+        """关闭HTTP会话和所有RPC连接"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        for w3 in self._web3.values():
+            await w3.provider.disconnect()
+        self._web3.clear()
+        self._contracts.clear()
+
+    def get_web3(self, rpc_url: str) -> AsyncWeb3:
+        """获取RPC对应的AsyncWeb3实例"""
+        w3 = self._web3.get(rpc_url)
+        if w3 is None:
+            provider = AsyncWeb3.AsyncHTTPProvider(
+                rpc_url,
+                request_kwargs={"timeout": aiohttp.ClientTimeout(total=self.timeout)}
+            )
+            w3 = self._web3[rpc_url] = AsyncWeb3(provider)
+        return w3
+
+    def get_contract(self, rpc_url: str, token_address: str):
+        """获取缓存的ERC20合约实例"""
+        address = Web3.to_checksum_address(token_address)
+        key = (rpc_url, address)
+        contract = self._contracts.get(key)
+        if contract is None:
+            contract = self._contracts[key] = self.get_web3(rpc_url).eth.contract(address=address, abi=ERC20_ABI)
+        return contract
+
+    async def _allocate_nonce(self, w3: AsyncWeb3, chain_id) -> int:
+        """本地分配nonce，首次使用时异步从链上初始化"""
+        address = self.account.address
+        if not self.nonces.is_seeded(chain_id, address):
+            self.nonces.seed(chain_id, address, await w3.eth.get_transaction_count(address, "pending"))
+        return self.nonces.allocate(None, chain_id, address)
+
+    async def _sign_and_send(self, w3: AsyncWeb3, transaction: dict, chain_id):
+        """签名并广播交易，失败时归还或重新同步nonce"""
+        try:
+            signed_txn = self.account.sign_transaction(transaction)
+            return await w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+        except Exception as e:
+            self.nonces.reconcile(chain_id, self.account.address, transaction['nonce'], e)
+            raise
+
+    async def get_quote(self, from_token: str, to_token: str, slippage, amount: str, chain_id) -> Optional[dict]:
+        """获取Swap报价"""
+        params = self._quote_params(from_token, to_token, slippage, amount, chain_id)
+        try:
+            full_path, headers = self._signed_request("/api/v5/dex/aggregator/quote", params)
+            return await self._get(full_path, headers)
+        except Exception:
+            return None
+
+    async def swap(self, quote_data: list, slippage) -> Optional[dict]:
+        """执行Swap交易"""
+        params = self._swap_params(quote_data, slippage)
+        full_path, headers = self._signed_request("/api/v5/dex/aggregator/swap", params)
+        try:
+            return await self._get(full_path, headers)
+        except Exception:
+            return None
+
+    async def send_transaction(self, tx_data: dict, rpc_url: str, chain_id, gas_price=None) -> Optional[dict]:
+        """发送交易到区块链并返回交易收据"""
+        try:
+            w3 = self.get_web3(rpc_url)
+            if gas_price is None:
+                gas_price = await w3.eth.gas_price
+            transaction = self._build_swap_transaction(tx_data, {'gasPrice': gas_price}, chain_id)
+            transaction['nonce'] = await self._allocate_nonce(w3, chain_id)
+
+            tx_hash = await self._sign_and_send(w3, transaction, chain_id)
+            receipt = await w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+
+            return {
+                'tx_hash': w3.to_hex(tx_hash),
+                'receipt': receipt
+            }
+        except Exception:
+            return None
+
+    async def get_token_balance(self, token_address: str, rpc) -> int:
+        """获取代币余额"""
+        try:
+            contract = self.get_contract(rpc, token_address)
+            return int(await contract.functions.balanceOf(self.account.address).call())
+        except Exception:
+            return 0
+
+    async def get_spender_address(self, token_address: str, chain_id, use_cache=True) -> Optional[str]:
+        """通过OKX API获取授权接收方（DEX合约地址），优先使用缓存"""
+        if use_cache:
+            spender_address = await asyncio.to_thread(self.allowances.get_spender, chain_id)
+            if spender_address:
+                return spender_address
+
+        params = self._approve_params(token_address, chain_id)
+        full_path, headers = self._signed_request("/api/v5/dex/aggregator/approve-transaction", params)
+        approve_data = await self._get(full_path, headers)
+        if approve_data is None or approve_data.get("code") != "0":
+            return None
+
+        spender_address = approve_data["data"][0]["dexContractAddress"]
+        await asyncio.to_thread(self.allowances.set_spender, chain_id, spender_address)
+        return spender_address
+
+    async def get_allowance(self, token_address: str, spender_address: str, rpc_url: str) -> int:
+        """查询当前授权额度"""
+        contract = self.get_contract(rpc_url, token_address)
+        return int(await contract.functions.allowance(
+            self.account.address,
+            Web3.to_checksum_address(spender_address)
+        ).call())
+
+    async def get_approval_state(self, token_address: str, rpc_url: str, chain_id):
+        """获取授权接收方及当前授权额度，缓存中已是最大授权时不发起任何请求"""
+        spender_address = await self.get_spender_address(token_address, chain_id)
+        if spender_address is None:
+            return None, 0
+
+        if self.allowances.is_max_approved(chain_id, self.account.address, token_address, spender_address):
+            return spender_address, MAX_ALLOWANCE
+
+        allowance = await self.get_allowance(token_address, spender_address, rpc_url)
+        if allowance >= MAX_ALLOWANCE:
+            await asyncio.to_thread(self.allowances.mark_approved, chain_id, self.account.address, token_address,
+                                    spender_address)
+        return spender_address, allowance
+
+    async def approve(self, token_address: str, spender_address: str, rpc_url: str, chain_id, wait=True, gas_price=None):
+        """发送最大额度授权交易"""
+        w3 = self.get_web3(rpc_url)
+        contract = self.get_contract(rpc_url, token_address)
+
+        if gas_price is None:
+            gas_price = await w3.eth.gas_price
+        nonce = await self._allocate_nonce(w3, chain_id)
+        try:
+            transaction = await contract.functions.approve(
+                Web3.to_checksum_address(spender_address),
+                MAX_ALLOWANCE
+            ).build_transaction(self._approve_transaction_fields({'gasPrice': gas_price}, nonce, chain_id))
+        except Exception:
+            self.nonces.release(chain_id, self.account.address, nonce)
+            raise
+
+        tx_hash = await self._sign_and_send(w3, transaction, chain_id)
+        if not wait:
+            return
+
+        try:
+            tx_receipt = await w3.eth.wait_for_transaction_receipt(tx_hash, timeout=60)
+            if tx_receipt['status'] == 1:
+                await asyncio.to_thread(self.allowances.mark_approved, chain_id, self.account.address, token_address,
+                                        spender_address)
+                return True
+        except Exception:
+            pass
+        return False
+
+    async def check_and_approve(self, token_address: str, rpc_url: str, chain_id, wait=True):
+        """检查并执行代币授权"""
+        try:
+            spender_address, allowance = await self.get_approval_state(token_address, rpc_url, chain_id)
+            if spender_address is None:
+                return False
+
+            if allowance < MAX_ALLOWANCE:
+                return await self.approve(token_address, spender_address, rpc_url, chain_id, wait=wait)
+            return True
+        except Exception:
+            return False
+
+
+def _timed_call(trace: TradeTrace, name: str, func, *args, **kwargs):
+    """执行函数并把耗时（毫秒）记录为顶层阶段name，函数内部的trace_span记为其子span"""
+    with trace.span(name):
+        return func(*args, **kwargs)
+
+
+class SellEngine:
+    """并行化的卖出流程
+
+    余额、授权接收方/授权额度、gas费用和nonce同时获取，余额一到手立即请求报价，
+    只有真正相互依赖的步骤才串行执行。
+    """
+
+    def __init__(self, dex: OKXDexSwap, max_workers=5, recorder=None):
+        self.dex = dex
+        self.max_workers = max_workers
+        self.recorder = recorder or trade_trace_recorder
+
+    def run(self, token_address: str, rpc_url: str, chain_id, sell_ratio: int, slippage, log=None,
+            quote_cache=None, wait=True, amount=None) -> dict:
+        """执行卖出，返回包含交易结果和各阶段耗时的字典
+
+        amount为卖出数量（最小单位）时按该数量卖出，超过余额时卖出全部余额，不再按sell_ratio计算。
+        quote_cache为QuotePrefetcher时，卖出数量与预取报价一致则直接使用预取报价。
+        wait为False时广播后立即返回，收据通过result['receipt_future']获取。
+        交易结束时各阶段耗时输出为一行日志，span树追加到JSONL文件。
+        """
+        trace = TradeTrace("sell", token_address, chain_id)
+        result = self._run(trace, token_address, rpc_url, chain_id, sell_ratio, slippage, log, quote_cache, wait,
+                           amount)
+        self.recorder.report(trace, result, log)
+        return result
+
+    def _run(self, trace: TradeTrace, token_address: str, rpc_url: str, chain_id, sell_ratio: int, slippage,
+             log, quote_cache, wait, amount=None) -> dict:
+        log = log or (lambda message, level="info": None)
+        dex = self.dex
+        result = {'success': False, 'tx_hash': None, 'receipt': None, 'timings': trace.timings}
+        start = time.perf_counter()
+        w3 = dex.get_web3(rpc_url)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # 相互独立的读取同时发出；授权接收方已缓存时余额、精度和授权额度合并为一次Multicall3调用
+            log("获取代币余额...")
+            cached_spender = dex.allowances.get_spender(chain_id)
+            state_future = pool.submit(_timed_call, trace, 'token_state', dex.get_token_state,
+                                       token_address, rpc_url, chain_id, cached_spender)
+            if cached_spender is None:
+                approval_future = pool.submit(_timed_call, trace, 'approval', dex.get_approval_state,
+                                              token_address, rpc_url, chain_id)
+            fees_future = pool.submit(_timed_call, trace, 'fees', dex.get_fees, rpc_url, chain_id)
+            nonce_future = pool.submit(_timed_call, trace, 'nonce', dex.nonces.prime, w3, chain_id, dex.account.address)
+
+            try:
+                token_state = state_future.result()
+            except Exception as e:
+                log(f"错误: 读取代币余额失败: {str(e)}", "error")
+                return result
+            token_balance = token_state["balance"]
+            if token_balance is None:
+                log("错误: 读取代币余额失败", "error")
+                return result
+            unit = 10 ** token_state["decimals"]
+            if token_balance <= MIN_SELL_BALANCE:
+                log(f"错误: 没有可用或太少的代币余额 {token_balance / unit}", "warning")
+                return result
+
+            log(f"代币余额: {token_balance / unit:.8f}")
+
+            # 计算要卖出的数量（指定数量时不超过余额，否则根据百分比）
+            if amount is not None:
+                sell_amount = min(int(amount), token_balance)
+            else:
+                sell_amount = calc_sell_amount(token_balance, sell_ratio)
+
+            if sell_amount <= 0:
+                log("错误: 计算的卖出数量为零")
+                return result
+
+            if amount is not None:
+                log(f"将卖出 {sell_amount / unit:.8f} 代币")
+            else:
+                log(f"将卖出 {sell_amount / unit:.8f} 代币 ({sell_ratio}%)")
+
+            # 余额已知，优先使用预取的报价，否则立即请求报价，与授权检查并行
+            cached_quote = None
+            if quote_cache is not None:
+                cached_quote = quote_cache.get(chain_id, token_address, BNB_ADDRESS, str(sell_amount), slippage)
+            if cached_quote is not None:
+                log("使用预取的卖出报价")
+                quote_future = Future()
+                quote_future.set_result(cached_quote)
+            else:
+                log("获取卖出报价...")
+                quote_future = pool.submit(_timed_call, trace, 'quote', dex.get_quote,
+                                           token_address, BNB_ADDRESS, slippage, str(sell_amount), chain_id)
+
+            # 检查并执行授权
+            log("检查并进行代币授权...")
+            if cached_spender is not None and token_state["allowance"] is not None:
+                spender_address, allowance = cached_spender, token_state["allowance"]
+            else:
+                try:
+                    if cached_spender is None:
+                        spender_address, allowance = approval_future.result()
+                    else:
+                        spender_address, allowance = dex.get_approval_state(token_address, rpc_url, chain_id)
+                except Exception:
+                    spender_address, allowance = None, 0
+            if spender_address is None:
+                log("授权失败，交易终止", "error")
+                return result
+
+            try:
+                fees = fees_future.result()
+            except Exception:
+                fees = None
+
+            if allowance < MAX_ALLOWANCE:
+                try:
+                    approved = _timed_call(trace, 'approve', dex.approve, token_address, spender_address,
+                                           rpc_url, chain_id, fees=fees)
+                except Exception:
+                    approved = False
+                if not approved:
+                    log("授权失败，交易终止", "error")
+                    return result
+
+            log("代币已授权，准备卖出")
+
+            quote = quote_future.result()
+            if quote is None:
+                log("获取报价失败", "error")
+                return result
+
+            if quote.get("code") != "0":
+                log(f"获取卖出报价失败: {quote}", "error")
+                return result
+
+            # 显示预计收到的BNB数量
+            expected_amount = quote["data"][0]["toTokenAmount"]
+            log(f"预计收到的代币: {float(expected_amount) / 1e18:.8f}")
+            log(f"价格影响: {quote['data'][0]['priceImpactPercentage']}%")
+            log(f"使用DEX: {quote['data'][0]['quoteCompareList'][0]['dexName']}")
+
+            # 执行交换
+            log("执行卖出交易...")
+            swap_result = _timed_call(trace, 'swap', dex.swap, quote["data"], slippage)
+            if not swap_result or swap_result.get("code") != "0":
+                # 授权相关的错误说明缓存的授权状态已失效
+                if swap_result and "allowance" in str(swap_result.get("msg", "")).lower():
+                    dex.invalidate_allowance(token_address, chain_id)
+                log(f"获取卖出交易数据失败: {swap_result}", "error")
+                return result
+
+            # 从响应中提取交易数据
+            tx_data = swap_result["data"][0]["tx"]
+            log("卖出交易数据已获取!")
+
+            # nonce预取失败时由send_transaction自行从链上初始化
+            try:
+                nonce_future.result()
+            except Exception:
+                pass
+
+        # 关键路径：从开始到交易可以签名发送
+        result['critical_path_ms'] = (time.perf_counter() - start) * 1000
+
+        log('准备发送卖出交易...')
+        try:
+            tx_hash = _timed_call(trace, 'send', dex.broadcast_transaction, tx_data, rpc_url, chain_id,
+                                  fees=fees)
+        except Exception:
+            result['total_ms'] = (time.perf_counter() - start) * 1000
+            log(f'发送卖出交易出错...', "error")
+            return result
+
+        result['tx_hash'] = tx_hash
+        receipt_future = dex.track_receipt(tx_hash, rpc_url, chain_id)
+
+        def invalidate_on_revert(future):
+            # 交易回滚可能是授权不足导致，下次卖出重新检查授权
+            if future.exception() is None and future.result()['status'] != 1:
+                dex.invalidate_allowance(token_address, chain_id)
+
+        receipt_future.add_done_callback(invalidate_on_revert)
+        result['receipt_future'] = receipt_future
+        return self._finish(result, receipt_future, start, wait)
+
+    @staticmethod
+    def _finish(result: dict, receipt_future: Future, start: float, wait: bool) -> dict:
+        """wait为True时等待收据并填入结果，否则直接返回（收据通过result['receipt_future']获取）"""
+        if wait:
+            try:
+                result['receipt'] = receipt_future.result()
+                result['success'] = result['receipt']['status'] == 1
+            except Exception:
+                pass
+        result['total_ms'] = (time.perf_counter() - start) * 1000
+        return result
+
+
+class MultiSellEngine:
+    """多代币并行清仓
+
+    一次Multicall3调用读取所有代币余额和授权额度，授权/报价/获取交换数据对每个代币并发执行，哪个先准备好就先签名广播。
+    广播在锁内按顺序进行，保证nonce连续且不会因某个代币失败而留下空缺；收据在广播后并发等待。
+    """
+
+    def __init__(self, dex: OKXDexSwap, max_workers=8):
+        self.dex = dex
+        self.max_workers = max_workers
+        self._send_lock = threading.Lock()
+
+    def _prepare(self, token_address: str, amount: int, rpc_url: str, chain_id, slippage, allowance=None,
+                 spender_address=None) -> dict:
+        """授权 -> 报价 -> 获取交换数据；已读取到授权额度时跳过授权检查"""
+        dex = self.dex
+        if allowance is not None and spender_address:
+            if allowance < MAX_ALLOWANCE and not dex.approve(token_address, spender_address, rpc_url, chain_id):
+                raise RuntimeError("授权失败")
+        elif not dex.check_and_approve(token_address, rpc_url, chain_id):
+            raise RuntimeError("授权失败")
+
+        quote = dex.get_quote(token_address, BNB_ADDRESS, slippage, str(amount), chain_id)
+        if quote is None or quote.get("code") != "0":
+            raise RuntimeError(f"获取卖出报价失败: {quote}")
+
+        swap_result = dex.swap(quote["data"], slippage)
+        if not swap_result or swap_result.get("code") != "0":
+            if swap_result and "allowance" in str(swap_result.get("msg", "")).lower():
+                dex.invalidate_allowance(token_address, chain_id)
+            raise RuntimeError(f"获取卖出交易数据失败: {swap_result}")
+
+        return swap_result["data"][0]["tx"]
+
+    def submit(self, token_addresses: list, rpc_url: str, chain_id, sell_ratio: int, slippage,
+               log=None, on_result=None) -> list:
+        """读取余额并广播所有卖出交易，返回已广播的行（不等待收据）
+
+        每行包含token、amount、tx_hash、error和start；未能广播的行会立即通过on_result回调。
+        """
+        log = log or (lambda message, level="info": None)
+        on_result = on_result or (lambda row: None)
+        dex = self.dex
+        w3 = dex.get_web3(rpc_url)
+        start = time.perf_counter()
+
+        # 一次Multicall3调用读取所有余额和授权额度（授权接收方每条链只有一个）
+        log(f"读取 {len(token_addresses)} 个代币余额...")
+        try:
+            spender_address = dex.get_spender_address(token_addresses[0], chain_id)
+        except Exception:
+            spender_address = None
+        try:
+            states = dex.get_token_states(token_addresses, rpc_url, chain_id, spender_address)
+        except Exception as e:
+            states, read_error = {}, f"读取代币余额失败: {str(e)}"
+        else:
+            read_error = "读取代币余额失败"
+
+        rows = []
+        for token_address in token_addresses:
+            state = states.get(token_address, {})
+            row = {'token': token_address, 'amount': 0, 'success': False, 'tx_hash': None,
+                   'error': None, 'start': start, 'allowance': state.get('allowance')}
+            balance = state.get('balance')
+            if balance is None or balance <= MIN_SELL_BALANCE:
+                row['error'] = read_error if balance is None else "没有可用或太少的代币余额"
+                row['latency_ms'] = (time.perf_counter() - start) * 1000
+                on_result(row)
+                continue
+            row['amount'] = calc_sell_amount(balance, sell_ratio)
+            rows.append(row)
+
+        if not rows:
+            return []
+
+        log(f"并行卖出 {len(rows)} 个代币...")
+        submitted = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            fees_future = pool.submit(dex.get_fees, rpc_url, chain_id)
+            pool.submit(dex.nonces.prime, w3, chain_id, dex.account.address)
+            futures = {
+                pool.submit(self._prepare, row['token'], row['amount'], rpc_url, chain_id, slippage,
+                            row['allowance'], spender_address): row
+                for row in rows
+            }
+            try:
+                fees = fees_future.result()
+            except Exception:
+                fees = None
+
+            for future in as_completed(futures):
+                row = futures[future]
+                try:
+                    tx_data = future.result()
+                    # 按完成顺序依次广播，nonce连续分配
+                    with self._send_lock:
+                        row['tx_hash'] = dex.broadcast_transaction(tx_data, rpc_url, chain_id, fees=fees)
+                    submitted.append(row)
+                    log(f"[{row['token'][:10]}] 已广播: {row['tx_hash']}")
+                except Exception as e:
+                    row['error'] = str(e)
+                    row['latency_ms'] = (time.perf_counter() - start) * 1000
+                    on_result(row)
+        return submitted
+
+    def wait(self, submitted: list, rpc_url: str, chain_id, on_result=None) -> list:
+        """等待已广播交易的收据，每个代币完成时回调on_result"""
+        on_result = on_result or (lambda row: None)
+        if not submitted:
+            return []
+
+        # 所有收据由共享跟踪器批量查询
+        futures = {self.dex.track_receipt(row['tx_hash'], rpc_url, chain_id, timeout=120): row for row in submitted}
+        for future in as_completed(futures):
+            row = futures[future]
+            try:
+                receipt = future.result()
+                row['success'] = receipt['status'] == 1
+                if not row['success']:
+                    row['error'] = "交易失败"
+                    self.dex.invalidate_allowance(row['token'], chain_id)
+            except Exception as e:
+                row['error'] = str(e)
+            row['latency_ms'] = (time.perf_counter() - row['start']) * 1000
+            on_result(row)
+        return submitted
+
+    def run(self, token_addresses: list, rpc_url: str, chain_id, sell_ratio: int, slippage,
+            log=None, on_result=None) -> list:
+        """广播并等待所有卖出交易"""
+        submitted = self.submit(token_addresses, rpc_url, chain_id, sell_ratio, slippage, log=log, on_result=on_result)
+        return self.wait(submitted, rpc_url, chain_id, on_result=on_result)
+
+
+class BuyEngine:
+    """买入流程：报价 -> 获取交换数据 -> 签名发送，成功后可在后台预授权方便卖出"""
+
+    def __init__(self, dex: OKXDexSwap, recorder=None):
+        self.dex = dex
+        self.recorder = recorder or trade_trace_recorder
+
+    def run(self, token_address: str, rpc_url: str, chain_id, buy_amount, slippage, log=None,
+            quote_cache=None, pre_approve=True, wait=True) -> dict:
+        """执行买入，返回包含交易结果和各阶段耗时的字典
+
+        wait为False时广播后立即返回，收据通过result['receipt_future']获取，预授权由调用方在确认后自行处理。
+        交易结束时各阶段耗时输出为一行日志，span树追加到JSONL文件。
+        """
+        trace = TradeTrace("buy", token_address, chain_id)
+        result = self._run(trace, token_address, rpc_url, chain_id, buy_amount, slippage, log, quote_cache,
+                           pre_approve, wait)
+        self.recorder.report(trace, result, log)
+        return result
+
+    def _run(self, trace: TradeTrace, token_address: str, rpc_url: str, chain_id, buy_amount, slippage, log,
+             quote_cache, pre_approve, wait) -> dict:
+        log = log or (lambda message, level="info": None)
+        dex = self.dex
+        result = {'success': False, 'tx_hash': None, 'receipt': None, 'timings': trace.timings}
+        start = time.perf_counter()
+
+        # 转换买入金额为wei
+        amount_wei = str(int(float(buy_amount) * 1e18))
+
+        # 获取报价，优先使用未过期的预取报价
+        quote = None
+        if quote_cache is not None:
+            quote = quote_cache.get(chain_id, BNB_ADDRESS, token_address, amount_wei, slippage)
+        if quote is not None:
+            log("使用预取的买入报价")
+        else:
+            log("买入获取报价中...")
+            quote = _timed_call(trace, 'quote', dex.get_quote, BNB_ADDRESS, token_address, slippage, amount_wei, chain_id)
+
+        if quote is None:
+            log("获取买入报价失败")
+            return result
+
+        if quote.get("code") != "0":
+            log(f"获取买入报价失败: {quote}", "error")
+            return result
+
+        # 显示预计收到的代币数量
+        expected_amount = quote["data"][0]["toTokenAmount"]
+        to_token = quote['data'][0]['toToken']
+        # 报价中带有目标代币的精度，不再假设为18位
+        decimals = int(to_token.get('decimal', DEFAULT_DECIMALS))
+        log(f"预计收到的代币 {int(expected_amount) / 10 ** decimals:.8f} {to_token['tokenSymbol']}")
+        log(f"价格影响: {quote['data'][0]['priceImpactPercentage']}%")
+        log(f"使用DEX: {quote['data'][0]['quoteCompareList'][0]['dexName']}")
+
+        # 执行交换
+        swap_result = _timed_call(trace, 'swap', dex.swap, quote["data"], slippage)
+        if not swap_result or swap_result.get("code") != "0":
+            log(f"获取买入交易数据失败: {swap_result}", "error")
+            return result
+
+        # 从响应中提取交易数据
+        tx_data = swap_result["data"][0]["tx"]
+        log("买入交易数据已获取!")
+
+        # 发送交易
+        log('准备发送买入交易...')
+        result['critical_path_ms'] = (time.perf_counter() - start) * 1000
+        try:
+            tx_hash = _timed_call(trace, 'send', dex.broadcast_transaction, tx_data, rpc_url, chain_id)
+        except Exception:
+            result['total_ms'] = (time.perf_counter() - start) * 1000
+            log("发送买入交易失败", "error")
+            return result
+
+        result['tx_hash'] = tx_hash
+        result['receipt_future'] = receipt_future = dex.track_receipt(tx_hash, rpc_url, chain_id)
+        SellEngine._finish(result, receipt_future, start, wait)
+        if result['success'] and pre_approve:
+            dex.check_and_approve(token_address, rpc_url, chain_id, wait=False)
+        return result
+
+
+class BatchTrader:
+    """多钱包批量买入/卖出
+
+    每个钱包一个OKXDexSwap实例（共用OKX连接池和Web3注册表），在有界线程池中并发执行
+    报价 -> 交换 -> 签名 -> 发送 的完整流程。nonce由NonceManager按(链ID, 地址)分别管理。
+    """
+
+    def __init__(self, api_key, api_secret, passphrase, wallets: dict, max_workers=8, **client_kwargs):
+        if not wallets:
+            raise ValueError("没有配置任何钱包")
+        self.max_workers = max_workers
+        self.session = OKXDexSwap._build_session(2, max_workers)
+        self.clients = {
+            name: OKXDexSwap(api_key, api_secret, passphrase, private_key,
+                             pool_size=max_workers, session=self.session, **client_kwargs)
+            for name, private_key in wallets.items()
+        }
+
+    def close(self):
+        self.session.close()
+
+    def _run_one(self, side: str, name: str, token_address: str, rpc_url: str, chain_id, slippage,
+                 buy_amount, sell_ratio, log, quote_cache) -> dict:
+        dex = self.clients[name]
+        wallet_log = lambda message, level="info": log(f"[{name}] {message}", level)
+        start = time.perf_counter()
+        row = {'wallet': name, 'address': dex.account.address, 'success': False, 'tx_hash': None, 'error': None}
+        try:
+            if side == "buy":
+                result = BuyEngine(dex).run(token_address, rpc_url, chain_id, buy_amount, slippage,
+                                            log=wallet_log, quote_cache=quote_cache)
+            else:
+                result = SellEngine(dex).run(token_address, rpc_url, chain_id, sell_ratio, slippage,
+                                             log=wallet_log)
+            row['success'] = result['success']
+            row['tx_hash'] = result['tx_hash']
+        except Exception as e:
+            row['error'] = str(e)
+        row['latency_ms'] = (time.perf_counter() - start) * 1000
+        return row
+
+    def run(self, side: str, token_address: str, rpc_url: str, chain_id, slippage,
+            buy_amount=None, sell_ratio=None, log=None, quote_cache=None) -> list:
+        """所有钱包并发执行买入(side="buy")或卖出(side="sell")，返回每个钱包的结果"""
+        log = log or (lambda message, level="info": None)
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [
+                pool.submit(self._run_one, side, name, token_address, rpc_url, chain_id, slippage,
+                            buy_amount, sell_ratio, log, quote_cache)
+                for name in self.clients
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+        # 按配置顺序输出
+        order = list(self.clients)
+        results.sort(key=lambda row: order.index(row['wallet']))
+        return results
+
+    @staticmethod
+    def format_results(results: list) -> list:
+        """生成结果汇总表的每一行"""
+        lines = [f"{'钱包':<12}{'状态':<6}{'耗时(ms)':>10}  交易哈希"]
+        for row in results:
+            if row['success']:
+                status = "成功"
+            elif row['tx_hash']:
+                status = "失败"
+            else:
+                status = "未发送"
+            detail = row['tx_hash'] or row['error'] or "-"
+            lines.append(f"{row['wallet']:<12}{status:<6}{row['latency_ms']:>10.0f}  {detail}")
+        return lines
+
+
+class QuotePrefetcher:
+    """后台为当前CA预取买入和卖出两个方向的报价
+
+    目标参数由调用方定期通过set_target更新，报价按(链ID, 输入代币, 输出代币, 数量, 滑点)缓存，
+    超过ttl的报价直接丢弃。
+    """
+
+    def __init__(self, interval=3.0, ttl=10.0):
+        self.interval = interval
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._quotes = {}
+        self._target = None
+        self._dex = None
+        self._dex_key = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _key(chain_id, from_token: str, to_token: str, amount, slippage):
+        return str(chain_id), from_token.lower(), to_token.lower(), str(amount), str(slippage)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread = None
+        with self._lock:
+            self._quotes.clear()
+            self._target = None
+
+    def set_target(self, target: Optional[dict]):
+        """设置预取目标，包含API参数、rpc、chain_id、ca、slippage（小数）、buy_amount和sell_ratio"""
+        with self._lock:
+            if target != self._target:
+                self._quotes.clear()
+            self._target = target
+
+    def get(self, chain_id, from_token: str, to_token: str, amount, slippage) -> Optional[dict]:
+        """获取未过期的预取报价"""
+        key = self._key(chain_id, from_token, to_token, amount, slippage)
+        with self._lock:
+            entry = self._quotes.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                return entry[1]
+            return None
+
+    def _put(self, chain_id, from_token: str, to_token: str, amount, slippage, quote: dict):
+        key = self._key(chain_id, from_token, to_token, amount, slippage)
+        with self._lock:
+            self._quotes[key] = (time.time(), quote)
+
+    def _purge(self):
+        """丢弃过期的报价"""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (ts, _) in self._quotes.items() if now - ts > self.ttl]:
+                del self._quotes[key]
+
+    def _get_dex(self, target: dict) -> OKXDexSwap:
+        """API参数变化时重新创建客户端"""
+        dex_key = (target["api_key"], target["api_secret"], target["passphrase"], target["private_key"])
+        if self._dex is None or self._dex_key != dex_key:
+            if self._dex is not None:
+                self._dex.close()
+            self._dex = OKXDexSwap(*dex_key)
+            self._dex_key = dex_key
+        return self._dex
+
+    def refresh(self):
+        """预取一轮报价"""
+        with self._lock:
+            target = self._target
+        if not target:
+            return
+
+        dex = self._get_dex(target)
+        chain_id = target["chain_id"]
+        ca = target["ca"]
+        slippage = target["slippage"]
+
+        # 买入方向：配置的买入金额
+        if target.get("buy_amount"):
+            amount_wei = str(int(float(target["buy_amount"]) * 1e18))
+            quote = dex.get_quote(BNB_ADDRESS, ca, slippage, amount_wei, chain_id,
+                                  priority=OkxRateLimiter.PRIORITY_BACKGROUND)
+            if quote and quote.get("code") == "0":
+                self._put(chain_id, BNB_ADDRESS, ca, amount_wei, slippage, quote)
+
+        # 卖出方向：当前余额按卖出比例计算
+        if target.get("sell_ratio"):
+            token_balance = dex.get_token_balance(ca, target["rpc"])
+            if token_balance > MIN_SELL_BALANCE:
+                sell_amount = str(calc_sell_amount(token_balance, target["sell_ratio"]))
+                quote = dex.get_quote(ca, BNB_ADDRESS, slippage, sell_amount, chain_id,
+                                      priority=OkxRateLimiter.PRIORITY_BACKGROUND)
+                if quote and quote.get("code") == "0":
+                    self._put(chain_id, ca, BNB_ADDRESS, sell_amount, slippage, quote)
+
+        self._purge()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                # 预取失败不影响交易，下一轮重试
+                pass
+            self._stop_event.wait(self.interval)
+
+
+class PriceWatcher:
+    """止盈止损监控：轮询监控列表中代币的卖出报价，价值触及止盈/止损线时自动卖出
+
+    所有代币共用一个调度线程和少量报价线程，按下次轮询时间排序依次发出报价请求，
+    不为每个代币单独开线程。同一条链上的同一代币（多个钱包持仓）合并为一次报价，
+    报价以后台优先级走OKX限流，不会挤占交易请求。
+    轮询间隔按代币自适应：离止盈/止损线越近、价格变化越快，轮询越频繁，远离触发线时为max_interval。
+    请求量超过限流时按到期先后轮询，临近触发线的代币间隔短，轮询次数自然更多。
+    触发后该条监控移除，通过on_trigger(entry, reason)在卖出线程池中执行卖出。
+    """
+
+    # 按当前价格变化速度，价值到达触发线之前至少轮询几次
+    POLLS_BEFORE_TRIGGER = 4
+
+    def __init__(self, dex: OKXDexSwap, on_trigger, log=None, min_interval=1.0, max_interval=30.0,
+                 probe_interval=5.0, near_margin=0.2, slippage=0.05, max_workers=4, sell_workers=4):
+        self.dex = dex
+        self.on_trigger = on_trigger
+        self.log = log or (lambda message, level="info": None)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # 首次报价后第二次报价的间隔，用于估计价格变化速度
+        self.probe_interval = probe_interval
+        # 价值距触发线小于该比例时开始缩短轮询间隔
+        self.near_margin = near_margin
+        # 只用于报价请求
+        self.slippage = slippage
+        self.max_workers = max_workers
+        self.sell_workers = sell_workers
+        self._cond = threading.Condition()
+        # (链ID, 代币) -> 报价分组：最新价格、轮询间隔、下次轮询时间和各钱包的监控条目
+        self._groups = {}
+        # (下次轮询时间, 序号, 分组键)，分组的due与之不一致时为过期项
+        self._schedule = []
+        self._seq = 0
+        self._running = False
+        self._thread = None
+        self._pool = None
+        self._sell_pool = None
+
+    @staticmethod
+    def _group_key(chain_id, token_address: str):
+        return str(int(chain_id)), token_address.lower()
+
+    def watch(self, token_address: str, chain_id, amount: int, cost=None, take_profit=None, stop_loss=None,
+              sell_ratio=100, wallet=None, rpc_url=None):
+        """加入或更新一条监控
+
+        amount为持仓数量（最小单位），cost为持仓成本（原生代币），为None时以首次报价的价值作为成本；
+        take_profit/stop_loss为相对成本涨跌的百分比，为None表示不设置。
+        """
+        if int(amount) <= 0:
+            raise ValueError(f"持仓数量必须大于0: {token_address}")
+        key = self._group_key(chain_id, token_address)
+        entry = {
+            "token": token_address, "chain_id": chain_id, "rpc": rpc_url, "wallet": wallet, "amount": int(amount),
+            "cost": None if cost is None else float(cost), "take_profit": take_profit, "stop_loss": stop_loss,
+            "sell_ratio": int(sell_ratio), "value": None
+        }
+        with self._cond:
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = {
+                    "entries": {}, "price": None, "decimals": None, "updated": None, "polled": None, "speed": None,
+                    "interval": self.min_interval, "due": None, "polling": False, "failures": 0
+                }
+            group["entries"][wallet] = entry
+            # 新代币立即报价一次，已在监控的代币保持原来的轮询时间
+            if group["due"] is None:
+                self._schedule_group(key, group, time.monotonic())
+
+    def unwatch(self, token_address: str, chain_id, wallet=None):
+        key = self._group_key(chain_id, token_address)
+        with self._cond:
+            group = self._groups.get(key)
+            if group is None:
+                return
+            group["entries"].pop(wallet, None)
+            if not group["entries"]:
+                del self._groups[key]
+
+    def _schedule_group(self, key, group: dict, due: float):
+        """调用方持有self._cond"""
+        self._seq += 1
+        group["due"] = due
+        heapq.heappush(self._schedule, (due, self._seq, key))
+        self._cond.notify_all()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return
+        self._running = True
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="watch-quote")
+        self._sell_pool = ThreadPoolExecutor(max_workers=self.sell_workers, thread_name_prefix="watch-sell")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止调度，等待进行中的报价和已触发的卖出完成"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._sell_pool is not None:
+            self._sell_pool.shutdown()
+            self._sell_pool = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    now = time.monotonic()
+                    # 丢弃已移除或已重新调度的分组留下的过期项
+                    while self._schedule:
+                        due, _, key = self._schedule[0]
+                        group = self._groups.get(key)
+                        if group is not None and group["due"] == due and not group["polling"]:
+                            break
+                        heapq.heappop(self._schedule)
+                    if self._schedule and self._schedule[0][0] <= now:
+                        break
+                    self._cond.wait(self._schedule[0][0] - now if self._schedule else None)
+                if not self._running:
+                    return
+                _, _, key = heapq.heappop(self._schedule)
+                group = self._groups[key]
+                group["polling"] = True
+                amount = max(entry["amount"] for entry in group["entries"].values())
+            self._pool.submit(self._poll, key, amount)
+
+    def _poll(self, key, amount: int):
+        chain_id, token_address = key
+        price = decimals = None
+        try:
+            quote = self.dex.get_quote(token_address, BNB_ADDRESS, self.slippage, str(amount), chain_id,
+                                       priority=OkxRateLimiter.PRIORITY_BACKGROUND)
+            if quote and quote.get("code") == "0":
+                data = quote["data"][0]
+                decimals = int(data.get("fromToken", {}).get("decimal", DEFAULT_DECIMALS))
+                to_decimals = int(data.get("toToken", {}).get("decimal", 18))
+                # 每个完整代币值多少原生代币
+                price = int(data["toTokenAmount"]) / 10 ** to_decimals / (amount / 10 ** decimals)
+        except Exception as e:
+            self.log(f"监控报价失败 {token_address}: {str(e)}", "debug")
+
+        triggered = []
+        with self._cond:
+            group = self._groups.get(key)
+            if group is None:
+                return
+            group["polling"] = False
+            if price is None:
+                # 报价失败时间隔加倍重试
+                group["failures"] += 1
+                group["interval"] = min(self.max_interval, group["interval"] * 2)
+            else:
+                now = time.monotonic()
+                if group["price"]:
+                    # 每秒的相对变化，变快时立即采用，变慢时逐步衰减
+                    speed = abs(price - group["price"]) / group["price"] / max(now - group["polled"], 0.001)
+                    group["speed"] = speed if group["speed"] is None else max(speed, group["speed"] / 2)
+                group["polled"] = now
+                group["failures"] = 0
+                group["price"], group["decimals"], group["updated"] = price, decimals, time.time()
+                triggered = self._check(group)
+                group["interval"] = self._next_interval(group)
+            if group["entries"]:
+                self._schedule_group(key, group, time.monotonic() + group["interval"])
+            else:
+                del self._groups[key]
+
+        for entry, reason in triggered:
+            self.log(f"{entry['token']} 触发{'止盈' if reason == 'take_profit' else '止损'}: "
+                     f"价值 {entry['value']:.6f} 成本 {entry['cost']:.6f}，卖出 {entry['sell_ratio']}%")
+            self._sell_pool.submit(self._fire, entry, reason)
+
+    def _check(self, group: dict) -> list:
+        """按最新价格更新各条目的价值，返回触发的 (条目, 原因) 并从监控中移除，调用方持有self._cond"""
+        triggered = []
+        for wallet, entry in list(group["entries"].items()):
+            value = entry["amount"] / 10 ** group["decimals"] * group["price"]
+            entry["value"] = value
+            if entry["cost"] is None:
+                entry["cost"] = value
+            take_profit_line, stop_loss_line = self._lines(entry)
+            reason = None
+            if take_profit_line is not None and value >= take_profit_line:
+                reason = "take_profit"
+            elif stop_loss_line is not None and value <= stop_loss_line:
+                reason = "stop_loss"
+            if reason is not None:
+                del group["entries"][wallet]
+                triggered.append((dict(entry), reason))
+        return triggered
+
+    @staticmethod
+    def _lines(entry: dict) -> tuple:
+        """止盈线和止损线（原生代币）"""
+        cost = entry["cost"]
+        take_profit_line = cost * (1 + entry["take_profit"] / 100) if entry["take_profit"] is not None else None
+        stop_loss_line = cost * (1 - entry["stop_loss"] / 100) if entry["stop_loss"] is not None else None
+        return take_profit_line, stop_loss_line
+
+    def _next_interval(self, group: dict) -> float:
+        """按最近的触发线距离和价格变化速度计算下次轮询间隔"""
+        margin = None
+        for entry in group["entries"].values():
+            if not entry["value"]:
+                continue
+            for line in self._lines(entry):
+                if line is not None:
+                    distance = abs(entry["value"] - line) / entry["value"]
+                    margin = distance if margin is None else min(margin, distance)
+        if margin is None:
+            return self.max_interval
+        interval = self.max_interval * min(1.0, margin / self.near_margin)
+        if group["speed"] is None:
+            # 只有一次报价，还不知道价格变化速度，较快地再报价一次
+            interval = min(interval, self.probe_interval)
+        elif group["speed"] > 0:
+            # 按当前变化速度到达触发线之前至少轮询POLLS_BEFORE_TRIGGER次
+            interval = min(interval, margin / group["speed"] / self.POLLS_BEFORE_TRIGGER)
+        return max(self.min_interval, interval)
+
+    def _fire(self, entry: dict, reason: str):
+        try:
+            self.on_trigger(entry, reason)
+        except Exception as e:
+            self.log(f"{entry['token']} 自动卖出失败: {str(e)}", "error")
+
+    def snapshot(self) -> list:
+        """各监控条目的最新价格、价值、盈亏百分比和当前轮询间隔"""
+        now = time.monotonic()
+        with self._cond:
+            rows = []
+            for (chain_id, _), group in self._groups.items():
+                for entry in group["entries"].values():
+                    pnl = None
+                    if entry["value"] is not None and entry["cost"]:
+                        pnl = (entry["value"] / entry["cost"] - 1) * 100
+                    rows.append({
+                        "token": entry["token"], "chain_id": chain_id, "wallet": entry["wallet"],
+                        "price": group["price"], "value": entry["value"], "cost": entry["cost"], "pnl": pnl,
+                        "take_profit": entry["take_profit"], "stop_loss": entry["stop_loss"],
+                        "updated": group["updated"], "interval": group["interval"],
+                        "next_poll": None if group["polling"] or group["due"] is None else max(0.0, group["due"] - now)
+                    })
+            return rows
@@ -0,0 +1,258 @@
+"""配置和日志：内存中的config.json、按大小滚动的JSONL日志文件
+
+只依赖标准库，图形界面启动时先导入这里，web3等较重的交易依赖在界面显示后再后台导入。
+"""
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueListener, RotatingFileHandler
+
+# 交易费用紧急程度 -> 小费取最近区块优先费的百分位
+FEE_URGENCY_LEVELS = {"slow": 10, "normal": 50, "fast": 90}
+
+
+class JsonlFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，通过write_record写入的记录原样输出"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = getattr(record, "swap_record", None)
+        if data is None:
+            data = {
+                "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                "level": getattr(record, "swap_level", record.levelname.lower()),
+                "message": record.getMessage()
+            }
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class JsonlLogWriter:
+    """后台线程把日志以JSONL格式追加到按大小滚动的文件，调用方只做一次入队"""
+
+    def __init__(self, path=os.path.join("logs", "swaphelper.jsonl"), max_bytes=5 * 1024 * 1024, backup_count=5):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8",
+                                      delay=True)
+        handler.setFormatter(JsonlFormatter())
+        self._queue = queue.SimpleQueue()
+        self._listener = QueueListener(self._queue, handler)
+        self._listener.start()
+
+    def write(self, timestamp: float, message, level="info"):
+        self._queue.put(logging.makeLogRecord({"msg": str(message), "created": timestamp, "swap_level": level}))
+
+    def write_record(self, data: dict):
+        """写入一条任意结构的JSON记录"""
+        self._queue.put(logging.makeLogRecord({"msg": "", "swap_record": data}))
+
+    def close(self):
+        """写完队列中剩余的日志并关闭文件"""
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+
+
+def parse_rpc_entries(config_data: dict) -> dict:
+    """解析配置中的RPC/<名称>项（格式为"url?chain_id"），返回 名称 -> (url, chain_id)"""
+    entries = {}
+    for key, value in config_data.items():
+        if key.startswith("RPC/") and isinstance(value, str):
+            rpc_parts = value.split('?')
+            if len(rpc_parts) >= 2:
+                entries[key[4:]] = (rpc_parts[0], rpc_parts[1])
+    return entries
+
+
+def group_rpcs_by_chain(config_data: dict) -> dict:
+    """按链ID分组所有配置的RPC，返回 链ID -> [url, ...]"""
+    chains = {}
+    for rpc_url, chain_id in parse_rpc_entries(config_data).values():
+        try:
+            chains.setdefault(str(int(chain_id)), []).append(rpc_url)
+        except ValueError:
+            continue
+    return chains
+
+
+class ConfigStore:
+    """内存中的config.json
+
+    启动时读取一次，之后所有读写都在内存中进行。修改后在debounce秒内合并为一次写盘，
+    由后台定时器通过临时文件+os.replace原子写入，界面线程不做磁盘I/O，写到一半崩溃也不会损坏配置。
+    RPC/<名称>项解析后缓存，RPC配置变化时才重新解析。
+    后台写盘失败时按指数退避重试，最多MAX_RETRIES次，通过log回调报告而不抛出异常；
+    直接调用flush()（退出、reload）时失败会抛出异常。
+    """
+
+    # 后台写盘连续失败的重试次数上限和最长重试间隔（秒）
+    MAX_RETRIES = 5
+    MAX_RETRY_DELAY = 30.0
+
+    def __init__(self, path="config.json", debounce=0.5, log=None):
+        self.path = path
+        self.debounce = debounce
+        # 日志回调 log(message, level)，由界面或命令行设置
+        self.log = log
+        self._lock = threading.RLock()
+        # 串行化写盘，避免两个定时器同时替换文件
+        self._write_lock = threading.Lock()
+        self._data = {}
+        self._rpc_entries = None
+        self._rpc_groups = None
+        self._timer = None
+        # 最近一次读取的文件无法解析，写盘前需要先备份
+        self._corrupt = False
+        # 有尚未落盘的修改
+        self._dirty = False
+        # 后台写盘连续失败次数
+        self._failures = 0
+
+    def load(self) -> dict:
+        """从文件读取配置，文件不存在或格式错误时抛出异常，内存中保留原来的配置
+
+        文件格式错误时，之后第一次写盘前先把该文件另存为<path>.corrupt，不会被新的配置直接覆盖。
+        """
+        with self._lock:
+            with open(self.path, "r") as f:
+                try:
+                    data = json.load(f)
+                except ValueError:
+                    self._corrupt = True
+                    raise
+            self._data = data
+            self._corrupt = False
+            self._invalidate_rpcs()
+            return dict(self._data)
+
+    def reload(self) -> dict:
+        """先写入尚未落盘的修改，再重新读取文件（用于手动编辑config.json之后）；文件不存在时保持内存中的配置"""
+        self.flush()
+        if not os.path.exists(self.path):
+            return self.snapshot()
+        return self.load()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def snapshot(self) -> dict:
+        """返回当前配置的浅拷贝"""
+        with self._lock:
+            return dict(self._data)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values: dict):
+        """批量修改配置并安排写盘"""
+        with self._lock:
+            self._data.update(values)
+            if any(key.startswith("RPC/") for key in values):
+                self._invalidate_rpcs()
+            self._dirty = True
+            self._failures = 0
+            self._schedule_save()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            if key.startswith("RPC/"):
+                self._invalidate_rpcs()
+            self._dirty = True
+            self._failures = 0
+            self._schedule_save()
+            return value
+
+    def append_unique(self, key, value) -> bool:
+        """向列表类型的配置项追加值（忽略大小写去重），返回是否有修改"""
+        with self._lock:
+            items = list(self._data.get(key, []))
+            if str(value).lower() in [str(item).lower() for item in items]:
+                return False
+            items.append(value)
+            self.set(key, items)
+            return True
+
+    def rpc_entries(self) -> dict:
+        """名称 -> (url, chain_id)"""
+        with self._lock:
+            if self._rpc_entries is None:
+                self._rpc_entries = parse_rpc_entries(self._data)
+            return dict(self._rpc_entries)
+
+    def rpc_groups(self) -> dict:
+        """链ID -> [url, ...]"""
+        with self._lock:
+            if self._rpc_groups is None:
+                self._rpc_groups = group_rpcs_by_chain(self._data)
+            return {chain_id: list(urls) for chain_id, urls in self._rpc_groups.items()}
+
+    def _invalidate_rpcs(self):
+        self._rpc_entries = None
+        self._rpc_groups = None
+
+    def _schedule_save(self, delay=None):
+        """debounce时间内的多次修改只写一次盘（调用方需持有锁）"""
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(self.debounce if delay is None else delay, self._flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """立即写入尚未落盘的修改，写盘失败时抛出异常"""
+        self._flush(raise_errors=True)
+
+    def _flush(self, raise_errors=False):
+        # 先取得写锁再复制数据，保证较新的数据不会被较旧的覆盖
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = dict(self._data)
+                corrupt = self._corrupt
+
+            try:
+                if corrupt and os.path.exists(self.path):
+                    os.replace(self.path, self.path + ".corrupt")
+                with self._lock:
+                    self._corrupt = False
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f, indent=4)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                self._on_save_failed(e)
+                if raise_errors:
+                    raise
+            else:
+                with self._lock:
+                    self._failures = 0
+
+    def _on_save_failed(self, error: Exception):
+        """写盘失败：保留未落盘标记，按指数退避安排重试，超过次数后停止自动重试"""
+        with self._lock:
+            self._dirty = True
+            self._failures += 1
+            failures = self._failures
+            if failures <= self.MAX_RETRIES:
+                delay = min(self.debounce * 2 ** failures, self.MAX_RETRY_DELAY)
+                self._schedule_save(delay)
+        if self.log is None:
+            return
+        if failures <= self.MAX_RETRIES:
+            self.log(f"保存配置失败，{delay:.1f}秒后重试: {str(error)}", "warning")
+        else:
+            self.log(f"保存配置失败，已停止自动重试，下次修改或退出时再保存: {str(error)}", "error")
+
+
+# 进程内共享的配置
+config_store = ConfigStore()
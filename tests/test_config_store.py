@@ -0,0 +1,88 @@
+import json
+import os
+import time
+
+import pytest
+
+from swap_config import ConfigStore
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_updates_within_debounce_are_written_once(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    store = ConfigStore(str(path), debounce=0.05)
+    writes = []
+    real_replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda src, dst: (writes.append(dst), real_replace(src, dst)))
+
+    store.set("rpc", "http://a")
+    store.update({"slippage": "5", "chain_id": "56"})
+    store.pop("rpc")
+    assert not path.exists()
+
+    store.flush()
+    assert writes == [str(path)]
+    assert read_json(path) == {"slippage": "5", "chain_id": "56"}
+    # 没有新的修改时不再写盘
+    store.flush()
+    assert len(writes) == 1
+
+
+def test_background_timer_writes_after_debounce(tmp_path):
+    path = tmp_path / "config.json"
+    store = ConfigStore(str(path), debounce=0.01)
+    store.set("a", 1)
+    deadline = time.time() + 5
+    while not path.exists() and time.time() < deadline:
+        time.sleep(0.01)
+    assert read_json(path) == {"a": 1}
+
+
+def test_corrupt_file_is_kept_and_backed_up_before_first_write(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text('{"api_key": "x", broken')
+    store = ConfigStore(str(path), debounce=60)
+    with pytest.raises(ValueError):
+        store.load()
+
+    store.set("rpc", "http://a")
+    store.flush()
+    assert (tmp_path / "config.json.corrupt").read_text() == '{"api_key": "x", broken'
+    assert read_json(path) == {"rpc": "http://a"}
+
+
+def test_failed_load_keeps_previous_data(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text('{"a": 1}')
+    store = ConfigStore(str(path), debounce=60)
+    store.load()
+    path.write_text("{bad")
+    with pytest.raises(ValueError):
+        store.load()
+    assert store.snapshot() == {"a": 1}
+
+
+def test_background_write_failures_back_off_and_stop(tmp_path):
+    path = tmp_path / "missing" / "config.json"
+    logs = []
+    store = ConfigStore(str(path), debounce=0.001, log=lambda message, level="info": logs.append(level))
+    store.MAX_RETRIES = 2
+    store.MAX_RETRY_DELAY = 0.01
+
+    store.set("a", 1)
+    deadline = time.time() + 5
+    while "error" not in logs and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert logs == ["warning", "warning", "error"]
+
+    # 直接调用flush时抛出异常，目录可写后保存成功
+    with pytest.raises(OSError):
+        store.flush()
+    (tmp_path / "missing").mkdir()
+    store.flush()
+    assert read_json(path) == {"a": 1}
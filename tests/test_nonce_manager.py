@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+
+import pytest
+
+from okx_dex import NonceManager
+
+ADDRESS = "0x00000000000000000000000000000000000000Aa"
+CHAIN_ID = 56
+
+
+class FakeWeb3:
+    """只提供get_transaction_count的Web3替身，记录调用次数"""
+
+    def __init__(self, pending_count):
+        self.pending_count = pending_count
+        self.calls = 0
+        self.eth = SimpleNamespace(get_transaction_count=self._get_transaction_count)
+
+    def _get_transaction_count(self, address, block_identifier):
+        assert block_identifier == "pending"
+        self.calls += 1
+        return self.pending_count
+
+
+def allocate(nonces, w3, count):
+    return [nonces.allocate(w3, CHAIN_ID, ADDRESS) for _ in range(count)]
+
+
+def test_allocate_seeds_once_from_pending_count():
+    nonces = NonceManager()
+    w3 = FakeWeb3(7)
+    assert allocate(nonces, w3, 3) == [7, 8, 9]
+    assert w3.calls == 1
+
+
+def test_allocate_without_web3_before_seed_raises():
+    with pytest.raises(RuntimeError):
+        NonceManager().allocate(None, CHAIN_ID, ADDRESS)
+
+
+def test_address_case_and_chain_id_type_share_state():
+    nonces = NonceManager()
+    w3 = FakeWeb3(0)
+    assert nonces.allocate(w3, CHAIN_ID, ADDRESS) == 0
+    assert nonces.allocate(w3, str(CHAIN_ID), ADDRESS.lower()) == 1
+    assert nonces.allocate(w3, 1, ADDRESS) == 0
+
+
+def test_release_last_nonce_rewinds_counter():
+    nonces = NonceManager()
+    w3 = FakeWeb3(5)
+    allocate(nonces, w3, 2)
+    nonces.release(CHAIN_ID, ADDRESS, 6)
+    assert nonces.allocate(w3, CHAIN_ID, ADDRESS) == 6
+
+
+def test_released_gaps_are_reused_lowest_first():
+    nonces = NonceManager()
+    w3 = FakeWeb3(0)
+    allocate(nonces, w3, 5)
+    nonces.release(CHAIN_ID, ADDRESS, 3)
+    nonces.release(CHAIN_ID, ADDRESS, 1)
+    # 重复归还被忽略
+    nonces.release(CHAIN_ID, ADDRESS, 1)
+    assert allocate(nonces, w3, 4) == [1, 3, 5, 6]
+
+
+def test_release_of_unallocated_or_unseeded_nonce_is_ignored():
+    nonces = NonceManager()
+    nonces.release(CHAIN_ID, ADDRESS, 3)
+    w3 = FakeWeb3(0)
+    allocate(nonces, w3, 2)
+    nonces.release(CHAIN_ID, ADDRESS, 10)
+    assert nonces.allocate(w3, CHAIN_ID, ADDRESS) == 2
+
+
+def test_reset_reseeds_from_chain():
+    nonces = NonceManager()
+    w3 = FakeWeb3(0)
+    allocate(nonces, w3, 3)
+    nonces.release(CHAIN_ID, ADDRESS, 0)
+    nonces.reset(CHAIN_ID, ADDRESS)
+    assert not nonces.is_seeded(CHAIN_ID, ADDRESS)
+    w3.pending_count = 10
+    assert allocate(nonces, w3, 2) == [10, 11]
+    assert w3.calls == 2
+
+
+def test_seed_is_ignored_when_already_seeded():
+    nonces = NonceManager()
+    nonces.seed(CHAIN_ID, ADDRESS, 4)
+    nonces.seed(CHAIN_ID, ADDRESS, 9)
+    assert nonces.allocate(None, CHAIN_ID, ADDRESS) == 4
+
+
+def test_reconcile_resyncs_on_nonce_errors_and_releases_otherwise():
+    nonces = NonceManager()
+    w3 = FakeWeb3(0)
+    allocate(nonces, w3, 3)
+    nonces.reconcile(CHAIN_ID, ADDRESS, 1, ValueError("insufficient funds for gas"))
+    assert nonces.allocate(w3, CHAIN_ID, ADDRESS) == 1
+
+    nonces.reconcile(CHAIN_ID, ADDRESS, 2, ValueError("Nonce too low: next nonce 8"))
+    w3.pending_count = 8
+    assert nonces.allocate(w3, CHAIN_ID, ADDRESS) == 8
@@ -0,0 +1,132 @@
+import queue
+import threading
+
+import pytest
+
+from control_api import OrderQueue
+
+TIMEOUT = 5
+
+
+class BlockingTrader:
+    """每笔订单在handle中等待测试放行，记录开始顺序和同一钱包的并发数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.running = {}
+        self.max_running = {}
+        self.start_events = {}
+        self.release_events = {}
+
+    def events(self, name):
+        with self.lock:
+            if name not in self.start_events:
+                self.start_events[name] = threading.Event()
+                self.release_events[name] = threading.Event()
+            return self.start_events[name], self.release_events[name]
+
+    def handle(self, command, log=None):
+        name = command["name"]
+        wallet = command.get("wallet") or ""
+        started, release = self.events(name)
+        with self.lock:
+            self.started.append(name)
+            self.running[wallet] = self.running.get(wallet, 0) + 1
+            self.max_running[wallet] = max(self.max_running.get(wallet, 0), self.running[wallet])
+        started.set()
+        assert release.wait(TIMEOUT)
+        with self.lock:
+            self.running[wallet] -= 1
+        return {"success": True, "name": name}
+
+
+def make_queue(workers=4, max_pending=100, wallet=None):
+    trader = BlockingTrader()
+    orders = OrderQueue(trader, workers=workers, max_pending=max_pending, wallet=wallet)
+    orders.start()
+    return trader, orders
+
+
+def test_same_wallet_orders_run_one_at_a_time_in_submit_order():
+    trader, orders = make_queue()
+    try:
+        first = orders.submit({"cmd": "sell", "ca": "0x1", "wallet": "a", "name": "a1"})
+        second = orders.submit({"cmd": "buy", "ca": "0x1", "wallet": "a", "name": "a2"})
+        third = orders.submit({"cmd": "sell", "ca": "0x1", "wallet": "a", "name": "a3"})
+        assert trader.events("a1")[0].wait(TIMEOUT)
+        # a1执行中，同一钱包的后续订单不能开始
+        assert not trader.events("a2")[0].wait(0.2)
+
+        trader.events("a1")[1].set()
+        assert first.wait(TIMEOUT)
+        assert trader.events("a2")[0].wait(TIMEOUT)
+        assert not trader.events("a3")[0].wait(0.2)
+        trader.events("a2")[1].set()
+        trader.events("a3")[1].set()
+        assert second.wait(TIMEOUT) and third.wait(TIMEOUT)
+
+        assert trader.started == ["a1", "a2", "a3"]
+        assert trader.max_running["a"] == 1
+        assert orders.status()["pending"] == 0
+        assert orders.status()["busy_wallets"] == 0
+    finally:
+        for name in ("a1", "a2", "a3"):
+            trader.events(name)[1].set()
+        orders.stop()
+
+
+def test_orders_without_wallet_serialize_with_the_default_wallet():
+    trader, orders = make_queue(wallet="a")
+    try:
+        first = orders.submit({"cmd": "sell", "ca": "0x1", "name": "d1"})
+        second = orders.submit({"cmd": "sell", "ca": "0x1", "wallet": "a", "name": "a1"})
+        assert trader.events("d1")[0].wait(TIMEOUT)
+        # 没有指定钱包的订单使用默认钱包a，和显式指定a的订单不能同时执行
+        assert not trader.events("a1")[0].wait(0.2)
+        trader.events("d1")[1].set()
+        trader.events("a1")[1].set()
+        assert first.wait(TIMEOUT) and second.wait(TIMEOUT)
+        assert first.command["wallet"] == "a"
+        assert trader.max_running["a"] == 1
+    finally:
+        for name in ("d1", "a1"):
+            trader.events(name)[1].set()
+        orders.stop()
+
+
+def test_different_wallets_and_queries_run_concurrently():
+    trader, orders = make_queue()
+    try:
+        submitted = [
+            orders.submit({"cmd": "sell", "ca": "0x1", "wallet": "a", "name": "a1"}),
+            orders.submit({"cmd": "sell", "ca": "0x1", "wallet": "b", "name": "b1"}),
+            orders.submit({"cmd": "quote", "ca": "0x1", "wallet": "a", "name": "q1"}),
+        ]
+        # 三笔订单同时处于执行中
+        for name in ("a1", "b1", "q1"):
+            assert trader.events(name)[0].wait(TIMEOUT)
+        for name in ("a1", "b1", "q1"):
+            trader.events(name)[1].set()
+        for order in submitted:
+            assert order.wait(TIMEOUT)
+            assert order.result["success"]
+    finally:
+        for name in ("a1", "b1", "q1"):
+            trader.events(name)[1].set()
+        orders.stop()
+
+
+def test_full_queue_and_invalid_orders_are_rejected():
+    trader, orders = make_queue(workers=1, max_pending=1)
+    try:
+        with pytest.raises(ValueError):
+            orders.submit({"cmd": "withdraw"})
+        with pytest.raises(ValueError):
+            orders.submit({"cmd": "sell"})
+        orders.submit({"cmd": "sell", "ca": "0x1", "name": "s1"})
+        with pytest.raises(queue.Full):
+            orders.submit({"cmd": "sell", "ca": "0x1", "name": "s2"})
+    finally:
+        trader.events("s1")[1].set()
+        orders.stop()
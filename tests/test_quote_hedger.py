@@ -0,0 +1,34 @@
+import threading
+import time
+
+from okx_dex import QuoteHedger
+
+TIMEOUT = 5
+
+
+def test_hedges_when_primary_pool_is_saturated():
+    hedger = QuoteHedger(budget=1.0, default_delay=0.1, max_workers=1, hedge_workers=1)
+    release = threading.Event()
+    # 占满主请求线程池
+    blocker = hedger._pool.submit(release.wait, TIMEOUT)
+    try:
+        start = time.perf_counter()
+        assert hedger.call(lambda: "quote") == "quote"
+        # 主请求一直没能开始执行，对冲请求在对冲延迟后返回，不等待主线程池空出来
+        assert time.perf_counter() - start < 1
+        assert hedger.stats()["hedged"] == 1
+    finally:
+        release.set()
+        blocker.result(TIMEOUT)
+        hedger._pool.shutdown()
+        hedger._hedge_pool.shutdown()
+
+
+def test_fast_primary_is_not_hedged():
+    hedger = QuoteHedger(budget=1.0, default_delay=1, max_workers=1, hedge_workers=1)
+    try:
+        assert hedger.call(lambda: "quote") == "quote"
+        assert hedger.stats() == {"hedged": 0, "quotes": 1, "samples": 1}
+    finally:
+        hedger._pool.shutdown()
+        hedger._hedge_pool.shutdown()